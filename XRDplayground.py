@@ -1,8 +1,9 @@
 import sys, os
-from PyQt5.QtCore import (Qt, pyqtSignal, QRect, QEvent)
-from PyQt5.QtGui import QFont
+from PyQt5.QtCore import (Qt, pyqtSignal, QRect, QEvent, QThread, QTimer, QAbstractTableModel, QModelIndex)
+from PyQt5.QtGui import QFont, QColor
 from PyQt5.QtWidgets import (QApplication, QCheckBox, QGridLayout, QGroupBox, QTabWidget,QMainWindow, QPushButton, QVBoxLayout, 
-                                QHBoxLayout, QWidget, QSlider, QLabel, QLineEdit, QColorDialog, QCheckBox, QFileDialog)
+                                QHBoxLayout, QWidget, QSlider, QLabel, QLineEdit, QColorDialog, QCheckBox, QFileDialog, QTableView, QAbstractItemView, QHeaderView,
+                                QStyle, QStyleOptionSlider)
 import qtawesome as qta
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5 import ToolbarQt
@@ -19,7 +20,10 @@ from matplotlib.backend_tools import ToolBase, ToolToggleBase
 import numpy as np
 import xrayutilities as xu
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
-import colorsys, random, inspect
+import colorsys, random, inspect, threading, time
+from pxrd_engine import PatternEngine, PatternCache, Cancelled, AtomTable
+from pxrd_cif import read_cif, element as cif_element
+from pxrd_store import SweepStore
 
 class Language():
     """ This class is used to give information to the users in their language. There are three options: ['en', 'es', 'br'], for English, Spanish and Brazilian Portuguese. 
@@ -53,7 +57,7 @@ class Language():
                 'hkl_000': 'hkl deve ser diferente de "0 0 0"', 'hkl_inf': 'Entre um HKL para seguir um pico', 'hkl_inf2': '(valor m\u00e1ximo plotado: {max})',
                 'showHKL':'Clique para mostrar/ocultar HKL',
                 'tt_s_uc': 'Clique e arraste para dar "zoom" no cristal', 
-                'addAtoms': 'Adicionar um \u00e1tomo na base', 'remAtoms': 'Remover o \u00faltimo \u00e1tomo da base',
+                'addAtoms': 'Adicionar um \u00e1tomo na base', 'remAtoms': 'Remover os \u00e1tomos selecionados (ou o \u00faltimo) da base',
                 'posx': 'Posi\u00e7\u00e3o x', 'posy': 'Posi\u00e7\u00e3o y', 'posz': 'Posi\u00e7\u00e3o z', 
                 'atomtype': 'Elemento qu\u00cdmico: entre um novo para trocar',
                 'save_for_latter': 'Salvar como valor padr\u00e3o para a pr\u00f3xima vez',
@@ -70,10 +74,14 @@ class Language():
                 'lattice_param_minmax':'Valor {minmax} para o slider deste par\u00e2metro',
                 'atom_size': 'Tamanho do \u00e1tomo (nu\u00famero entre 1 e 10)',
                 'atom_size2': 'o tamanho do \u00e1tomo',
+                'occ': 'Ocup.', 'atm_size': 'Tamanho', 'atm_color': 'Cor',
+                'atom_table': 'Clique duas vezes para editar (na cor, para mud\u00e1-la). Os sliders movem o \u00e1tomo selecionado',
                 'extended_cells': 'Expandir para 8 c\u00e9lulas unit\u00e1rias',
                 'include_edge_atms': 'Incluir \u00e1tomos da borda da c\u00e9lula',
                 'loaddata':'Abrir janela para incluir seus dados de difra\u00e7\u00e3o, no formato "2th vs. Int"',
                 'loaddataproblem': 'N\u00e3o foi poss\u00cdvel carregar os dados, infelizmente. Coloque-os no formato "2th vs. Int" e tente novamente!',
+                'loadcif': 'Abrir uma estrutura de um arquivo CIF', 'loadcifproblem': 'n\u00e3o foi poss\u00cdvel ler este arquivo CIF',
+                'loadsweep': 'Abrir uma varredura de padr\u00f5es guardada em uma pasta', 'loadsweepproblem': 'esta pasta n\u00e3o tem uma varredura de padr\u00f5es',
                 'loadfileproblem': 'n\u00e3o \u00e9 um nome de arquivo v\u00e1lido',
                 'settings':'Mostrar op\u00e7\u00f5es para os dados carregados',
                 'scale': 'Escala',
@@ -97,7 +105,7 @@ class Language():
                 'crysedge': 'Show/hide edge', 'hkl_000': 'hkl should be different from "0 0 0"', 'hkl_inf': 'enter an HKL to follow a peak', 'hkl_inf2': '(maximum plotted value: {max})',
                 'showHKL':'click to show/hide HKL',
                 'tt_s_uc': 'Click and drag to zoom crystal', 'crysface': 'Show/hide crystal faces', 'crysatoms': 'Show/hide atoms',
-                'addAtoms': 'Add one atom into the base', 'remAtoms': 'Remove last atom from base',
+                'addAtoms': 'Add one atom into the base', 'remAtoms': 'Remove the selected atoms (or the last one) from base',
                 'posx': 'x position', 'posy': 'y position', 'posz': 'z position', 
                 'atomtype': 'Atom type: enter a new one to change',
                 'save_for_latter': 'Save as new default value for next time',
@@ -114,10 +122,14 @@ class Language():
                 'lattice_param_minmax':"{minmax} value for this parameter's slider",
                 'atom_size': 'Atom size (number between 1 and 10)',
                 'atom_size2': 'the size of the atom',
+                'occ': 'Occ.', 'atm_size': 'Size', 'atm_color': 'Color',
+                'atom_table': 'Double click to edit (on the color, to change it). The sliders move the selected atom',
                 'extended_cells': 'Expande to 8 unitary cells',
                 'include_edge_atms': 'Include atoms from edge',
                 'loaddata':'Open window to include your diffraction data in "2th vs. Int" format',
                 'loaddataproblem': 'data could not be loaded, sorry. Fix it using "2th vs. Int" format',
+                'loadcif': 'Open a structure from a CIF file', 'loadcifproblem': 'this CIF file could not be read',
+                'loadsweep': 'Open a sweep of patterns stored in a folder', 'loadsweepproblem': 'this folder has no sweep of patterns',
                 'loadfileproblem': 'is not a valid file name',
                 'settings':'Show options for loaded data',
                 'scale': 'Scale',
@@ -141,7 +153,7 @@ class Language():
                 'crysedge': 'Mostrar/ocultar borde', 'hkl_000': 'hkl deve ser diferente de "0 0 0"', 'hkl_inf': 'ingrese un HKL para seguir un pico', 'hkl_inf2': '(valor m\u00e1ximo trazado: {max})',
                 'showHKL':'Haga clic para mostrar/ocultar HKL',
                 'tt_s_uc': 'Haga clic y arrastre para acercar o alejar el cristal', 'crysface': 'Mostrar/ocultar faces', 'crysatoms': 'Mostrar/ocultar \u00e1tomos',
-                'addAtoms': 'A\u00f1adir un \u00e1tomo en la base', 'remAtoms': 'Quitar el \u00faltimo \u00e1tomo de la base',
+                'addAtoms': 'A\u00f1adir un \u00e1tomo en la base', 'remAtoms': 'Quitar los \u00e1tomos seleccionados (o el \u00faltimo) de la base',
                 'posx': 'posici\u00f3n x', 'posy': 'posici\u00f3n y', 'posz': 'posici\u00f3n z', 
                 'atomtype': 'Tipo de \u00e1tomo: ingrese uno nuevo para cambiar',
                 'save_for_latter': 'Guardar como est\00e1ndar para la pr\u00f3xima vez',
@@ -158,10 +170,14 @@ class Language():
                 'lattice_param_minmax':'Valor {minmax} para el control deslizante de este par\u00e1metro',
                 'atom_size': 'Tama\u00f1o del \u00e1tomo (nu\u00famero entre 1 y 10)',
                 'atom_size2': 'el tama\u00f1o del \u00e1tomo',
+                'occ': 'Ocup.', 'atm_size': 'Tama\u00f1o', 'atm_color': 'Color',
+                'atom_table': 'Doble clic para editar (en el color, para cambiarlo). Los sliders mueven el \u00e1tomo seleccionado',
                 'extended_cells': 'Expandir para 8 celdas unitarias',
                 'include_edge_atms': 'A\u00f1adir \u00e1tomos del borde de la celda unitaria',
                 'loaddata':'Abrir una ventana para incluir sus datos de difracci\u00f3n en el formato "2th vs. Int"',
                 'loaddataproblem': 'No fue posible cargar los datos. Col\u00f3quelos en el formato "2th vs int" e int\u00e9ntelo nuevamente',
+                'loadcif': 'Abrir una estructura de un archivo CIF', 'loadcifproblem': 'no fue posible leer este archivo CIF',
+                'loadsweep': 'Abrir un barrido de patrones guardado en una carpeta', 'loadsweepproblem': 'esta carpeta no tiene un barrido de patrones',
                 'loadfileproblem': 'no es un nombre de archivo v\u00e1lido',
                 'settings':'Mostrar opciones para los datos cargados',
                 'scale': 'Amplitud',
@@ -226,10 +242,28 @@ class Defaults():
         self.tth_min = 5
         self.tth_max = 65
         self.tth_step = 0.04
+        # peaks are cut where they fall below this fraction of their maximum
+        self.peak_tol = 1e-6
         # hkl max
         self.h_max = 4
         self.k_max = 4
         self.l_max = 4
+        # Laue class used to merge equivalent HKLs ('auto', 'none' or a class as '4/mmm')
+        self.laue = 'auto'
+        # systematic absences: 'auto' (from the structure), 'none' or the centering of the cell ('P', 'A', 'B', 'C', 'I', 'F' or 'R')
+        self.extinctions = 'auto'
+        # maximum number of redraws per second while dragging the sliders
+        self.fps = 30
+        # while dragging a slider the pattern is a draft: the tth step is multiplied by draft_step, H, K and L go only up to draft_hkl and the peaks are cut at draft_peak_tol
+        self.draft_step = 4
+        self.draft_hkl = 3
+        self.draft_peak_tol = 1e-2
+        # memory (in MB) of the cache of the patterns already calculated, so going back to them is immediate
+        self.cache_mb = 64
+        # while idle, patterns of the positions next to the current one of the slider used last are calculated: how many pixels to each side (0 turns it off),
+        # and the fraction of one CPU it may take
+        self.precompute = 0
+        self.precompute_cpu = 0.5
         # initial energy and energy range
         self.E_ini = 8
         self.E_min = 4
@@ -279,9 +313,19 @@ class Defaults():
         self.default = {'tth_min': self.tth_min, 
                          'tth_max': self.tth_max,
                          'tth_step':self.tth_step,
+                         'peak_tol':self.peak_tol,
                          'h_max':   self.h_max,
                          'k_max':   self.k_max,
                          'l_max':   self.l_max,
+                         'laue':    self.laue,
+                         'extinctions': self.extinctions,
+                         'fps':     self.fps,
+                         'draft_step':      self.draft_step,
+                         'draft_hkl':       self.draft_hkl,
+                         'draft_peak_tol':  self.draft_peak_tol,
+                         'cache_mb':        self.cache_mb,
+                         'precompute':      self.precompute,
+                         'precompute_cpu':  self.precompute_cpu,
                          'E_ini':   self.E_ini,
                          'E_min':   self.E_min,
                          'E_max':   self.E_max,
@@ -322,9 +366,30 @@ class Defaults():
         # 2th range
         list = ["# 2th range", "tth_min = {}".format(self.default['tth_min']), "tth_max = {}".format(self.default['tth_max']), "tth_step = {}".format(self.default['tth_step'])]
         for i in list: lstout.append(i)
+        # peak truncation
+        list = ["# peak truncation", "peak_tol = {}".format(self.default['peak_tol'])]
+        for i in list: lstout.append(i)
         # hkl max
         list = ["# hkl max","h_max = {}".format(self.default['h_max']),"k_max = {}".format(self.default['k_max']),"l_max = {}".format(self.default['l_max'])]
         for i in list: lstout.append(i)
+        # Laue class
+        list = ["# laue class", "laue = {}".format(self.default['laue'])]
+        for i in list: lstout.append(i)
+        # systematic absences
+        list = ["# systematic absences: auto, none or a centering (P, A, B, C, I, F, R)", "extinctions = {}".format(self.default['extinctions'])]
+        for i in list: lstout.append(i)
+        # redraws per second
+        list = ["# redraws per second", "fps = {}".format(self.default['fps'])]
+        for i in list: lstout.append(i)
+        # draft patterns while dragging
+        list = ["# draft while dragging", "draft_step = {}".format(self.default['draft_step']), "draft_hkl = {}".format(self.default['draft_hkl']), "draft_peak_tol = {}".format(self.default['draft_peak_tol'])]
+        for i in list: lstout.append(i)
+        # cache of patterns
+        list = ["# cache of patterns (MB)", "cache_mb = {}".format(self.default['cache_mb'])]
+        for i in list: lstout.append(i)
+        # patterns calculated in advance
+        list = ["# precompute while idle", "precompute = {}".format(self.default['precompute']), "precompute_cpu = {}".format(self.default['precompute_cpu'])]
+        for i in list: lstout.append(i)
         # initial energy and energy range
         list = ["# energy", "E_ini = {}".format(self.default['E_ini']), "E_min = {}".format(self.default['E_min']), "E_max = {}".format(self.default['E_max'])]
         for i in list: lstout.append(i)
@@ -510,6 +575,19 @@ class Icons():
         plt.savefig(name + '.png', dpi=24)
         fig.clf()
 
+        fig, ax = plt.subplots()
+        for axis in ['top','bottom','left','right']: ax.spines[axis].set_linewidth(w*2/3.)
+        ax.xaxis.set_ticks([])
+        ax.yaxis.set_ticks([])
+        for j in range(3): 
+            ax.plot(x, 0.5*j + np.exp((x-n/3.-n*j/6.)*(n/3.+n*j/6.-x)/(2.*n*n/400.)), c = 'k', lw = w/2.)
+        fig.set_size_inches(1,1)
+        name = matplotlib.get_data_path() + r"\images\sweep"
+        self.name.append(name)
+        plt.savefig(name + '_large.png', dpi=48)
+        plt.savefig(name + '.png', dpi=24)
+        fig.clf()
+
 class Freeze(ToolToggleBase):
     """Freeze simulation, creating a new colored curve above the main curve. Used to compare simulations."""
     default_toggled = False
@@ -621,6 +699,52 @@ class Settings_Data(ToolBase):
             self.w1.setGeometry(QRect(100, 100, 315, 5 + noc*30))
             self.w1.show()
         
+class Load_Sweep(ToolBase):
+    """Open a dialog to choose the folder of a stored sweep of patterns, which are then browsed with sliders. """
+    default_keymap = 'w'
+    
+    def __init__(self, *args, xrdp, description, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.xrdp = xrdp
+        self.image = a.name[6]
+        self.description = description
+        
+    def trigger(self, *args, **kwargs):
+        folder = QFileDialog.getExistingDirectory(self.xrdp, self.description)
+        if folder: self.xrdp.open_sweep(folder)
+
+class PopUpSweep(QWidget):
+    """ Window with one slider for each axis of a stored sweep. Only the pattern the sliders point to is read from the disk, and drawn over the simulation """
+    def __init__(self, xrdp, store):
+        QWidget.__init__(self)
+        self.xrdp = xrdp
+        self.store = store
+        self.layout = QGridLayout(self)
+        self.setWindowTitle(os.path.basename(os.path.normpath(store.folder)))
+        self.Labels = []
+        self.Sliders = []
+        for j, name in enumerate(store.names):
+            self.Labels.append(QLabel())
+            self.Labels[j].setFont(QFont(xrdp.font,xrdp.fontsize-2))
+            self.Labels[j].setFixedWidth(150)
+            self.Sliders.append(QSlider(Qt.Horizontal))
+            self.Sliders[j].setRange(0, store.shape[j]-1)
+            self.Sliders[j].valueChanged.connect(self.change)
+            self.layout.addWidget(self.Labels[j],j,0,1,1)
+            self.layout.addWidget(self.Sliders[j],j,1,1,1)
+        self.change()
+
+    def change(self):
+        row = self.store.index(*[i.value() for i in self.Sliders])
+        for label, name, values, slider in zip(self.Labels, self.store.names, self.store.values, self.Sliders):
+            value = values[slider.value()]
+            label.setText('{} = {}'.format(name, '{:g}'.format(value) if np.issubdtype(values.dtype, np.number) else value))
+        self.xrdp.show_sweep(self.store.tth, self.store.pattern(row))
+
+    def closeEvent(self, event):
+        self.xrdp.show_sweep(None, None)
+        super().closeEvent(event)
+
 class PopUpUserDataOpt(QWidget):
     """ Opens a window which permits to change some settings concening the user data and freezed simulations. """
     
@@ -999,6 +1123,8 @@ class PopUpOpt(QWidget):
                 print ('{} is not a valid value'.format(entry_value))
                 self.Entries[who].setText('{}'.format(old_value))
                 return
+        else:
+            value = entry_value.strip()
         
         func(value)
     def save_as_default(self, who):
@@ -1135,6 +1261,237 @@ class Structures():
         a = random.choice(self.structures)
         return Structure(self, a)
 
+class PatternWorker(QThread):
+    """ Thread which calculates the patterns, so the window does not freeze. It has its own engine, and receives snapshots of the inputs (PatternEngine.state()). 
+        Only the latest snapshot matters: older ones waiting are dropped, and a calculation is abandoned (between two nodes of the graph, or between two operations while the symmetry is searched) as soon as a newer one arrives, 
+        or when the window got the latest pattern from its cache (skip). The results are sent back with the signal 'calculated', together with the number of the request. """
+    calculated = pyqtSignal(int, object, object)
+
+    def __init__(self, engine, draft_engine, parent = None):
+        super(PatternWorker, self).__init__(parent)
+        self.engines = {False:engine, True:draft_engine} # the draft engine is used while a slider is dragged, so the caches of the full one are kept
+        for i in self.engines: self.engines[i].graph.interrupt = self.newer
+        self.condition = threading.Condition()
+        self.generation = 0 # number of the latest request
+        self.done = 0 # number of the latest request finished or abandoned
+        self.skipped = -1 # number of the latest request which was not needed
+        self.busy = False
+        self.snapshot = None
+        self.draft = False
+        self.running = True
+
+    def request(self, snapshot, draft = False):
+        """ asks for a new pattern, a draft or the full one. Returns the number of the request """
+        with self.condition:
+            self.generation += 1
+            self.snapshot = snapshot
+            self.draft = draft
+            self.condition.notify()
+            return self.generation
+
+    def skip(self):
+        """ drops the requests not finished yet: the latest pattern did not need to be calculated """
+        with self.condition:
+            self.generation += 1
+            self.snapshot = None
+            self.skipped = self.generation
+
+    def newer(self):
+        """ True when there is a request newer than the one being calculated """
+        return self.snapshot is not None or self.skipped == self.generation
+
+    def idle(self):
+        return self.done == self.generation or (self.skipped == self.generation and not self.busy)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.snapshot is None: self.condition.wait()
+                if not self.running: return
+                snapshot, generation, engine = self.snapshot, self.generation, self.engines[self.draft]
+                self.snapshot = None
+                self.busy = True
+            try:
+                engine.set_state(snapshot)
+                tth, intensity = engine.calculate()
+                self.done = generation
+                self.calculated.emit(generation, tth, intensity)
+            except Cancelled:
+                self.done = generation
+            except Exception as e:
+                self.done = generation
+                print ('problem calculating the pattern:', e)
+            self.busy = False
+
+class Speculator(QThread):
+    """ Thread which fills the cache of patterns while the window is idle, with the positions next to the current one of the slider used last, so dragging it again 
+        finds them ready. Each task is a state of the engine, the axis of the slider (the index of a lattice parameter or 'size') and the values to try. They are calculated 
+        a few at a time with PatternEngine.calculate_lattices, resting in between so the thread takes at most the fraction cpu of one core. Any new request of the 
+        window stops it (cancel). The patterns are sent with the signal 'calculated': number of the request, task, values, tth and an (N, points) array """
+    calculated = pyqtSignal(int, int, object, object, object)
+
+    def __init__(self, engine, cpu = 0.5, chunk = 4, parent = None):
+        super(Speculator, self).__init__(parent)
+        self.engine = engine
+        self.cpu = cpu
+        self.chunk = chunk
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.tasks = None
+        self.running = True
+
+    def request(self, tasks):
+        """ replaces the tasks. Returns the number of the request """
+        with self.condition:
+            self.generation += 1
+            self.tasks = tasks
+            self.condition.notify()
+            return self.generation
+
+    def cancel(self):
+        with self.condition:
+            self.generation += 1
+            self.tasks = None
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.tasks is None: self.condition.wait()
+                if not self.running: return
+                tasks, generation = self.tasks, self.generation
+                self.tasks = None
+            try:
+                self.work(tasks, generation)
+            except Exception as e:
+                print ('problem calculating in advance:', e)
+
+    def work(self, tasks, generation):
+        for task, (state, axis, values) in enumerate(tasks):
+            self.engine.set_state(state)
+            for start in range(0, len(values), self.chunk):
+                begin = time.perf_counter()
+                part = np.array(values[start:start + self.chunk])
+                lattices = np.tile(np.array(state['lattice'], dtype = float), (len(part), 1))
+                if axis != 'size': lattices[:, axis] = part
+                tth, intensities = self.engine.calculate_lattices(lattices, sizes = part if axis == 'size' else None)
+                with self.condition:
+                    if not self.running or generation != self.generation: return
+                    self.calculated.emit(generation, task, part, tth, intensities)
+                    # resting, so only the fraction cpu of the time is spent calculating. A new request wakes it up
+                    self.condition.wait((time.perf_counter() - begin)*(1 - self.cpu)/self.cpu)
+                    if not self.running or generation != self.generation: return
+
+class AtomTableModel(QAbstractTableModel):
+    """ Shows an AtomTable in a QTableView. The view only asks for the rows on the screen, so a cell with hundreds of atoms is fine. The edits are checked and written 
+        in the arrays of the table; then 'edited' is emitted with 'atoms' or 'view' (what Window.update needs to do), or 'rejected' with the header and the text refused. 
+        The position of the first atom is (0,0,0) and can not be edited. """
+    edited = pyqtSignal(str)
+    rejected = pyqtSignal(str, str)
+    limits = {'x':(0, 1), 'y':(0, 1), 'z':(0, 1), 'occupancy':(0, 1), 'B':(0, 100), 'size':(1, 10)}
+
+    def __init__(self, table, headers, element_name, parent = None):
+        super(AtomTableModel, self).__init__(parent)
+        self.table = table
+        self.headers = headers
+        self.element_name = element_name # returns the name of an element or raises KeyError
+
+    def rowCount(self, parent = QModelIndex()):
+        return 0 if parent.isValid() else len(self.table)
+
+    def columnCount(self, parent = QModelIndex()):
+        return 0 if parent.isValid() else len(self.table.columns)
+
+    def headerData(self, section, orientation, role = Qt.DisplayRole):
+        if role != Qt.DisplayRole: return None
+        if orientation == Qt.Horizontal: return self.headers[section]
+        return str(section)
+
+    def data(self, index, role = Qt.DisplayRole):
+        column = self.table.columns[index.column()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            value = self.table.get(index.row(), column)
+            if column == 'color': return ''
+            if column == 'element': return str(value)
+            if column == 'size': return '{:g}'.format(value/100.)
+            if column in ('x', 'y', 'z'): return '{:.3f}'.format(value)
+            return '{:g}'.format(value)
+        if role == Qt.BackgroundRole and column in ('element', 'color'): return QColor(self.table.color[index.row()])
+        if role == Qt.TextAlignmentRole: return int(Qt.AlignCenter)
+        return None
+
+    def flags(self, index):
+        column = self.table.columns[index.column()]
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if column == 'color' or (index.row() == 0 and column in ('x', 'y', 'z')): return flags
+        return flags | Qt.ItemIsEditable
+
+    def setData(self, index, value, role = Qt.EditRole):
+        if role != Qt.EditRole or not index.isValid(): return False
+        column = self.table.columns[index.column()]
+        try:
+            if column == 'element':
+                value = self.element_name(str(value).strip())
+            else:
+                value = float(value)
+                if value < self.limits[column][0] or value > self.limits[column][1]: raise ValueError
+                if column == 'size': value = value*100
+        except (KeyError, ValueError):
+            self.rejected.emit(self.headers[index.column()], str(value))
+            return False
+        self.table.set(index.row(), column, value)
+        self.dataChanged.emit(self.index(index.row(), 0), self.index(index.row(), len(self.table.columns)-1))
+        self.edited.emit('view' if column in ('size', 'color') else 'atoms')
+        return True
+
+    def set_color(self, row, color):
+        """ the color is chosen in a dialog, not typed """
+        self.table.set(row, 'color', color)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.table.columns)-1))
+        self.edited.emit('view')
+
+    def set_position(self, row, i, value):
+        """ called by the sliders of the position of the selected atom """
+        self.table.xyz[row, i] = value
+        self.dataChanged.emit(self.index(row, 1+i), self.index(row, 1+i))
+
+    def append(self, *args, **kwargs):
+        """ includes atoms at the end, with the arguments of AtomTable.append """
+        n = len(args[0])
+        self.beginInsertRows(QModelIndex(), len(self.table), len(self.table)+n-1)
+        self.table.append(*args, **kwargs)
+        self.endInsertRows()
+        self.edited.emit('atoms')
+
+    def load(self, *args, **kwargs):
+        """ replaces all atoms by new ones, with the arguments of AtomTable.append """
+        self.beginResetModel()
+        self.table.remove(np.arange(len(self.table)))
+        self.table.append(*args, **kwargs)
+        self.endResetModel()
+        self.edited.emit('atoms')
+
+    def remove(self, rows):
+        """ removes the atoms of the given rows, but never the first one """
+        rows = sorted(set(i for i in rows if 0 < i < len(self.table)))
+        if not rows: return
+        self.beginResetModel()
+        self.table.remove(rows)
+        self.endResetModel()
+        self.edited.emit('atoms')
+
 class Window(QMainWindow,QWidget):
     """ Main window class"""
 
@@ -1168,14 +1525,30 @@ class Window(QMainWindow,QWidget):
 
         self.setWindowTitle("XRD Playground - version 1.0.2 2024-10-04")
 
-        self.include_base()
-        
-        self.update(ul=True, xpd = True, en = True)
+        self.update()
 
         self.rescale()
         
         self.update_arrow()
 
+        self.start_worker()
+
+    def start_worker(self):
+        """ from now on, the patterns are calculated in another thread """
+        self.worker = PatternWorker(PatternEngine(E_min = self.E_min, E_max = self.E_max), PatternEngine(E_min = self.E_min, E_max = self.E_max))
+        self.cache_keys = {} # key of the cache of each request still waiting for its pattern
+        self.worker.calculated.connect(self.xpd_calculated)
+        self.worker.start()
+        self.speculator = Speculator(PatternEngine(E_min = self.E_min, E_max = self.E_max), self.precompute_cpu)
+        self.speculator.calculated.connect(self.speculated)
+        self.speculator.start(QThread.LowPriority)
+
+    def closeEvent(self, event):
+        if self.worker is not None: 
+            self.worker.stop()
+            self.speculator.stop()
+        super(Window, self).closeEvent(event)
+
     def loadInitialParameters(self):
         # importing defaults
         self.inis = self.default.loadDefault()
@@ -1183,8 +1556,37 @@ class Window(QMainWindow,QWidget):
         # loading default values from file
         self.loadDefaultValues_from_file()
         
+        # the calculation of the pattern, which does not depend on the widgets
+        self.engine = PatternEngine(E_min = self.E_min, E_max = self.E_max, E = self.E, D = self.D, peak_tol = self.peak_tol)
+        # the Laue class and the absences of pxrd.defaults must be known to the engine, or the defaults are used (like the language)
+        if self.laue not in ['auto', 'none'] + list(self.engine.symmetry.laue_classes.keys()):
+            print ('Laue class "{}" not implemented, only auto, none or one of {}, switching to {}'.format(self.laue, ', '.join(self.engine.symmetry.laue_classes.keys()), self.default.default['laue']))
+            self.laue = self.default.default['laue']
+        # only the centering of the cell can be given as absences: glide planes and screw axes are found with 'auto'
+        if self.extinctions not in ['auto', 'none'] + list(self.engine.symmetry.centerings.keys()):
+            print ('absences "{}" not implemented, only auto, none or a centering ({}), switching to {}'.format(self.extinctions, ', '.join(self.engine.symmetry.centerings.keys()), self.default.default['extinctions']))
+            self.extinctions = self.default.default['extinctions']
+        self.engine.set_laue(self.laue)
+        self.engine.set_extinctions(self.extinctions)
+        self.elements = self.engine.elements
+        self.pattern_cache = PatternCache(int(self.cache_mb*2**20))
+        # calculation in advance of the patterns next to the slider used last
+        self.active_slider = None
+        self.speculation = None
+        self.speculate_timer = QTimer()
+        self.speculate_timer.setSingleShot(True)
+        self.speculate_timer.timeout.connect(self.speculate)
+        self.worker = None
+        self.rescale_pending = False
+        # changes of the sliders waiting for the next frame
+        self.pending_changes = set()
+        self.last_redraw = 0.
+        self.redraw_timer = QTimer()
+        self.redraw_timer.setSingleShot(True)
+        self.redraw_timer.timeout.connect(self.flush)
+        self.dragging = False
+        
         # things related to tth step and range
-        self.Fhkl = {}
         self.calc_QiQf()
         self.create_tth_range()
         
@@ -1196,26 +1598,6 @@ class Window(QMainWindow,QWidget):
         self.old_HKL_L = 0
         
         # things related to the base atoms
-        self.additional_atoms = 0
-        self.AddAtoms_label_At = {}
-        self.AddAtoms_label_x = {}
-        self.AddAtoms_label_y = {}
-        self.AddAtoms_label_z = {}
-        self.AddAtoms_label_pos_x = {}
-        self.AddAtoms_label_pos_y = {}
-        self.AddAtoms_label_pos_z = {}
-        self.AddAtoms_slider_x = {}
-        self.AddAtoms_slider_y = {}
-        self.AddAtoms_slider_z = {}
-        self.AddAtoms_entry_At = {}
-        self.AddAtoms_entry_At_size = {}
-        self.AddAtoms_color = {}
-        self.AddAtoms_entry_pos_x = {}
-        self.AddAtoms_entry_pos_y = {}
-        self.AddAtoms_entry_pos_z = {}
-        self.AddAtoms_groupBox = {}
-        self.AddAtoms_groupBox_layout = {}        
-        self.Atom_types = {}
         
         # geometry proposed
         self.ini_w = 1280
@@ -1260,6 +1642,8 @@ class Window(QMainWindow,QWidget):
         
         # vars needed when loading a file by the user
         self.userdata_dict = {}
+        # window of a stored sweep, if one is open
+        self.w_sweep = None
         
         # colors for the atoms, when the structure is not an existing one
         self.colors = [self.gray, self.blue_dark, self.green_dark, self.orange, self.sl_col_1, self.bluemagenta, self.yellow, self.cyan, self.magenta]
@@ -1307,46 +1691,51 @@ class Window(QMainWindow,QWidget):
         self.tth_min = float(self.inis['tth_min'])
         self.tth_max = float(self.inis['tth_max'])
         self.tth_step = float(self.inis['tth_step'])
+        self.peak_tol = float(self.inis.get('peak_tol', self.default.default['peak_tol']))
         # initial H K L maximum values
         self.h_max = int(float(self.inis['h_max']))
         self.k_max = int(float(self.inis['k_max']))
         self.l_max = int(float(self.inis['l_max']))
+        # Laue class used to merge equivalent HKLs
+        self.laue = self.inis.get('laue', self.default.default['laue'])
+        # systematic absences removed before any calculation
+        self.extinctions = self.inis.get('extinctions', self.default.default['extinctions'])
+        # maximum number of redraws per second while dragging the sliders
+        self.fps = float(self.inis.get('fps', self.default.default['fps']))
+        # draft patterns while a slider is dragged
+        self.draft_step = int(float(self.inis.get('draft_step', self.default.default['draft_step'])))
+        self.draft_hkl = int(float(self.inis.get('draft_hkl', self.default.default['draft_hkl'])))
+        self.draft_peak_tol = float(self.inis.get('draft_peak_tol', self.default.default['draft_peak_tol']))
+        # cache of the patterns already calculated
+        self.cache_mb = float(self.inis.get('cache_mb', self.default.default['cache_mb']))
+        # patterns calculated in advance while idle
+        self.precompute = int(float(self.inis.get('precompute', self.default.default['precompute'])))
+        self.precompute_cpu = float(self.inis.get('precompute_cpu', self.default.default['precompute_cpu']))
         
     def loadRandomStructure(self):
         '''This function loads a random structure from a pool when opening the program'''
         self.structure = Structures().getRandom()
-        self.color_init = self.structure.colors
-        self.pos_x_init = np.array(self.structure.positions).T[0]
-        self.pos_y_init = np.array(self.structure.positions).T[1]
-        self.pos_z_init = np.array(self.structure.positions).T[2]
         self.baseAtoms = self.structure.baseAtoms
-        self.sizes_init = self.structure.sizes
+        self.atoms = AtomTable()
+        self.atoms.append([self.elements.get(i).name for i in self.baseAtoms], self.structure.positions, size = self.structure.sizes, color = self.structure.colors)
         self.par0 = {   'a': self.structure.lattice[0],
                         'b': self.structure.lattice[1],
                         'c': self.structure.lattice[2],
                         'alpha':self.structure.lattice[3],
                         'beta': self.structure.lattice[4],
                         'gamma':self.structure.lattice[5]}
-        self.Atom_types.update({0:self.baseAtoms[0]})
-        self.color_atom0 = self.color_init[0]
         
     def loadStructureFromDefault(self):
         """ This fucntion was necessary in the past, but I believe it is not anymore. It was substituted by the loading of the random structure """
-        self.Atom_types.update({0:self.baseAtoms[0]})
-        self.color_init = self.colors
-        self.pos_x_init = self.baseAtoms_positions.T[0]
-        self.pos_y_init = self.baseAtoms_positions.T[1]
-        self.pos_z_init = self.baseAtoms_positions.T[2]
-        self.sizes_init = self.baseAtoms_sizes
-        self.last_atom = self.baseAtoms[-1]
-        self.last_atom_size = self.baseAtoms_sizes[-1]
+        colors = [self.blue] + [self.colors[i%len(self.colors)] for i in range(1, len(self.baseAtoms))]
+        self.atoms = AtomTable()
+        self.atoms.append([self.elements.get(i).name for i in self.baseAtoms], self.baseAtoms_positions, size = self.baseAtoms_sizes, color = colors)
         self.par0 = {   'a': float(self.inis['a_ini']),  
                         'b': float(self.inis['b_ini']),  
                         'c':float(self.inis['c_ini']),  
                         'alpha':float(self.inis['alpha_ini']),  
                         'beta':float(self.inis['beta_ini']),  
                         'gamma':float(self.inis['gamma_ini'])}
-        self.color_atom0 = self.blue
 
 
     # lists and updates
@@ -1357,15 +1746,12 @@ class Window(QMainWindow,QWidget):
         
     def create_tth_range(self):  
         """Just create a tth range based on tth minimum and maximum"""
-        self.tth_range =  np.arange (self.tth_min,self.tth_max,self.tth_step)
+        self.engine.set_grid(self.tth_min, self.tth_max, self.tth_step)
+        self.tth_range = self.engine.get('tth_range')
         
     def create_list_of_hkl(self):
-        """ creates a list of HKLs based on the maximum values for them. """
-        self.list_of_hkl = []
-        for h in range (-self.h_max,self.h_max+1):
-            for k in range (-self.k_max,self.k_max+1):
-                for l in range (-self.l_max,self.l_max+1):
-                    if not ( h == 0 and k == 0 and l == 0): self.list_of_hkl.append([h,k,l])
+        """ creates the list of HKLs of the engine based on the maximum values for them. """
+        self.engine.set_hkl_max(self.h_max, self.k_max, self.l_max)
 
 
 
@@ -1486,22 +1872,29 @@ class Window(QMainWindow,QWidget):
         self.XPDFigure, self.pXRDax = plt.subplots()
         plt.subplots_adjust(left=0.08,right=0.98, bottom=0.08, top=0.98)
         
-        self.main_plot, = self.pXRDax.plot (self.tth_range,self.intensity, 'ko-',lw = 2.5, markersize = 4)
+        self.main_plot, = self.pXRDax.plot (self.tth_range,self.intensity, 'ko-',lw = 2.5, markersize = 4, animated = True)
         self.colored_plots = []
         for i in ['r','g','b']:
             a, = self.pXRDax.plot (self.tth_range,self.intensity, '{}o-'.format(i),lw = 1.2, markersize = 2)
             a.set_visible(False)
             a.scale = 1.
             self.colored_plots.append(a)
+        # pattern of a stored sweep, chosen with the sliders of PopUpSweep
+        self.sweep_plot, = self.pXRDax.plot([], [], 'mo-', lw = 1.2, markersize = 2, animated = True)
+        self.sweep_plot.set_visible(False)
             
         self.define_pXRDax_limits()
         #self.pXRDax.set_xlim(self.tth_min-5,self.tth_max+5)
         
-        self.hkl_text = self.pXRDax.text(5, 5, '')
-        self.line, = self.pXRDax.plot([0,0],[0,0], 'r--', lw = 1)
+        self.hkl_text = self.pXRDax.text(5, 5, '', animated = True)
+        self.line, = self.pXRDax.plot([0,0],[0,0], 'r--', lw = 1, animated = True)
+        self.arrow_ = None
         
         # Canvas Widget that displays the `figure`; it takes the `figure` instance as a parameter to its __init__
         self.XPDcanvas = FigureCanvas(self.XPDFigure) 
+        # the main curve, the arrow and the HKL text are animated: they are blitted over a copy of the rest of the figure
+        self.XPDbackground = None
+        self.XPDcanvas.mpl_connect('draw_event', self.pXRD_drawn)
         
         # Navigation widget; it takes the Canvas widget and a parent
         self.tool_manager = ToolManager(self.XPDFigure)
@@ -1518,6 +1911,54 @@ class Window(QMainWindow,QWidget):
         
         return self.pXRDFigure_groupBox
 
+    def pXRD_animated(self):
+        """ the artists which change with the sliders """
+        artists = [self.main_plot, self.sweep_plot, self.line, self.hkl_text]
+        if self.arrow_ is not None: artists.append(self.arrow_)
+        return artists
+
+    def pXRD_view(self):
+        """ the limits and the size of the figure. The background copy is only valid while they stay the same """
+        return self.pXRDax.get_xlim(), self.pXRDax.get_ylim(), self.XPDcanvas.get_width_height()
+
+    def pXRD_drawn(self, event):
+        """ called after every full draw of the figure (limits, resize, frozen curves, user data...). Keeps a copy of it without the animated artists and then draws them """
+        self.XPDbackground = self.XPDcanvas.copy_from_bbox(self.XPDFigure.bbox)
+        self.XPDbackground_view = self.pXRD_view()
+        for i in self.pXRD_animated(): self.pXRDax.draw_artist(i)
+
+    def blit_pXRD(self):
+        """ draws only the main curve, the arrow and the HKL text over the copy of the figure. If the copy is missing or old, the whole figure is drawn """
+        if self.XPDbackground is None or self.XPDbackground_view != self.pXRD_view():
+            self.XPDcanvas.draw_idle()
+            return
+        self.XPDcanvas.restore_region(self.XPDbackground)
+        for i in self.pXRD_animated(): self.pXRDax.draw_artist(i)
+        self.XPDcanvas.blit(self.XPDFigure.bbox)
+
+    def open_sweep(self, folder):
+        """ opens a stored sweep (see pxrd_store) in a window where its patterns are chosen with sliders """
+        try:
+            store = SweepStore(folder)
+        except (OSError, ValueError, KeyError):
+            text = '{}: {}'.format(os.path.basename(os.path.normpath(folder)), self.l.what['loadsweepproblem'])
+            self.Update_Info_label(text = text, bkg = self.red)
+            return
+        if self.w_sweep is not None: self.w_sweep.close()
+        self.w_sweep = PopUpSweep(self, store)
+        self.w_sweep.setGeometry(QRect(100, 100, 400, 30 + 30*len(store.names)))
+        self.w_sweep.show()
+
+    def show_sweep(self, tth, intensity):
+        """ draws a pattern of a stored sweep over the simulation, or hides it if intensity is None """
+        if intensity is None:
+            self.w_sweep = None
+            self.sweep_plot.set_visible(False)
+        else:
+            self.sweep_plot.set_data(tth, intensity)
+            self.sweep_plot.set_visible(True)
+        self.blit_pXRD()
+
     def define_pXRDax_limits(self):
         """ set the ax limits"""
         self.pXRDax.set_xlim(self.tth_min-5,self.tth_max+5)
@@ -1539,6 +1980,8 @@ class Window(QMainWindow,QWidget):
         self.XPDtoolbar.add_tool('LoadData','mydata', 0)
         self.tool_manager.add_tool('Settings', Settings_Data, xrdp = self, description = self.l.what['settings'], func = self.settings_user_data_preparation)
         self.XPDtoolbar.add_tool('Settings','mydata', 0)
+        self.tool_manager.add_tool('LoadSweep', Load_Sweep, xrdp = self, description = self.l.what['loadsweep'])
+        self.XPDtoolbar.add_tool('LoadSweep','mydata', 0)
         
         self.include_HKL()
         self.include_settings_graph()
@@ -1616,7 +2059,7 @@ class Window(QMainWindow,QWidget):
 
             else:
                 self.old_HKL_H = val_
-                self.update(ul=False, xpd = True, en = False)
+                self.update('view')
         except:
             text = '"{}" {} {}'.format(val, self.l.what['problem_a'], 'H')
             self.Update_Info_label(text = text, bkg = self.red)
@@ -1637,7 +2080,7 @@ class Window(QMainWindow,QWidget):
                 self.le_K.setText(str(self.old_HKL_K))
             else:
                 self.old_HKL_K = val_
-                self.update(ul=False, xpd = True, en = False)
+                self.update('view')
         except:
             text = '"{}" {} {}'.format(val, self.l.what['problem_a'], 'K')
             self.Update_Info_label(text = text, bkg = self.red)
@@ -1658,7 +2101,7 @@ class Window(QMainWindow,QWidget):
                 self.le_L.setText(str(self.old_HKL_L))
             else:
                 self.old_HKL_L = val_
-                self.update(ul=False, xpd = True, en = False)
+                self.update('view')
         except:
             text = '"{}" {} {}'.format(val, self.l.what['problem_a'],'L')
             self.Update_Info_label(text = text, bkg = self.red)
@@ -1677,7 +2120,8 @@ class Window(QMainWindow,QWidget):
             self.arrow_.remove()
         except:
             pass
-        arrow = Arrow(_2theta,ymax*0.93,0,-ymax*0.09, color="#aa0088")
+        self.arrow_ = None
+        arrow = Arrow(_2theta,ymax*0.93,0,-ymax*0.09, color="#aa0088", animated = True)
         if self.showHKL_check.isChecked():
             self.arrow_ = self.pXRDax.add_patch(arrow)
             self.line.set_data([_2theta, _2theta], [0, ymax*0.77])
@@ -1689,70 +2133,96 @@ class Window(QMainWindow,QWidget):
 
     def check_showHKL_TF(self):
         """ check if the HKL arrow and plane will be shown or not """
-        self.update(ul=False, xpd = True, en = False)
-        if self.showHKL_check.isChecked(): self.calc_HKL_planes()
+        self.update('view')
         
     def settings_graph(self):
         """ function that opens a window where the user can change some parameters and default values for future uses of the application"""
         self.graph_options = { 'tth_min':self.tth_min, 
                     'tth_max':self.tth_max, 
                     'tth_step':self.tth_step,
+                    'peak_tol':self.peak_tol,
                     'h_max': self.h_max,
                     'k_max': self.k_max,
-                    'l_max': self.l_max}
+                    'l_max': self.l_max,
+                    'laue': self.laue,
+                    'extinctions': self.extinctions}
         self.graph_functions = {   'tth_min':  self.set_tth_min,
                         'tth_max':  self.set_tth_max,
                         'tth_step': self.set_tth_step,
+                        'peak_tol': self.set_peak_tol,
                         'h_max':    self.set_h_max,
                         'k_max':    self.set_k_max,
-                        'l_max':    self.set_l_max}
+                        'l_max':    self.set_l_max,
+                        'laue':     self.set_laue,
+                        'extinctions':  self.set_extinctions}
         self.graph_names = {   'tth_min':'2\u03b8 min', 
                     'tth_max':'2\u03b8 max', 
                     'tth_step':'2\u03b8 step',
+                    'peak_tol':'peak tol',
                     'h_max': 'H max ',
                     'k_max': 'K max ',
-                    'l_max': 'L max '}
+                    'l_max': 'L max ',
+                    'laue': 'Laue',
+                    'extinctions': 'absences'}
         self.graph_tooltips = {'tth_min':"minimum 2\u03b8 value for calculation", 
                     'tth_max':"maximum 2\u03b8 value for calculation", 
                     'tth_step':"2\u03b8 step (warning: increases calc time)",
+                    'peak_tol':"peaks are cut where they fall below this fraction of their maximum (warning: smaller values increase calc time)",
                     'h_max': "\u00b1H for peak calculation (warning: increases calc time a lot!)",
                     'k_max': "\u00b1K for peak calculation (warning: increases calc time a lot!)",
-                    'l_max': "\u00b1L for peak calculation (warning: increases calc time a lot!)"}
+                    'l_max': "\u00b1L for peak calculation (warning: increases calc time a lot!)",
+                    'laue': "Laue class used to merge equivalent HKLs: 'auto' (found from the structure), 'none' or one of " + ", ".join(self.engine.symmetry.laue_classes.keys()),
+                    'extinctions': "systematically absent HKLs, which are not calculated: 'auto' (found from the structure, with its glide planes and screw axes), 'none' or the centering of the cell, one of " + ", ".join(self.engine.symmetry.centerings.keys())}
         self.graph_types = { 'tth_min':'float', 
                     'tth_max':'float',
                     'tth_step':'float',
+                    'peak_tol':'float',
                     'h_max': 'int',
                     'k_max': 'int',
-                    'l_max': 'int'}
+                    'l_max': 'int',
+                    'laue': 'str',
+                    'extinctions': 'str'}
         graph_min_lims = {  'tth_min':0, 
                             'tth_max':self.tth_min,
                             'tth_step':0,
+                            'peak_tol':1e-12,
                             'h_max': 0,
                             'k_max': 0,
-                            'l_max': 0}
+                            'l_max': 0,
+                            'laue': None,
+                            'extinctions': None}
         graph_max_lims = {  'tth_min':self.tth_max, 
                             'tth_max':180,
                             'tth_step':1,
+                            'peak_tol':0.5,
                             'h_max': 20,
                             'k_max': 20,
-                            'l_max': 20}
+                            'l_max': 20,
+                            'laue': None,
+                            'extinctions': None}
         color = {           'tth_min':self.magenta_light, 
                             'tth_max':self.magenta_light,
                             'tth_step':self.magenta_light,
+                            'peak_tol':self.magenta_light,
                             'h_max':self.magenta_light,
                             'k_max':self.magenta_light,
-                            'l_max':self.magenta_light 
+                            'l_max':self.magenta_light,
+                            'laue':self.magenta_light,
+                            'extinctions':self.magenta_light
                             }
         save =              {'tth_min':True, 
                             'tth_max':True,
                             'tth_step':True,
+                            'peak_tol':True,
                             'h_max':True,
                             'k_max':True,
-                            'l_max':True
+                            'l_max':True,
+                            'laue':True,
+                            'extinctions':True
                             }
         title = "Graph Options"
         self.w1 = PopUpOpt(self, self.graph_options, self.graph_functions, self.graph_names, self.graph_tooltips, self.graph_types, graph_min_lims, graph_max_lims, color, title, save)
-        self.w1.setGeometry(QRect(100, 100, 200, 200))
+        self.w1.setGeometry(QRect(100, 100, 200, 260))
         self.w1.show()
 
     def set_tth_min(self, tth_min):
@@ -1760,8 +2230,8 @@ class Window(QMainWindow,QWidget):
         self.tth_min = tth_min
         self.create_tth_range()
         self.calc_QiQf()
-        self.update(ul=True, from_opts = True)
-        self.define_pXRDax_limits()
+        self.define_pXRDax_limits() # before the update, which may blit a pattern from the cache at once
+        self.update('grid')
         return self.tth_min
         
     def set_tth_max(self, tth_max):
@@ -1769,38 +2239,69 @@ class Window(QMainWindow,QWidget):
         self.tth_max = tth_max
         self.create_tth_range()
         self.calc_QiQf()
-        self.update(ul=True, from_opts = True)
-        self.define_pXRDax_limits()
+        self.define_pXRDax_limits() # before the update, which may blit a pattern from the cache at once
+        self.update('grid')
         return self.tth_max
         
     def set_tth_step(self, tth_step):
         """ function that changes the atep for tth, and associated parameters"""
         self.tth_step = tth_step
         self.create_tth_range()
-        self.update(ul=True, from_opts = True)
+        self.update('grid')
         return self.tth_step
         
+    def set_peak_tol(self, peak_tol):
+        """ function that changes the fraction of the maximum below which the peaks are not calculated anymore """
+        self.peak_tol = peak_tol
+        self.engine.set_peak_tol(peak_tol)
+        self.update('peak_tol')
+        return self.peak_tol
+        
     def set_h_max (self, h_max):
         """ set the maximum value for H used in the simulations """
         self.h_max = h_max
         self.create_list_of_hkl()
-        self.update(ul=True)
+        self.update('hkl_max')
         return self.h_max
         
     def set_k_max (self, k_max):
         """ set the maximum value for K used in the simulations """
         self.k_max = k_max
         self.create_list_of_hkl()
-        self.update(ul=True)
+        self.update('hkl_max')
         return self.k_max
         
     def set_l_max (self, l_max):
         """ set the maximum value for L used in the simulations """
         self.l_max = l_max
         self.create_list_of_hkl()
-        self.update(ul=True)
+        self.update('hkl_max')
         return self.l_max
 
+    def set_laue(self, laue):
+        """ set the Laue class used to merge equivalent HKLs """
+        if laue not in ['auto', 'none'] + list(self.engine.symmetry.laue_classes.keys()):
+            text = '"{}" {} {}'.format(laue, self.l.what['problem_a'], 'Laue')
+            self.Update_Info_label(text = text, bkg = self.red)
+            self.w1.Entries['laue'].setText(self.laue)
+            return self.laue
+        self.laue = laue
+        self.engine.set_laue(laue)
+        self.update('laue')
+        return self.laue
+
+    def set_extinctions(self, extinctions):
+        """ set the rules of the systematic absences: the HKLs they remove are not calculated """
+        if extinctions not in ['auto', 'none'] + list(self.engine.symmetry.centerings.keys()):
+            text = '"{}" {} {}'.format(extinctions, self.l.what['problem_a'], 'absences')
+            self.Update_Info_label(text = text, bkg = self.red)
+            self.w1.Entries['extinctions'].setText(self.extinctions)
+            return self.extinctions
+        self.extinctions = extinctions
+        self.engine.set_extinctions(extinctions)
+        self.update('extinctions')
+        return self.extinctions
+
     def settings_user_data_preparation(self):
         """this function helps to open the dialog for including the user data  """
         noc = len(list(self.userdata_dict.keys()))
@@ -1861,6 +2362,8 @@ class Window(QMainWindow,QWidget):
             self. LatticeParams_slider[i].setSingleStep(1)
             self. LatticeParams_slider[i].setTickPosition(QSlider.NoTicks)
             self. LatticeParams_slider[i].valueChanged.connect(self.par_slider_change[i])
+            self. LatticeParams_slider[i].sliderPressed.connect(self.slider_pressed)
+            self. LatticeParams_slider[i].sliderReleased.connect(self.slider_released)
             self. LatticeParams_slider[i].setToolTip(self.l.what['tt_s_pars'])
 
             self.LatticeParams_entry.update({i:QLineEdit(str(self.par0[i]))})
@@ -1885,74 +2388,74 @@ class Window(QMainWindow,QWidget):
         """ function called when button a is clicked"""
         self. LatticeParams_slider['a'].setValue(self.par0['a'])
         self. LatticeParams_entry['a'].setText(str(self. LatticeParams_slider['a'].value()))
-        self.update(ul=True, en = False)
+        self.update('lattice')
         
     def button_b (self): 
         """ function called when button B is clicked"""
         self. LatticeParams_slider['b'].setValue(self.par0['b'])
         self. LatticeParams_entry['b'].setText(str(self. LatticeParams_slider['b'].value()))
-        self.update(ul=True, en = False)
+        self.update('lattice')
         
     def button_c (self): 
         """ function called when button c is clicked"""
         self. LatticeParams_slider['c'].setValue(self.par0['c'])
         self. LatticeParams_entry['c'].setText(str(self. LatticeParams_slider['c'].value()))
-        self.update(ul=True, en = False)
+        self.update('lattice')
         
     def button_alpha (self): 
         """ function called when button alpha is clicked"""
         self. LatticeParams_slider['alpha'].setValue(self.par0['alpha'])
         self. LatticeParams_entry['alpha'].setText(str(self. LatticeParams_slider['alpha'].value()))
-        self.update(ul=True, en = False)
+        self.update('lattice')
         
     def button_beta  (self): 
         """ function called when button beta is clicked"""
         self. LatticeParams_slider['beta'].setValue(self.par0['beta'])
         self. LatticeParams_entry['beta'].setText(str(self. LatticeParams_slider['beta'].value()))
-        self.update(ul=True, en = False)
+        self.update('lattice')
         
     def button_gamma (self): 
         """ function called when button gamma is clicked"""
         self. LatticeParams_slider['gamma'].setValue(self.par0['gamma'])
         self. LatticeParams_entry['gamma'].setText(str(self. LatticeParams_slider['gamma'].value()))
-        self.update(ul=True, en = False)
+        self.update('lattice')
         
     def slider_a (self): 
         """ function called when slider a is changed"""
         self.LatticeParams_entry['a'].setText(str(self.LatticeParams_slider['a'].value()))
-        self.update(ul=True, en = False)
+        self.schedule('lattice')
         
     def slider_b (self): 
         """ function called when slider b is changed"""
         self.LatticeParams_entry['b'].setText(str(self. LatticeParams_slider['b'].value()))
-        self.update(ul=True, en = False)
+        self.schedule('lattice')
         
     def slider_c (self): 
         """ function called when slider c is changed"""
         self.LatticeParams_entry['c'].setText(str(self. LatticeParams_slider['c'].value()))
-        self.update(ul=True, en = False)
+        self.schedule('lattice')
         
     def slider_alpha (self): 
         """ function called when slider alpha is changed"""
         self.LatticeParams_entry['alpha'].setText(str(self. LatticeParams_slider['alpha'].value()))
-        self.update(ul=True, en = False)
+        self.schedule('lattice')
         
     def slider_beta  (self): 
         """ function called when slider beta is changed"""
         self.LatticeParams_entry['beta'].setText(str(self. LatticeParams_slider['beta'].value()))
-        self.update(ul=True, en = False)
+        self.schedule('lattice')
         
     def slider_gamma (self): 
         """ function called when slider gamma is changed"""
         self.LatticeParams_entry['gamma'].setText(str(self. LatticeParams_slider['gamma'].value()))
-        self.update(ul=True, en = False)
+        self.schedule('lattice')
         
     def update_sliders(self, par): 
         """ function called when edit boxes texts are changed"""
         val = self.LatticeParams_entry[par].text()
         try:
             self.LatticeParams_slider[par].setValue(float(val))
-            self.update(ul=True, en = False)
+            self.update('lattice')
         except:
             text = '"{}" {} {}'.format(val, self.l.what['problem_a'], self.l.what[par])
             self.Update_Info_label(text = text, bkg = self.red)
@@ -1986,6 +2489,8 @@ class Window(QMainWindow,QWidget):
         self.E_slider.setValue(self.E)
         self.E_slider.setTickPosition(QSlider.NoTicks)
         self.E_slider.valueChanged.connect(self.E_slider_change)
+        self.E_slider.sliderPressed.connect(self.slider_pressed)
+        self.E_slider.sliderReleased.connect(self.slider_released)
         self.E_slider.setToolTip(self.l.what['tt_s_pars'])
 
         self.Wvl_slider = DoubleSlider(4,Qt.Horizontal)
@@ -1995,6 +2500,8 @@ class Window(QMainWindow,QWidget):
         self.Wvl_slider.setValue(12.398/self.E)
         self.Wvl_slider.setTickPosition(QSlider.NoTicks)
         self.Wvl_slider.valueChanged.connect(self.Wvl_slider_change)
+        self.Wvl_slider.sliderPressed.connect(self.slider_pressed)
+        self.Wvl_slider.sliderReleased.connect(self.slider_released)
         self.Wvl_slider.setToolTip(self.l.what['tt_s_pars'])
 
         self.E_entry = QLineEdit()
@@ -2038,7 +2545,7 @@ class Window(QMainWindow,QWidget):
         self.E_slider.setValue(self.E)
         self.Wvl_slider.setValue(12.398/self.E)
         self.updateQs()
-        self.update(ul=True, en = True)
+        self.update('energy')
 
     def E_slider_change(self):
         """ function called when the energy slider is changed"""
@@ -2046,7 +2553,7 @@ class Window(QMainWindow,QWidget):
         self.E_entry.setText('{: 5.2f}'.format(self.E))
         self.Wvl_entry.setText('{: 5.2f}'.format(12.398/self.E))
         self.Wvl_slider.setValue(12.398/self.E)
-        self.update(ul=True, en = True)
+        self.schedule('energy')
 
     def Wvl_slider_change(self):
         """ function called when the wavelength slider is changed"""
@@ -2055,7 +2562,7 @@ class Window(QMainWindow,QWidget):
         self.E_entry.setText('{: 5.2f}'.format(self.E))
         self.E_slider.setValue(12.398/self.Wvl)
         self.updateQs()
-        self.update(ul=True, en = True)
+        self.schedule('energy')
 
     def E_update_slider(self):
         """function called when entering a new value in energy text box """
@@ -2066,7 +2573,7 @@ class Window(QMainWindow,QWidget):
             self.Wvl_slider.setValue(12.398/self.E)
             self.Wvl_entry.setText('{: 5.2f}'.format(12.398/self.E))
             self.updateQs()
-            self.update(ul=True, en = True)
+            self.update('energy')
         except:
             text = '"{}" {} {}'.format(val, self.l.what['problem_a'], self.l.what['en_0'])
             self.Update_Info_label(text = text, bkg = self.red)
@@ -2081,7 +2588,7 @@ class Window(QMainWindow,QWidget):
             self.Wvl_slider.setValue(float(self.Wvl_entry.text()))
             self.E_entry.setText('{: 5.2f}'.format(self.E))
             self.updateQs()
-            self.update(ul=True, en = True)
+            self.update('energy')
         except:
             text = '"{}" {} {}'.format(val, self.l.what['problem_a'], self.l.what['wvl_0'])
             self.Update_Info_label(text = text, bkg = self.red)
@@ -2109,6 +2616,8 @@ class Window(QMainWindow,QWidget):
         self.CrystalSize_slider.setValue(self.init_D)
         self.CrystalSize_slider.setTickPosition(QSlider.NoTicks)
         self.CrystalSize_slider.valueChanged.connect(self.D_slider_change)
+        self.CrystalSize_slider.sliderPressed.connect(self.slider_pressed)
+        self.CrystalSize_slider.sliderReleased.connect(self.slider_released)
         self.CrystalSize_slider.setToolTip(self.l.what['tt_s_pars'])
         
         self.CrystalSize_entry = QLineEdit()
@@ -2141,7 +2650,7 @@ class Window(QMainWindow,QWidget):
         """ function called when the crystal size slider is changed"""
         self.D = self.CrystalSize_slider.value()
         self.CrystalSize_entry.setText('{: 6.1f}'.format(self.D))
-        self.update(ul=False, xpd = True, en = False)
+        self.schedule('size')
         
     def Size_update_slider(self):
         """ function called when the edit box text of the crystal size is changed"""
@@ -2149,7 +2658,7 @@ class Window(QMainWindow,QWidget):
         try:
             self.D = float(val)
             self.CrystalSize_slider.setValue(float(self.CrystalSize_entry.text()))
-            self.update(ul=False, xpd = True, en = False)
+            self.update('size')
         except:
             text = '"{}" {} {}'.format(val, self.l.what['problem_a'], self.l.what['size_0'])
             self.Update_Info_label(text = text, bkg = self.red)
@@ -2237,7 +2746,15 @@ class Window(QMainWindow,QWidget):
 
                                 'gamma_ini': self.par0['gamma'],
                                 'gamma_min': self.par_min['gamma'],
-                                'gamma_max': self.par_max['gamma']                     
+                                'gamma_max': self.par_max['gamma'],
+
+                                'fps':self.fps,
+                                'draft_step':self.draft_step,
+                                'draft_hkl':self.draft_hkl,
+                                'draft_peak_tol':self.draft_peak_tol,
+                                'cache_mb':self.cache_mb,
+                                'precompute':self.precompute,
+                                'precompute_cpu':self.precompute_cpu
                                 }
         self.params_functions = { 'E_ini':self.set_init_E, 
                                 'E_min':self.set_E_min, 
@@ -2266,7 +2783,15 @@ class Window(QMainWindow,QWidget):
                                 'c_max':self.set_c_max,
                                 'alpha_max': self.set_alpha_max,
                                 'beta_max': self.set_beta_max,
-                                'gamma_max': self.set_gamma_max
+                                'gamma_max': self.set_gamma_max,
+
+                                'fps':self.set_fps,
+                                'draft_step':self.set_draft_step,
+                                'draft_hkl':self.set_draft_hkl,
+                                'draft_peak_tol':self.set_draft_peak_tol,
+                                'cache_mb':self.set_cache_mb,
+                                'precompute':self.set_precompute,
+                                'precompute_cpu':self.set_precompute_cpu
                                 }
         self.params_names = {   'E_ini':'E (keV) ini', 
                                 'E_min':'E (keV) min', 
@@ -2295,7 +2820,15 @@ class Window(QMainWindow,QWidget):
                                 'c_max':'c (\u212b) max',
                                 'alpha_max':'\u03b1 (\u00b0) max',
                                 'beta_max':'\u03b2 (\u00b0) max',
-                                'gamma_max':'\u03b3 (\u00b0) max'
+                                'gamma_max':'\u03b3 (\u00b0) max',
+
+                                'fps':'fps',
+                                'draft_step':'draft step',
+                                'draft_hkl':'draft hkl',
+                                'draft_peak_tol':'draft tol',
+                                'cache_mb':'cache (MB)',
+                                'precompute':'precompute',
+                                'precompute_cpu':'precomp. CPU'
                                 }
         self.params_tooltips = {'E_ini':self.l.what['param_energy_ini'], 
                                 'E_min':self.l.what['param_energy_minmax'].format(minmax = self.l.what['min']),
@@ -2324,7 +2857,15 @@ class Window(QMainWindow,QWidget):
                                 'c_max':self.l.what['lattice_param_minmax'].format(minmax = self.l.what['max']),
                                 'alpha_max':self.l.what['lattice_param_minmax'].format(minmax = self.l.what['max']),
                                 'beta_max':self.l.what['lattice_param_minmax'].format(minmax = self.l.what['max']),
-                                'gamma_max':self.l.what['lattice_param_minmax'].format(minmax = self.l.what['max'])
+                                'gamma_max':self.l.what['lattice_param_minmax'].format(minmax = self.l.what['max']),
+
+                                'fps':'maximum number of redraws per second while dragging the sliders',
+                                'draft_step':'while dragging a slider, the tth step is multiplied by this number',
+                                'draft_hkl':'while dragging a slider, H, K and L go only up to this value',
+                                'draft_peak_tol':'while dragging a slider, the peaks are cut where they fall below this fraction of their maximum',
+                                'cache_mb':'memory kept for the patterns already calculated, so going back to them is immediate (0 turns the cache off)',
+                                'precompute':'while idle, the patterns of this many positions (pixels) to each side of the slider used last are calculated in advance and kept in the cache (0 turns it off)',
+                                'precompute_cpu':'fraction of one CPU that the calculation in advance may take'
                                 }
         self.params_types = {   'E_ini':'float',
                                 'E_min':'float',
@@ -2353,7 +2894,15 @@ class Window(QMainWindow,QWidget):
                                 'c_max':'float',
                                 'alpha_max':'float',
                                 'beta_max':'float',
-                                'gamma_max':'float'
+                                'gamma_max':'float',
+
+                                'fps':'float',
+                                'draft_step':'int',
+                                'draft_hkl':'int',
+                                'draft_peak_tol':'float',
+                                'cache_mb':'float',
+                                'precompute':'int',
+                                'precompute_cpu':'float'
                                 }
         params_min_lims = {     'E_ini':self.E_min,
                                 'E_min':2,
@@ -2382,7 +2931,15 @@ class Window(QMainWindow,QWidget):
                                 'c_max':self.par_min['c'],
                                 'alpha_max':self.par_min['alpha'],
                                 'beta_max':self.par_min['beta'],
-                                'gamma_max':self.par_min['gamma']
+                                'gamma_max':self.par_min['gamma'],
+
+                                'fps':1,
+                                'draft_step':1,
+                                'draft_hkl':1,
+                                'draft_peak_tol':1e-12,
+                                'cache_mb':0,
+                                'precompute':0,
+                                'precompute_cpu':0.05
                                 }
         params_max_lims = {     'E_ini':self.E_max,
                                 'E_min':self.E_max,
@@ -2411,7 +2968,15 @@ class Window(QMainWindow,QWidget):
                                 'c_max':40,
                                 'alpha_max':179,
                                 'beta_max':179,
-                                'gamma_max':179
+                                'gamma_max':179,
+
+                                'fps':240,
+                                'draft_step':100,
+                                'draft_hkl':20,
+                                'draft_peak_tol':0.5,
+                                'cache_mb':4096,
+                                'precompute':200,
+                                'precompute_cpu':1
                                 }
         color =    {            'E_ini':self.red_red,
                                 'E_min':self.red,
@@ -2440,7 +3005,15 @@ class Window(QMainWindow,QWidget):
                                 'c_max':self.green,
                                 'alpha_max':self.green,
                                 'beta_max':self.green,
-                                'gamma_max':self.green
+                                'gamma_max':self.green,
+
+                                'fps':self.gray,
+                                'draft_step':self.gray_light,
+                                'draft_hkl':self.gray_light,
+                                'draft_peak_tol':self.gray_light,
+                                'cache_mb':self.gray_light,
+                                'precompute':self.gray_light,
+                                'precompute_cpu':self.gray_light
                                 }
         save =  {               'E_ini':True,
                                 'E_min':True,
@@ -2470,10 +3043,18 @@ class Window(QMainWindow,QWidget):
                                 'alpha_max':False,
                                 'beta_max':False,
                                 'gamma_max':False,
+
+                                'fps':True,
+                                'draft_step':True,
+                                'draft_hkl':True,
+                                'draft_peak_tol':True,
+                                'cache_mb':True,
+                                'precompute':True,
+                                'precompute_cpu':True
                                 }
         title = "Parameter Options"
         self.w1 = PopUpOpt(self, self.params_options, self.params_functions, self.params_names, self.params_tooltips, self.params_types, params_min_lims, params_max_lims, color, title, save)
-        self.w1.setGeometry(QRect(100, 100, 200, 300))
+        self.w1.setGeometry(QRect(100, 100, 200, 470))
         self.w1.show()
 
     def set_init_E(self, init_E):
@@ -2485,12 +3066,14 @@ class Window(QMainWindow,QWidget):
         """ function that defines the minimum value for the energy, used in the slider"""
         self.E_min = E_min
         self.E_slider.setMinimum(self.E_min)
+        self.engine.form_factor_tables.set_energy_range(self.E_min, self.E_max)
         return self.E_min
 
     def set_E_max(self, E_max):
         """ function that defines the maximum value for the energy, used in the slider"""
         self.E_max = E_max
         self.E_slider.setMaximum(self.E_max)
+        self.engine.form_factor_tables.set_energy_range(self.E_min, self.E_max)
         return self.E_max
         
     def set_init_D(self, init_D):
@@ -2635,6 +3218,7 @@ class Window(QMainWindow,QWidget):
         self.Vis_slider.setValue(self.plotlimits)
         self.Vis_slider.setTickPosition(QSlider.NoTicks)
         self.Vis_slider.valueChanged.connect(self.change_limits)
+        self.Vis_slider.sliderReleased.connect(self.flush)
         self.Vis_slider.setToolTip(self.l.what['tt_s_uc'])
 
         self.Edge_check = QCheckBox('')
@@ -2687,69 +3271,80 @@ class Window(QMainWindow,QWidget):
         Figure_layout.addWidget(self.Extended_cells_check, 7, 0, 1, 1)
         #Figure_layout.addWidget(self.Include_edge_atoms_check, 8, 0, 1, 1)
         self.CrystalFigure_groupBox.setLayout(Figure_layout)
+
+        self.include_unit_cell_artists()
         
         return self.CrystalFigure_groupBox
 
     def change_limits(self):
         """Function that changes the limits of the 3D plot, based ont he slider value"""
         self.plotlimits = self.Vis_slider.value()
-        self.update(ul=False, xpd = False, en = False)
+        self.schedule('view')
         
     def check_edge_TF(self):
         """ calls the update function with no calculations just changing the crystal visualization removing or including the edge of the unit cell """
-        self.update(ul=False, xpd = False, en = False)
+        self.update('view')
 
     def check_face_TF(self):
         """ calls the update function with no calculations just changing the crystal visualization removing or including the face of the unit cell """
-        self.update(ul=False, xpd = False, en = False)
+        self.update('view')
 
     def check_showhideatoms_TF(self):
         """ calls the update function with no calculations just changing the crystal visualization removing or including the atoms of the unit cell """
-        self.update(ul=False, xpd = False, en = False)
+        self.update('view')
 
     def check_extended_cells_TF(self):
         """ calls the update function with no calculations just changing the crystal visualization removing or including the atoms of extra unit cells  """
-        self.update(ul=False, xpd = False, en = False)
+        self.update('view')
         
     def check_add_edge_atoms_TF(self):
         """ calls the update function with no calculations just changing the crystal visualization removing or including the atoms from the edge of the unit cell. Not sure that I have imp0lemented that!! :-o """
-        self.update(ul=False, xpd = False, en = False)
-        
+        self.update('view')
+        
+    def include_unit_cell_artists(self):
+        """ creates, only once, the artists of the unit cell figure. Later, update_unit_cell just changes their vertices, positions, colors and sizes """
+        self.verts = self.Crystalax.add_collection3d(Poly3DCollection([], facecolors = self.crysface_color, edgecolors = self.crysedge_color))
+        self.scatter = self.Crystalax.scatter3D([], [], [])
+        self.hkl_planes = self.Crystalax.add_collection3d(Poly3DCollection([], facecolors = self.magenta_light, linewidths = 0, alpha = 0.75))
+        self.HKL_planes_cache = {}
+        self.HKL_planes_key = None
+        self.Crystalax.set_xlabel('a')
+        self.Crystalax.set_ylabel('b')
+        self.Crystalax.set_zlabel('c')
+        self.Crystalax.set_box_aspect((1.0, 1.0, 1.0))
+
+    def clip_HKL_planes(self, h, k, l):
+        """ returns the HKL planes which cross the unit cell, clipped to its faces, as a list of polygons in fractional coordinates. They only depend on h, k and l, so they are kept in HKL_planes_cache """
+        if (h, k, l) not in self.HKL_planes_cache:
+            corners = np.indices((2, 2, 2)).reshape(3, -1).T
+            edges = [(i, j) for i in range(8) for j in range(i+1, 8) if np.abs(corners[i]-corners[j]).sum() == 1]
+            n = np.array([h, k, l])
+            d = corners @ n
+            polygons = []
+            for i in range(d.min(), d.max()+1):
+                points = [corners[j] for j in range(8) if d[j] == i]
+                points += [corners[j0]+(i-d[j0])/(d[j1]-d[j0])*(corners[j1]-corners[j0]) for j0, j1 in edges if (d[j0]-i)*(d[j1]-i) < 0]
+                if len(points) < 3: continue
+                points = np.array(points, dtype = float)
+                center = points.mean(axis = 0)
+                u = points[0]-center
+                v = np.cross(n, u)
+                angles = np.arctan2((points-center) @ v, (points-center) @ u)
+                polygons.append(points[np.argsort(angles)])
+            self.HKL_planes_cache[(h, k, l)] = polygons
+        return self.HKL_planes_cache[(h, k, l)]
+
     def calc_HKL_planes(self):
-        """ function that calculates the equations of the HKL planes, to include them or not in the visualization of the unit cell"""
-        h = int(self.le_H.text())
-        k = int(self.le_K.text())
-        l = int(self.le_L.text())
-        #lim = self.plotlimits
-        #lim2 = lim/5.
-        mesh = np.arange(-0.2,1.21, 0.2)
-        x0, x1 = np.meshgrid(mesh, mesh)
-        d = []
-        delta = 0.1
-        diag = np.array(self.set_pos(1,1,1))+delta
-        #dist = np.sqrt(np.dot(diag,[h,k,l]))
-        #d_HKL = 2*np.pi/self.Qhkl(h,k,l)
-        _alpha = 0.75
-        #while n*d_HKL <= 5*dist: n+=1
-        if h != 0:
-            for i in range(-4,4,1): 
-                x = (-x0*k -x1*l +i)/h
-                [xx, yy, zz] = self.set_pos(x,x0,x1)
-                if np.all([np.any(xx <= diag[0]), np.any(xx >= -delta), np.any(yy <= diag[1]), np.any(yy >= -delta), np.any(zz <= diag[2]), np.any(zz >= -delta)]):
-                    self.curv = self.Crystalax.plot_surface(xx, yy, zz, color = self.magenta_light, alpha = _alpha )
-        elif k != 0:
-            for i in range(-4,4,1): 
-                y = (-x0*h -x1*l +i)/k
-                [xx, yy, zz] = self.set_pos(x0,y,x1)
-                if np.all([np.any(xx <= diag[0]), np.any(xx >= -delta), np.any(yy <= diag[1]), np.any(yy >= -delta), np.any(zz <= diag[2]), np.any(zz >= -delta)]):
-                    self.curv = self.Crystalax.plot_surface(xx, yy, zz, color = self.magenta_light, alpha = _alpha )
-        elif l != 0:
-            for i in range(-4,4,1): 
-                z = (-x0*h -x1*k +i)/l
-                [xx, yy, zz] = self.set_pos(x0,x1,z)
-                if np.all([np.any(xx <= diag[0]), np.any(xx >= -delta), np.any(yy <= diag[1]), np.any(yy >= -delta), np.any(zz <= diag[2]), np.any(zz >= -delta)]):
-                    self.curv = self.Crystalax.plot_surface(xx, yy, zz, color = self.magenta_light, alpha = _alpha )
-        self.Crystalcanvas.draw()
+        """ gives the HKL planes to their collection in the visualization of the unit cell. They are transformed to cartesian only when the HKL or the lattice changed """
+        key = (self.old_HKL_H, self.old_HKL_K, self.old_HKL_L, self.engine.get('lattice'))
+        if key == self.HKL_planes_key: return
+        polygons = self.clip_HKL_planes(*key[:3])
+        verts = []
+        if polygons:
+            xyz = np.array(self.set_pos(*np.concatenate(polygons).T)).T
+            verts = np.split(xyz, np.cumsum([len(i) for i in polygons])[:-1])
+        self.hkl_planes.set_verts(verts)
+        self.HKL_planes_key = key
 
 
 
@@ -2768,48 +3363,13 @@ class Window(QMainWindow,QWidget):
 
     # base atoms functions and options
     def include_BaseAtoms(self):
-        """ function that includes the groupbox of the atoms of the unit cell, with all components"""
+        """ function that includes the groupbox of the atoms of the unit cell: a table with all of them and the sliders of the position of the selected one """
         # just the name of the group
         self.BaseAtoms_groupBox = QGroupBox(self.l.what['base'], self)
         self.BaseAtoms_groupBox.setFont(QFont(self.font,self.fontsize))
-        self.BaseAtoms_groupBox.setStyleSheet(self.GroupBox_StyleSheet(self.color_atom0, self.blue_light))
-
-        #self.BaseAtoms_settings_button = QPushButton('')
-        #self.BaseAtoms_settings_button.clicked.connect(self.BaseAtoms_settings_opts)
-        #button_opts = self.PushButton_Toolbox_StyleSheet(self.sl_col_1)
-        #self.BaseAtoms_settings_button.setStyleSheet(button_opts)
-        #self.BaseAtoms_settings_button.setToolTip(self.l.what['baseatoms_settings'])
-        #icon = qta.icon('ri.settings-5-fill', color='k', scale_factor = 1.3)
-        #self.BaseAtoms_settings_button.setIcon(icon)
-        
-        self.BaseAtoms_entry_0 = QLineEdit(self.baseAtoms[0])
-        self.BaseAtoms_entry_0.setStyleSheet(self.LineEdit_StyleSheet(self.color_atom0))
-        self.BaseAtoms_entry_0.setFont(QFont(self.font,self.fontsize))
-        self.BaseAtoms_entry_0.setMaxLength(2)
-        self.BaseAtoms_entry_0.editingFinished.connect(lambda atom = 0: self.newAtomEntered(atom))
-        self.BaseAtoms_entry_0.setFixedWidth(40);
-        self.BaseAtoms_entry_0.setToolTip(self.l.what['label_0'])
-        self.BaseAtoms_entry_0.setAlignment(Qt.AlignHCenter | Qt.AlignVCenter)
-        
-        self.BaseAtoms_color = QPushButton('')
-        self.BaseAtoms_color.clicked.connect(self.getBaseAtom_color)
-        button_opts = self.PushButton_StyleSheet(self.color_atom0)
-        button_opts2 = self.PushButton_StyleSheet2(self.color_atom0)
-        icon = qta.icon('msc.symbol-color', color='k', scale_factor = 1.1)
-        self.BaseAtoms_color.setIcon(icon)
-        self.BaseAtoms_color.setStyleSheet(button_opts2)
-        self.BaseAtoms_color.setToolTip(self.l.what['color_0'])
-
-        self.BaseAtoms_entry_0_size = QLineEdit('{}'.format(self.sizes_init[0]/100.))
-        self.BaseAtoms_entry_0_size.setStyleSheet(self.LineEdit_StyleSheet(self.color_atom0))
-        self.BaseAtoms_entry_0_size.setFont(QFont(self.font,self.fontsize))
-        self.BaseAtoms_entry_0_size.setMaxLength(4)
-        self.BaseAtoms_entry_0_size.editingFinished.connect(lambda atom = 0: self.newAtomSizeEntered(atom))
-        self.BaseAtoms_entry_0_size.setFixedWidth(40);
-        self.BaseAtoms_entry_0_size.setToolTip(self.l.what['atom_size'])
-        self.BaseAtoms_entry_0_size.setAlignment(Qt.AlignHCenter | Qt.AlignVCenter)
-        
-        
+        self.BaseAtoms_groupBox.setStyleSheet(self.GroupBox_StyleSheet(self.atoms.color[0], self.blue_light))
+
+        button_opts = self.PushButton_StyleSheet(self.atoms.color[0])
         self.BaseAtoms_button_addAtom = QPushButton('+ {}'.format(self.l.what['atm']))
         self.BaseAtoms_button_addAtom.setFont(QFont(self.font,self.fontsize))
         self.BaseAtoms_button_addAtom.clicked.connect(self.add_Atom)
@@ -2820,347 +3380,158 @@ class Window(QMainWindow,QWidget):
         self.BaseAtoms_button_remAtom.clicked.connect(self.rem_Atom)
         self.BaseAtoms_button_remAtom.setStyleSheet(button_opts)
         self.BaseAtoms_button_remAtom.setToolTip(self.l.what['remAtoms'])
+        self.BaseAtoms_button_loadCIF = QPushButton('CIF')
+        self.BaseAtoms_button_loadCIF.setFont(QFont(self.font,self.fontsize))
+        self.BaseAtoms_button_loadCIF.clicked.connect(self.load_CIF)
+        self.BaseAtoms_button_loadCIF.setStyleSheet(button_opts)
+        self.BaseAtoms_button_loadCIF.setToolTip(self.l.what['loadcif'])
+
+        # the table: the model keeps the AtomTable, the view shows only the rows on the screen
+        headers = [self.l.what['atm'], 'x', 'y', 'z', self.l.what['occ'], 'B', self.l.what['atm_size'], self.l.what['atm_color']]
+        self.atoms_model = AtomTableModel(self.atoms, headers, lambda name: self.elements.get(name).name)
+        self.atoms_model.edited.connect(self.update)
+        self.atoms_model.rejected.connect(self.atom_rejected)
+        self.BaseAtoms_table = QTableView()
+        self.BaseAtoms_table.setModel(self.atoms_model)
+        self.BaseAtoms_table.setFont(QFont(self.font,self.fontsize-2))
+        self.BaseAtoms_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.BaseAtoms_table.setEditTriggers(QAbstractItemView.DoubleClicked | QAbstractItemView.EditKeyPressed)
+        self.BaseAtoms_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.BaseAtoms_table.verticalHeader().setDefaultSectionSize(int(self.fontsize*2))
+        self.BaseAtoms_table.setToolTip(self.l.what['atom_table'])
+        self.BaseAtoms_table.doubleClicked.connect(self.atom_double_clicked)
+        self.BaseAtoms_table.selectionModel().currentRowChanged.connect(self.atom_selected)
+
+        # sliders of the position of the selected atom
+        self.BaseAtoms_label_pos = {}
+        self.BaseAtoms_slider_pos = {}
+        slider_opts = self.Slider_StyleSheet()
+        for i, pos in enumerate(['x', 'y', 'z']):
+            self.BaseAtoms_label_pos.update({pos:QLabel(pos)})
+            self.BaseAtoms_label_pos[pos].setFont(QFont(self.font,self.fontsize))
+            self.BaseAtoms_slider_pos.update({pos:DoubleSlider(3,Qt.Horizontal)})
+            self.BaseAtoms_slider_pos[pos].setStyleSheet(slider_opts)
+            self.BaseAtoms_slider_pos[pos].setMinimum(0)
+            self.BaseAtoms_slider_pos[pos].setMaximum(1)
+            self.BaseAtoms_slider_pos[pos].setTickPosition(QSlider.NoTicks)
+            self.BaseAtoms_slider_pos[pos].valueChanged.connect(lambda value, i = i: self.pos_slider_change(i))
+            self.BaseAtoms_slider_pos[pos].sliderPressed.connect(self.slider_pressed)
+            self.BaseAtoms_slider_pos[pos].sliderReleased.connect(self.slider_released)
+            self.BaseAtoms_slider_pos[pos].setToolTip(self.l.what['pos'+pos] + ': ' + self.l.what['tt_s_pars'])
+        self.selected_atom = 0
+        self.select_atom(min(1, len(self.atoms)-1))
 
-        self.BaseAtoms_tabs = QTabWidget()
-
-
-
-        # North  = 0; South  = 1; West  = 2; East = 3
-        c3 = 'min-height: 15ex;padding: 2px;}'
-        b = 'QTabWidget::tab-bar { left: 0px; top: 15px}'
-        c2 = 'border-bottom-color: #C2C7CB; border-top-left-radius: 5px; border-bottom-left-radius: 5px;'
-        
-        self.BaseAtoms_tabs.setTabPosition(2)
-        
-        a = 'QTabWidget::pane { border-top: 2px solid #C2C7CB; border-left: 2px solid #C2C7CB; border-right: 2px solid #C2C7CB; border-bottom: 2px solid #C2C7CB;}'
-        c = 'QTabBar::tab { background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1, stop: 0 #E1E1E1, '
-        c1 = 'stop: 0.4 #DDDDDD, stop: 0.5 #D8D8D8, stop: 1.0 #D3D3D3); border: 2px solid #C4C4C3; '
-        
-        d = 'QTabBar::tab:selected, QTabBar::tab:hover { background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,'
-        d1 = 'stop: 0 {}, stop:  1.0 {});'.format(self.blue,self.blue_light)+'}'
-        e = 'QTabBar::tab:selected {border-color: '+ '{};border-bottom-color: {}'.format(self.blue, self.blue)+';}'
-        f = 'QTabBar::tab:!selected {margin-top: 2px; }'
-        tab_opts = a + b + c + c1+ c2 + c3 + d + d1 + e + f
-        self.BaseAtoms_tabs.setStyleSheet(tab_opts)
-
-        
-        self.BaseAtoms_tab1 = QWidget()
-        self.BaseAtoms_tab2 = QWidget()
-        self.BaseAtoms_tab3 = QWidget()
-
-        self.layout = [QVBoxLayout(self.BaseAtoms_tab1),QVBoxLayout(self.BaseAtoms_tab2),QVBoxLayout(self.BaseAtoms_tab3)]
-        
-        self.BaseAtoms_tabs.addTab(self.BaseAtoms_tab1,"pos 1-3")
-        self.BaseAtoms_tabs.addTab(self.BaseAtoms_tab2,"pos 4-6")
-        self.BaseAtoms_tabs.addTab(self.BaseAtoms_tab3,"pos 7-9")
-        for i in range (3): self.BaseAtoms_tabs.setTabEnabled (i, False)
-        
         BaseAtoms_layout = QGridLayout()
         BaseAtoms_layout.setContentsMargins(5, 15, 5, 5)
-        
-        #BaseAtoms_layout.addWidget(self.BaseAtoms_settings_button, 1,0)
-        BaseAtoms_layout.addWidget(self.BaseAtoms_entry_0, 1, 0)
-        BaseAtoms_layout.addWidget(self.BaseAtoms_color,1,1)
-        BaseAtoms_layout.addWidget(self.BaseAtoms_entry_0_size,1,2)
+        BaseAtoms_layout.addWidget(self.BaseAtoms_button_loadCIF, 1, 8,1,2)
         BaseAtoms_layout.addWidget(self.BaseAtoms_button_addAtom, 1, 10,1,2)
         BaseAtoms_layout.addWidget(self.BaseAtoms_button_remAtom, 1, 12,1,2)
-        BaseAtoms_layout.addWidget(self.BaseAtoms_tabs,2,0,-1,-1)
+        BaseAtoms_layout.addWidget(self.BaseAtoms_table,2,0,1,-1)
+        for i, pos in enumerate(['x', 'y', 'z']):
+            BaseAtoms_layout.addWidget(self.BaseAtoms_label_pos[pos], 3+i, 0)
+            BaseAtoms_layout.addWidget(self.BaseAtoms_slider_pos[pos], 3+i, 1, 1, -1)
         self.BaseAtoms_groupBox.setLayout(BaseAtoms_layout)
 
         return self.BaseAtoms_groupBox
 
-    def newAtomEntered(self, atom, init = False):
-        """ function called when a new text is entered in the text box of the atoms' names. This funtion is called in the beginning of the program; so to do not update so many times when an atom is included, I put this option 'init = False' """
-        if atom == 0:
-            func = self.BaseAtoms_entry_0
-        else:
-            func = self.AddAtoms_entry_At[atom]
-        try:
-            eval('xu.materials.elements.{}'.format(func.text()))
-            self.Atom_types.update({atom:func.text()})
-            self.last_atom = func.text()
-            if not init: self.update(ul=False, xpd = True, en = True)
-        except:
-            text0 = func.text()
-            func.setText(self.last_atom)
-            text = '"{}" {} {}'.format(text0, self.l.what['problem_a'], self.l.what['atm'])
-            self.Update_Info_label(text = text, bkg = self.red)
+    def load_CIF(self):
+        """ function called when the CIF button is pressed: opens a dialog to choose the file """
+        filename = QFileDialog.getOpenFileName(self, self.l.what['loadcif'], '', 'CIF (*.cif);;* (*)')[0]
+        if filename: self.read_CIF(filename)
 
-    def newAtomSizeEntered(self, atom):
-        """ function called when a new text is entered in the text box of the atoms' size. I've put a limit for the sizes, but, actually, never tried what is the real value of the limit.  """
-        if atom == 0:
-            func = self.BaseAtoms_entry_0_size
-        else:
-            func = self.AddAtoms_entry_At_size[atom]
+    def read_CIF(self, filename):
+        """ loads the structure of a CIF file: the lattice goes to the sliders and all atoms of the cell to the table. An atom at the origin becomes the first one; 
+            if there is none, the structure is moved so the first atom is at the origin, which does not change the pattern """
         try:
-            numb = float(func.text())
-            if numb < 1 or numb > 10:
-                text = '"{}" {} {}'.format(numb, self.l.what['problem_a'], self.l.what['atom_size2'])
-                self.Update_Info_label(text = text, bkg = self.red)
-                func.setText('{}'.format(self.sizes_init[atom]/100.))
-            else:
-                self.sizes_init[atom] = numb*100
-        except:
-            text = '"{}" {} {}'.format(func.text(), self.l.what['problem_a'], self.l.what['atom_size2'])
+            structure = read_cif(filename)
+            types = [cif_element(i, self.elements) for i in structure['types']]
+        except (OSError, ValueError, KeyError):
+            text = '{}: {}'.format(os.path.basename(filename), self.l.what['loadcifproblem'])
             self.Update_Info_label(text = text, bkg = self.red)
-            func.setText('{}'.format(self.sizes_init[atom]/100))
-        self.update(ul=False, xpd = False, en = False)
-
-    def add_Atom(self, init = False):
-        """ function that prepares to include an atom in the unit cell. The limit of 10 atoms is here. One can change it here. I do not believe this include more atoms would be a problem; however, 10 is a very large value"""
-        self.additional_atoms += 1
-        if self.additional_atoms>9: 
-            print ('maximum of 10 atoms')
-            self.additional_atoms = 9
-        else: 
-            self.include_atom(init = init)
-            if not init: self.rescale()
-
-    def rem_Atom(self):
-        """ function that prepares to remove an atom of the unit cell. """
-        self.additional_atoms -= 1
-        if self.additional_atoms < 0: self.additional_atoms = 0
-        else: 
-            self.exclude_atom()
-            self.rescale()
-
-    def include_atom(self, init = False):
-        """ function that effectively includes an atom on the unit cell. it call ohter function to create and prepare the sliders and tabs """
-        i = self.additional_atoms
-        j = (i-1)//3
-        k = (i-1)%3
-        if init:
-            color = self.color_init[i]
-            pos_x = self.pos_x_init[i]
-            pos_y = self.pos_y_init[i]
-            pos_z = self.pos_z_init[i]
-            atom_ = self.baseAtoms[i] 
+            return
+        xyz = structure['xyz']
+        origin = np.nonzero(np.all(np.abs(xyz) < 1e-6, axis = 1))[0]
+        if len(origin):
+            order = np.concatenate(([origin[0]], np.delete(np.arange(len(xyz)), origin[0])))
         else:
-            color = self.colors[i-1]
-            pos_x = 0.5
-            pos_y = 0.5
-            pos_z = 0.5
-            atom_ = self.last_atom
-
-        if k == 0: 
-            self.BaseAtoms_tabs.setTabEnabled (j, True)
-            self.BaseAtoms_tabs.setCurrentIndex(j)
-        self.AddAtoms_groupBox.update({i:QGroupBox('{} {}'.format(self.l.what['atm'],i))})
-        self.AddAtoms_groupBox[i].setFont(QFont(self.font,self.fontsize))
-        self.AddAtoms_groupBox[i].setStyleSheet(self.GroupBox_StyleSheet(color,'#dddddd'))
-        #self.AddAtoms_groupBox[i].show()
-        self.AddAtoms_groupBox[i].setMaximumHeight(int(self.layout[j].geometry().getRect()[3]/3))
-        
-        
-
-        
-        self.AddAtoms_groupBox_layout.update({i:QGridLayout(self.AddAtoms_groupBox[i])})
-        self.AddAtoms_label_x.update({i:QLabel()})
-        self.AddAtoms_label_x[i].setFont(QFont(self.font,self.fontsize))
-        self.AddAtoms_label_x[i].setText('{}'.format('x'))
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_label_x[i],0,1)
-
-        self.AddAtoms_label_y.update({i:QLabel()})
-        self.AddAtoms_label_y[i].setFont(QFont(self.font,self.fontsize))
-        self.AddAtoms_label_y[i].setText('{}'.format('y'))
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_label_y[i],1,1)
-        
-        self.AddAtoms_label_z.update({i:QLabel()})
-        self.AddAtoms_label_z[i].setFont(QFont(self.font,self.fontsize))
-        self.AddAtoms_label_z[i].setText('{}'.format('z'))
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_label_z[i],2,1)
-
-
-        self.AddAtoms_slider_x.update({i:DoubleSlider(3,Qt.Horizontal)})
-        slider_opts = self.Slider_StyleSheet()
-        self.AddAtoms_slider_x[i].setStyleSheet(slider_opts)
-        self.AddAtoms_slider_x[i].setMinimum(0)
-        self.AddAtoms_slider_x[i].setMaximum(1)
-        self.AddAtoms_slider_x[i].setValue(pos_x)
-        self.AddAtoms_slider_x[i].setTickPosition(QSlider.NoTicks)
-        self.AddAtoms_slider_x[i].valueChanged.connect(lambda value, atom = i: self.pos_x_slider_change(value, atom))
-        self.AddAtoms_slider_x[i].setToolTip(self.l.what['atm'] + '{}, '.format(i) + self.l.what['posx'] + ': '.format(i) + self.l.what['tt_s_pars'])
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_slider_x[i],0,2,1,7)
-
-
-        self.AddAtoms_entry_pos_x.update({i:QLineEdit('{}'.format(pos_x))})
-        entry_opts = self.LineEdit_StyleSheet(color)
-        self.AddAtoms_entry_pos_x[i].setStyleSheet(entry_opts)
-        self.AddAtoms_entry_pos_x[i].setFont(QFont(self.font,self.fontsize))
-        self.AddAtoms_entry_pos_x[i].setMaxLength(5)
-        self.AddAtoms_entry_pos_x[i].editingFinished.connect(lambda atom = i: self.new_pos_x(atom))
-        self.AddAtoms_entry_pos_x[i].setFixedWidth(60)
-        self.AddAtoms_entry_pos_x[i].setAlignment(Qt.AlignRight | Qt.AlignVCenter)
-        self.AddAtoms_entry_pos_x[i].setToolTip(self.l.what['atm'] + '{}, '.format(i) + self.l.what['posx'] + ': '.format(i) + self.l.what['tt_e_pars'])
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_entry_pos_x[i],0,11)
-        
-        
-        self.AddAtoms_slider_y.update({i:DoubleSlider(3,Qt.Horizontal)})
-        self.AddAtoms_slider_y[i].setStyleSheet(slider_opts)
-        self.AddAtoms_slider_y[i].setMinimum(0)
-        self.AddAtoms_slider_y[i].setMaximum(1)
-        self.AddAtoms_slider_y[i].setValue(pos_y)
-        self.AddAtoms_slider_y[i].setTickPosition(QSlider.NoTicks)
-        self.AddAtoms_slider_y[i].valueChanged.connect(lambda value, atom = i: self.pos_y_slider_change(value, atom))
-        self.AddAtoms_slider_y[i].setToolTip(self.l.what['atm'] + '{}, '.format(i) + self.l.what['posy'] + ': '.format(i) + self.l.what['tt_s_pars'])
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_slider_y[i],1,2,1,7)
-        
-        
-        self.AddAtoms_entry_pos_y.update({i:QLineEdit('{}'.format(pos_y))})
-        self.AddAtoms_entry_pos_y[i].setStyleSheet(entry_opts)
-        self.AddAtoms_entry_pos_y[i].setFont(QFont(self.font,self.fontsize))
-        self.AddAtoms_entry_pos_y[i].setMaxLength(5)
-        self.AddAtoms_entry_pos_y[i].editingFinished.connect(lambda atom = i: self.new_pos_y(atom))
-        self.AddAtoms_entry_pos_y[i].setFixedWidth(60)
-        self.AddAtoms_entry_pos_y[i].setAlignment(Qt.AlignRight | Qt.AlignVCenter)
-        self.AddAtoms_entry_pos_y[i].setToolTip(self.l.what['atm'] + '{}, '.format(i) + self.l.what['posy'] + ': '.format(i) + self.l.what['tt_e_pars'])
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_entry_pos_y[i],1,11)
-        
-        
-        self.AddAtoms_slider_z.update({i:DoubleSlider(3,Qt.Horizontal)})
-        self.AddAtoms_slider_z[i].setStyleSheet(slider_opts)
-        self.AddAtoms_slider_z[i].setMinimum(0)
-        self.AddAtoms_slider_z[i].setMaximum(1)
-        self.AddAtoms_slider_z[i].setValue(pos_z)
-        self.AddAtoms_slider_z[i].setTickPosition(QSlider.NoTicks)
-        self.AddAtoms_slider_z[i].valueChanged.connect(lambda value, atom = i: self.pos_z_slider_change(value, atom))
-        self.AddAtoms_slider_z[i].setToolTip(self.l.what['atm'] + '{}, '.format(i) + self.l.what['posz'] + ': '.format(i) + self.l.what['tt_s_pars'])
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_slider_z[i],2,2,1,7)
-        
-        
-        self.AddAtoms_entry_pos_z.update({i:QLineEdit('{}'.format(pos_z))})
-        self.AddAtoms_entry_pos_z[i].setStyleSheet(entry_opts)
-        self.AddAtoms_entry_pos_z[i].setFont(QFont(self.font,self.fontsize))
-        self.AddAtoms_entry_pos_z[i].setMaxLength(5)
-        self.AddAtoms_entry_pos_z[i].editingFinished.connect(lambda atom = i: self.new_pos_z(atom))
-        self.AddAtoms_entry_pos_z[i].setFixedWidth(60)
-        self.AddAtoms_entry_pos_z[i].setAlignment(Qt.AlignRight | Qt.AlignVCenter)
-        self.AddAtoms_entry_pos_z[i].setToolTip(self.l.what['atm'] + '{}, '.format(i) + self.l.what['posz'] + ': '.format(i) + self.l.what['tt_e_pars'])
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_entry_pos_z[i],2,11)
-        
-        
-        self.AddAtoms_entry_At.update({i:QLineEdit(atom_)})
-        self.AddAtoms_entry_At[i].setStyleSheet(entry_opts)
-        self.AddAtoms_entry_At[i].setFont(QFont(self.font,self.fontsize))
-        self.AddAtoms_entry_At[i].setMaxLength(2)
-        self.AddAtoms_entry_At[i].editingFinished.connect(lambda atom = i: self.newAtomEntered(atom))
-        self.AddAtoms_entry_At[i].setFixedWidth(40)
-        self.AddAtoms_entry_At[i].setAlignment(Qt.AlignHCenter | Qt.AlignVCenter)
-        self.AddAtoms_entry_At[i].setToolTip(self.l.what['atomtype'])
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_entry_At[i],0,0)
-        
-        self.Atom_types.update({i:atom_})
-        
-        self.AddAtoms_color.update({i:QPushButton('')})
-        self.AddAtoms_color[i].clicked.connect(lambda tf, atom = i: self.getAddAtoms_color(tf, atom))
-        button_opts = self.PushButton_StyleSheet2(color)
-        self.AddAtoms_color[i].setStyleSheet(button_opts)
-        self.AddAtoms_color[i].setToolTip(self.l.what['color_0'])
-        icon = qta.icon('msc.symbol-color', color='k', scale_factor = 1.1)
-        self.AddAtoms_color[i].setIcon(icon)
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_color[i],1,0)
-        
-        
-        if len(self.sizes_init) <= i: self.sizes_init.append(self.sizes_init[-1])
-        self.AddAtoms_entry_At_size.update({i:QLineEdit('{}'.format(self.sizes_init[i]/100.))})
-        self.AddAtoms_entry_At_size[i].setStyleSheet(entry_opts)
-        self.AddAtoms_entry_At_size[i].setFont(QFont(self.font,self.fontsize))
-        self.AddAtoms_entry_At_size[i].setMaxLength(4)
-        self.AddAtoms_entry_At_size[i].editingFinished.connect(lambda atom = i: self.newAtomSizeEntered(atom))
-        self.AddAtoms_entry_At_size[i].setFixedWidth(40)
-        self.AddAtoms_entry_At_size[i].setAlignment(Qt.AlignHCenter | Qt.AlignVCenter)
-        self.AddAtoms_entry_At_size[i].setToolTip(self.l.what['atom_size'])
-        self.AddAtoms_groupBox_layout[i].addWidget(self.AddAtoms_entry_At_size[i],2,0)
-        
-        self.layout[j].addWidget(self.AddAtoms_groupBox[i])
-        self.layout[j].activate() #seriously: this is the only function that solved my problem. Comment it and you will see what my problem was. If you know why, send me an e-mail to explain me, please!!
-        
-        if not init: self.update()
-
-    def pos_x_slider_change(self, value, atom):
-        """ function called when the x position slider of an atom changes """
-        self.AddAtoms_entry_pos_x[atom].setText('{: 5.3f}'.format(self.AddAtoms_slider_x[atom].value()))
-        self.update(ul=False, xpd = True, en = False)
-
-    def pos_y_slider_change(self, value, atom):
-        """ function called when the y position slider of an atom changes """
-        self.AddAtoms_entry_pos_y[atom].setText('{: 5.3f}'.format(self.AddAtoms_slider_y[atom].value()))
-        self.update(ul=False, xpd = True, en = False)
-
-    def pos_z_slider_change(self, value, atom):
-        """ function called when the z position slider of an atom changes """
-        self.AddAtoms_entry_pos_z[atom].setText('{: 5.3f}'.format(self.AddAtoms_slider_z[atom].value()))
-        self.update(ul=False, xpd = True, en = False)
-
-    def new_pos_x(self,atom):
-        """ function called when the edit box of the x position of an atom changes """
-        val = self.AddAtoms_entry_pos_x[atom].text()
-        try:
-            self.AddAtoms_slider_x[atom].setValue(float(val))
-            self.update(ul=False, xpd = True, en = False)
-        except:
-            text = '"{}" {} {}'.format(val, self.l.what['problem_a'], self.l.what['atm_0'])
-            self.Update_Info_label(text = text, bkg = self.red)
-            self.AddAtoms_entry_pos_x[atom].setText('{: 5.3f}'.format(self.AddAtoms_slider_x[atom].value()))
-
-    def new_pos_y(self,atom):
-        """ function called when the edit box of the y position of an atom changes """
-        val = self.AddAtoms_entry_pos_y[atom].text()
-        try:
-            self.AddAtoms_slider_y[atom].setValue(float(val))
-            self.update(ul=False, xpd = True, en = False)
-        except:
-            text = '"{}" {} {}'.format(val, self.l.what['problem_a'], self.l.what['atm_0'])
-            self.Update_Info_label(text = text, bkg = self.red)
-            self.AddAtoms_entry_pos_y[atom].setText('{: 5.3f}'.format(self.AddAtoms_slider_y[atom].value()))
-
-    def new_pos_z(self,atom):
-        """ function called when the edit box of the z position of an atom changes """
-        val = self.AddAtoms_entry_pos_z[atom].text()
-        try:
-            self.AddAtoms_slider_z[atom].setValue(float(val))
-            self.update(ul=False, xpd = True, en = False)
-        except:
-            text = '"{}" {} {}'.format(val, self.l.what['problem_a'], self.l.what['atm_0'])
-            self.Update_Info_label(text = text, bkg = self.red)
-            self.AddAtoms_entry_pos_z[atom].setText('{: 5.3f}'.format(self.AddAtoms_slider_z[atom].value()))
-
-    def exclude_atom(self):
-        """ function preparing to exclude an atom from the unit cell """
-        i = self.additional_atoms
-        j = (i)//3
-        k = (i)%3
-        self.layout[j].itemAt(k).widget().deleteLater()
-        self.update(ul=False, xpd = True, en = False)
-
-    def getBaseAtom_color(self):
-        """ function called when the color button of the first atom of the unit cell is pressed. """
-        color = QColorDialog.getColor().name()
-        self.BaseAtoms_entry_0.setStyleSheet(self.LineEdit_StyleSheet(color))
-        self.BaseAtoms_color.setStyleSheet(self.PushButton_StyleSheet2(color))
-        self.BaseAtoms_entry_0_size.setStyleSheet(self.LineEdit_StyleSheet(color))
-        self.color_atom0 = color
-        self.update(xpd = False, en = False)
-        
-    def getAddAtoms_color(self, tf, atom):
-        """ function called when the color button of the atoms of the unit cell are pressed. It calls the stylesheets of the other buttons to change to new color"""
-        color = QColorDialog.getColor().name()
-        self.AddAtoms_color[atom].setStyleSheet(self.PushButton_StyleSheet2(color))
-        self.AddAtoms_entry_At[atom].setStyleSheet(self.LineEdit_StyleSheet(color))
-        self.colors[atom-1] = color
-        self.AddAtoms_groupBox[atom].setStyleSheet(self.GroupBox_StyleSheet(color,'#dddddd'))
-        self.AddAtoms_entry_pos_x[atom].setStyleSheet(self.LineEdit_StyleSheet(color))
-        self.AddAtoms_entry_pos_y[atom].setStyleSheet(self.LineEdit_StyleSheet(color))
-        self.AddAtoms_entry_pos_z[atom].setStyleSheet(self.LineEdit_StyleSheet(color))
-        self.AddAtoms_entry_At_size[atom].setStyleSheet(self.LineEdit_StyleSheet(color))
-        self.update(xpd = False, en = False)
+            order = np.arange(len(xyz))
+            xyz = (xyz - xyz[0])%1.
+            xyz[xyz > 1-1e-6] = 0.
+        types = [types[i] for i in order]
+        species = list(dict.fromkeys(types))
+        colors = [self.colors[species.index(i)%len(self.colors)] for i in types]
+        self.set_lattice_values(structure['lattice'])
+        self.atoms_model.load(types, xyz[order], structure['occupancy'][order], structure['B'][order], size = 200., color = colors)
+        self.select_atom(min(1, len(self.atoms)-1))
+        self.rescale()
 
-    def include_base(self):
-        """ function called in the beginning of the program to load all atoms of the unit cell. """
-        for i in range(len(self.baseAtoms)-1):
-            self.add_Atom(init = True)
-            self.newAtomEntered(i+1, init = True)
+    def set_lattice_values(self, values):
+        """ puts new lattice parameters in the sliders, widening their limits if needed. They also become the values of the reset buttons """
+        for i, value in zip(self.LatticeParams, values):
+            value = float(value)
+            if value < self.par_min[i]:
+                self.par_min[i] = value
+                self.LatticeParams_slider[i].setMinimum(value)
+            if value > self.par_max[i]:
+                self.par_max[i] = value
+                self.LatticeParams_slider[i].setMaximum(value)
+            self.par0[i] = value
+            self.LatticeParams_slider[i].blockSignals(True)
+            self.LatticeParams_slider[i].setValue(value)
+            self.LatticeParams_slider[i].blockSignals(False)
+            self.LatticeParams_entry[i].setText(str(self.LatticeParams_slider[i].value()))
+        limits = int(max(values[:3])) + 1
+        if limits > self.plotlimits_max:
+            self.plotlimits_max = limits
+            self.Vis_slider.setMaximum(limits)
+        self.Vis_slider.setValue(limits)
+
+    def select_atom(self, row):
+        """ selects an atom of the table, so the sliders move it """
+        self.BaseAtoms_table.selectRow(row)
+        self.BaseAtoms_table.setCurrentIndex(self.atoms_model.index(row, 0))
+        self.atom_selected(self.atoms_model.index(row, 0))
+
+    def atom_selected(self, current, previous = None):
+        """ function called when another atom of the table is selected: the sliders show its position. The first atom stays at (0,0,0) """
+        self.selected_atom = max(current.row(), 0)
+        for i, pos in enumerate(['x', 'y', 'z']):
+            self.BaseAtoms_slider_pos[pos].blockSignals(True)
+            self.BaseAtoms_slider_pos[pos].setValue(self.atoms.xyz[self.selected_atom, i])
+            self.BaseAtoms_slider_pos[pos].blockSignals(False)
+            self.BaseAtoms_slider_pos[pos].setEnabled(self.selected_atom > 0)
+
+    def pos_slider_change(self, i):
+        """ function called when a position slider changes: the selected atom is moved """
+        if self.selected_atom == 0: return
+        self.atoms_model.set_position(self.selected_atom, i, self.BaseAtoms_slider_pos['xyz'[i]].value())
+        self.schedule('atoms')
+
+    def atom_double_clicked(self, index):
+        """ the color of an atom is changed with a dialog; the other cells are edited in the table """
+        if self.atoms.columns[index.column()] != 'color': return
+        color = QColorDialog.getColor(QColor(self.atoms.color[index.row()]))
+        if color.isValid(): self.atoms_model.set_color(index.row(), color.name())
+
+    def atom_rejected(self, column, value):
+        """ a value typed in the table was not accepted """
+        text = '"{}" {} {}'.format(value, self.l.what['problem_a'], column)
+        self.Update_Info_label(text = text, bkg = self.red)
+
+    def add_Atom(self):
+        """ function that includes an atom in the unit cell, at (0.5, 0.5, 0.5), with the element and size of the last one """
+        n = len(self.atoms)
+        self.atoms_model.append([self.atoms.get(n-1, 'element')], [0.5, 0.5, 0.5], size = self.atoms.size[n-1], color = self.colors[(n-1)%len(self.colors)])
+        self.select_atom(n)
+        self.BaseAtoms_table.scrollToBottom()
+        self.rescale()
 
+    def rem_Atom(self):
+        """ function that removes the selected atoms of the unit cell, or the last one if none is selected. The first atom is never removed """
+        rows = [i.row() for i in self.BaseAtoms_table.selectionModel().selectedRows()] or [len(self.atoms)-1]
+        self.atoms_model.remove(rows)
+        self.select_atom(min(self.selected_atom, len(self.atoms)-1))
+        self.rescale()
 
 
 
@@ -3224,30 +3595,154 @@ class Window(QMainWindow,QWidget):
     # end
 
 
-    def update(self, ul=False, xpd = True, en = True, from_opts = False):
-        """ this function is called every time the user interacts with the main window. To decrease the time of the calculations and avoid unnecessary calculations, there are 4 (for now, at least) options which shortcut the calculations. """
-        x_add = []
-        y_add = []
-        z_add = []
-        pos_add = []
-        for i in range (self.additional_atoms):
-            x_add.append(self.AddAtoms_slider_x[i+1].value())
-            y_add.append(self.AddAtoms_slider_y[i+1].value())
-            z_add.append(self.AddAtoms_slider_z[i+1].value())
-            pos_add.append([x_add[i], y_add[i], z_add[i]])
-        
-        self.update_unit_cell(pos_add, self.plotlimits)
+    def update(self, *changed):
+        """ this function is called every time the user interacts with the main window, with the names of what was changed: 'lattice', 'atoms', 'energy', 'size', 'grid', 'hkl_max', 'laue', 'extinctions', 'peak_tol' 
+            (the inputs of the engine), 'draft' (a slider was released, so the pattern is calculated again with full quality) or 'view' (only the drawings). Without names, everything is updated. The engine recalculates only what depends on the changes, 
+            and the unit cell is only drawn again when the lattice, the atoms or the view changed. """
+        if not changed: changed = ('lattice', 'atoms', 'energy', 'size', 'grid', 'hkl_max', 'laue', 'extinctions', 'peak_tol', 'view')
+        changed = set(changed) | self.pending_changes
+        self.pending_changes = set()
+        self.redraw_timer.stop()
+        self.last_redraw = time.perf_counter()
+        self.update_lattice()
+        if changed & {'lattice', 'atoms', 'view'}:
+            if self.showHKL_check.isChecked(): self.calc_HKL_planes()
+            self.hkl_planes.set_visible(self.showHKL_check.isChecked())
+            self.update_unit_cell(self.atom_positions()[1:], self.plotlimits)
         self.update_arrow()
-        if ul: self.update_limits()
-        if xpd: self.calculate_xpd(en, from_opts = from_opts)
-        if self.showHKL_check.isChecked(): self.calc_HKL_planes()
+        if changed - {'view'}: self.calculate_xpd()
+        self.blit_pXRD()
+
+    def schedule(self, *changed):
+        """ called by the sliders, which change many times per second while dragged: the changes are kept and update() runs with all of them together, at most fps times per second """
+        self.pending_changes.update(changed)
+        if not self.redraw_timer.isActive():
+            wait = 1000./self.fps - 1000*(time.perf_counter() - self.last_redraw)
+            self.redraw_timer.start(max(0, int(wait)))
+
+    def flush(self):
+        """ runs update() with the pending changes right now. Called by the timer and when a slider is released """
+        if self.pending_changes: self.update(*self.pending_changes)
+
+    def set_fps(self, fps):
+        """ maximum number of redraws per second while dragging the sliders """
+        self.fps = fps
+        return self.fps
+
+    def set_draft_step(self, draft_step):
+        """ while dragging a slider, the tth step is multiplied by this number """
+        self.draft_step = draft_step
+        return self.draft_step
+
+    def set_draft_hkl(self, draft_hkl):
+        """ while dragging a slider, H, K and L go only up to this value """
+        self.draft_hkl = draft_hkl
+        return self.draft_hkl
+
+    def set_draft_peak_tol(self, draft_peak_tol):
+        """ while dragging a slider, the peaks are cut where they fall below this fraction of their maximum """
+        self.draft_peak_tol = draft_peak_tol
+        return self.draft_peak_tol
+
+    def set_cache_mb(self, cache_mb):
+        """ memory (in MB) of the cache of patterns """
+        self.cache_mb = cache_mb
+        self.pattern_cache.set_limit(int(cache_mb*2**20))
+        return self.cache_mb
+
+    def set_precompute(self, precompute):
+        """ positions (pixels) to each side of the slider used last whose patterns are calculated in advance while idle """
+        self.precompute = precompute
+        if precompute <= 0 and self.worker is not None: self.speculator.cancel()
+        return self.precompute
+
+    def set_precompute_cpu(self, precompute_cpu):
+        """ fraction of one CPU that the calculation in advance may take """
+        self.precompute_cpu = precompute_cpu
+        if self.worker is not None: self.speculator.cpu = precompute_cpu
+        return self.precompute_cpu
+
+    def slider_pressed(self):
+        """ while a slider is pressed, the patterns are drafts, and the symmetry found before is kept: moving an atom only updates F, and never waits for the symmetry to be found again """
+        self.dragging = True
+        self.engine.freeze_symmetry(True)
+        self.active_slider = self.sender()
+
+    def speculate(self):
+        """ when nothing is being calculated, asks the speculator for the patterns of the positions next to the current one of the slider used last (only the lattice 
+            and the crystal size, whose next states are known exactly): first the drafts of a new drag, then the full patterns. Speculation uses at most half of the cache """
+        if self.precompute <= 0 or self.worker is None or self.dragging or not self.worker.idle(): return
+        axis = self.speculation_axis(self.active_slider)
+        if axis is None: return
+        values = self.slider_neighbours(self.active_slider, self.precompute)
+        tasks = []
+        room = self.pattern_cache.limit/2.
+        for state in [self.draft_state(), self.engine.state()]:
+            todo = []
+            for value in values:
+                key = self.pattern_cache.key(self.speculation_state(state, axis, value))
+                size = self.pattern_cache.nbytes(key) + 16*len(np.arange(*state['grid']))
+                if key in self.pattern_cache or size > room: continue
+                room -= size
+                todo.append(value)
+            if todo: tasks.append((state, axis, todo))
+        if tasks: self.speculation = (self.speculator.request(tasks), tasks)
+
+    def speculated(self, generation, task, values, tth, intensities):
+        """ receives patterns calculated in advance and keeps them in the cache """
+        if self.speculation is None or generation != self.speculation[0]: return
+        state, axis = self.speculation[1][task][:2]
+        for value, intensity in zip(values, intensities):
+            self.pattern_cache.put(self.pattern_cache.key(self.speculation_state(state, axis, float(value))), tth, np.array(intensity))
+
+    def speculation_axis(self, slider):
+        """ the axis of the engine changed by a slider: the index of a lattice parameter or 'size'. None for the others """
+        for i, name in enumerate(self.LatticeParams):
+            if slider is self.LatticeParams_slider[name]: return i
+        if slider is self.CrystalSize_slider: return 'size'
+        return None
+
+    def speculation_state(self, state, axis, value):
+        """ the state with another value along an axis """
+        state = dict(state)
+        if axis == 'size': state['size'] = value
+        else: state['lattice'] = tuple(value if i == axis else j for i, j in enumerate(state['lattice']))
+        return state
+
+    def slider_neighbours(self, slider, n):
+        """ the values a DoubleSlider takes when dragged up to n pixels to each side of where it is, the nearest first. They are found as Qt does when the mouse moves """
+        option = QStyleOptionSlider()
+        slider.initStyleOption(option)
+        groove = slider.style().subControlRect(QStyle.CC_Slider, option, QStyle.SC_SliderGroove, slider)
+        handle = slider.style().subControlRect(QStyle.CC_Slider, option, QStyle.SC_SliderHandle, slider)
+        span = groove.width() - handle.width()
+        if span <= 0: return []
+        low, high, tick = slider.minimum(), slider.maximum(), QSlider.value(slider)
+        here = QStyle.sliderPositionFromValue(low, high, tick, span)
+        ticks = []
+        for i in range(1, n+1):
+            for position in [here + i, here - i]:
+                if 0 <= position <= span:
+                    value = QStyle.sliderValueFromPosition(low, high, position, span)
+                    if value != tick and value not in ticks: ticks.append(value)
+        return [float(i)/slider._multi for i in ticks]
+
+    def slider_released(self):
+        """ when the slider is released, the pending changes are done at once and the pattern is calculated again with full quality, with the symmetry of the new structure """
+        self.dragging = False
+        self.engine.freeze_symmetry(False)
+        self.update('draft', *self.pending_changes)
 
     def rescale(self):
-        """ rescales the main axis in order to show all parts of the curves. """
+        """ rescales the main axis in order to show all parts of the curves. If a pattern is still being calculated, it is done when it arrives. """
+        if self.worker is not None and not self.worker.idle():
+            self.rescale_pending = True
+            return
         max = []
         for i in range(len(self.colored_plots)):
             if self.colored_plots[i].get_visible():
                 max.append(self.colored_plots[i].get_ydata().max())
+        if self.sweep_plot.get_visible() and len(self.sweep_plot.get_ydata()): max.append(self.sweep_plot.get_ydata().max())
         max.append(self.intensity.max())
         a = np.array(max).max()
         self.pXRDax.set_ylim(-5, a*1.2)
@@ -3255,278 +3750,121 @@ class Window(QMainWindow,QWidget):
         self.XPDcanvas.draw()
 
     def update_unit_cell(self, pos_add, plotlimits):
-        """ ths fucntion updates the unit cell 3D axis, putting the atoms in the desired positions with the desired colors, and positioning the edges and faces. Also includes the HKL planes.
-            The code is big because of the inclusion of the extra unit cells. """
-        #def set_pos(x, y, z): return [x*a_su+y*b_su*cg+z*c_su*cb,y*b_su*sg+z*c_su*abg,z*c_su*np.sqrt(sb*sb-abg*abg)]
-        x = []
-        y = []
-        z = []
-        pos = []
-        unit_cell = []
+        """ ths fucntion updates the unit cell 3D axis, putting the atoms in the desired positions with the desired colors, and positioning the edges and faces.
+            All the positions, including the ones of the extra unit cells, are transformed to cartesian in a single call. """
+        pos_add = np.asarray(pos_add, dtype = float).reshape(-1, 3)
+        n = len(pos_add)
         mult = 3./(self.plotlimits-2)
         if self.Extended_cells_check.isChecked():
             noc = 3
         else:
             noc = 2
-        for _ii in range(noc):
-            for _jj in range (noc):
-                for _kk in range (noc):
-                    pos.append(self.set_pos(_ii, _jj, _kk))
-                    if _ii < 2 and _jj < 2 and _kk < 2: unit_cell.append(self.set_pos(_ii, _jj, _kk))
-        self.scatter = []
-        colors = []
-        sizes = []
-        for i in range (len(pos)):
-            x.append(pos[i][0])
-            y.append(pos[i][1])
-            z.append(pos[i][2])
-            colors.append(self.color_atom0)
-            
-            sizes.append(self.sizes_init[0]*mult)
-        
-        verts = [[pos[0],pos[1],pos[3],pos[2]], [pos[4],pos[5],pos[7],pos[6]], 
-                [pos[0],pos[1],pos[5],pos[4]],  [pos[2],pos[3],pos[7],pos[6]], 
-                [pos[1],pos[3],pos[7],pos[5]],  [pos[4],pos[6],pos[2],pos[0]]]
-                
+        corners = np.indices((noc, noc, noc)).reshape(3, -1).T
+        cell = np.indices((2, 2, 2)).reshape(3, -1).T
+        unit_cell = np.array(self.set_pos(*cell.T)).T
+        if self.Extended_cells_check.isChecked(): cells = cell
+        else: cells = cell[:1]
+        images = (pos_add[:, None, :] + cells[None, :, :]).reshape(-1, 3)
+        x, y, z = self.set_pos(*np.concatenate((corners, images)).T)
+        colors = np.concatenate((np.full(len(corners), self.atoms.color[0]), np.repeat(self.atoms.color[1:n+1], len(cells))))
+        sizes = np.concatenate((np.full(len(corners), self.atoms.size[0]*mult), np.repeat(self.atoms.size[1:n+1]*mult, len(cells))))
+
         verts = [[unit_cell[0],unit_cell[1],unit_cell[3],unit_cell[2]], [unit_cell[4],unit_cell[5],unit_cell[7],unit_cell[6]], 
                 [unit_cell[0],unit_cell[1],unit_cell[5],unit_cell[4]],  [unit_cell[2],unit_cell[3],unit_cell[7],unit_cell[6]], 
                 [unit_cell[1],unit_cell[3],unit_cell[7],unit_cell[5]],  [unit_cell[4],unit_cell[6],unit_cell[2],unit_cell[0]]]
 
-        self.Crystalax.cla()
         if self.Edge_check.isChecked(): lw_ = 2
         else: lw_ = 0
         if self.Face_check.isChecked(): alpha_ = 0.25
         else: alpha_ = 0
-        self.verts = self.Crystalax.add_collection3d(Poly3DCollection(verts, facecolors = self.crysface_color, linewidths=lw_, edgecolors=self.crysedge_color, alpha=alpha_))
-        self.Crystalax.set_xlabel('a')
-        self.Crystalax.set_ylabel('b')
-        self.Crystalax.set_zlabel('c')
-        for i in range(len(pos_add)):
-            edge_atoms_x = False
-            edge_atoms_y = False
-            edge_atoms_z = False
-            res = self.set_pos(pos_add[i][0], pos_add[i][1], pos_add[i][2])
-            x.append(res[0])
-            y.append(res[1])
-            z.append(res[2])
-            bk_color = self.AddAtoms_entry_pos_y[i+1].palette().color(self.AddAtoms_entry_pos_y[i+1].backgroundRole())
-            colors.append(bk_color.name())
-            sizes.append(self.sizes_init[i+1]*mult)
-            if self.Extended_cells_check.isChecked():
-                for _ii in range(2):
-                    for _jj in range(2):
-                        for _kk in range(2):
-                            if _ii != 0 or _jj != 0 or _kk != 0:
-                                res = self.set_pos(pos_add[i][0]+_ii, pos_add[i][1]+_jj, pos_add[i][2]+_kk)
-                                x.append(res[0])
-                                y.append(res[1])
-                                z.append(res[2])
-                                bk_color = self.AddAtoms_entry_pos_y[i+1].palette().color(self.AddAtoms_entry_pos_y[i+1].backgroundRole())
-                                colors.append(bk_color.name())
-                                sizes.append(self.sizes_init[i+1]*mult)
-            if False:
-                if self.Include_edge_atoms_check.isChecked():
-                    if pos_add[i][0] == 0.0:
-                        pos_x = 1
-                        if self.Extended_cells_check.isChecked():
-                            pos_x += 1
-                        edge_atoms_x = True
-                    elif pos_add[i][0] == 1.0:
-                        pos_x = 0
-                        edge_atoms_x = True
-                    if pos_add[i][1] == 0.0:
-                        pos_y = 1
-                        if self.Extended_cells_check.isChecked():
-                            pos_y += 1
-                        edge_atoms_y = True
-                    elif pos_add[i][1] == 1.0:
-                        pos_y = 0
-                        edge_atoms_y = True
-                    if pos_add[i][2] == 0.0:
-                        pos_z = 1
-                        if self.Extended_cells_check.isChecked():
-                            pos_z += 1
-                        edge_atoms_z = True
-                    elif pos_add[i][0] == 1.0:
-                        pos_z = 0
-                        edge_atoms_z = True
-                    if edge_atoms_x:
-                        res = self.set_pos(pos_x, pos_add[i][1], pos_add[i][2])
-                        x.append(res[0])
-                        y.append(res[1])
-                        z.append(res[2])
-                        bk_color = self.AddAtoms_entry_pos_y[i+1].palette().color(self.AddAtoms_entry_pos_y[i+1].backgroundRole())
-                        colors.append(bk_color.name())
-                        sizes.append(self.sizes_init[i+1]*mult)
-                        if edge_atoms_y:
-                            res = self.set_pos(pos_x, pos_y, pos_add[i][2])
-                            x.append(res[0])
-                            y.append(res[1])
-                            z.append(res[2])
-                            bk_color = self.AddAtoms_entry_pos_y[i+1].palette().color(self.AddAtoms_entry_pos_y[i+1].backgroundRole())
-                            colors.append(bk_color.name())
-                            sizes.append(self.sizes_init[i+1]*mult)
-                        elif edge_atoms_z:
-                            res = self.set_pos(pos_x, pos_add[i][1], pos_z)
-                            x.append(res[0])
-                            y.append(res[1])
-                            z.append(res[2])
-                            bk_color = self.AddAtoms_entry_pos_y[i+1].palette().color(self.AddAtoms_entry_pos_y[i+1].backgroundRole())
-                            colors.append(bk_color.name())
-                            sizes.append(self.sizes_init[i+1]*mult)
-                    if edge_atoms_y:
-                        res = self.set_pos(pos_add[i][0], pos_y, pos_add[i][2])
-                        x.append(res[0])
-                        y.append(res[1])
-                        z.append(res[2])
-                        bk_color = self.AddAtoms_entry_pos_y[i+1].palette().color(self.AddAtoms_entry_pos_y[i+1].backgroundRole())
-                        colors.append(bk_color.name())
-                        sizes.append(self.sizes_init[i+1]*mult)
-                        if edge_atoms_z:
-                            res = self.set_pos(pos_add[i][0], pos_y, pos_z)
-                            x.append(res[0])
-                            y.append(res[1])
-                            z.append(res[2])
-                            bk_color = self.AddAtoms_entry_pos_y[i+1].palette().color(self.AddAtoms_entry_pos_y[i+1].backgroundRole())
-                            colors.append(bk_color.name())
-                            sizes.append(self.sizes_init[i+1]*mult)
-                    if edge_atoms_z:
-                        res = self.set_pos(pos_add[i][0], pos_add[i][1], pos_z)
-                        x.append(res[0])
-                        y.append(res[1])
-                        z.append(res[2])
-                        bk_color = self.AddAtoms_entry_pos_y[i+1].palette().color(self.AddAtoms_entry_pos_y[i+1].backgroundRole())
-                        colors.append(bk_color.name())
-                        sizes.append(self.sizes_init[i+1]*mult)
-                               
-            
-        
-        if self.Atoms_check.isChecked(): self.scatter = self.Crystalax.scatter3D (x, y, z, color=colors, s = sizes)
-        #self.Crystalax.pbaspect = [1.0, 1.0, 1.5]
-        self.Crystalax.set_box_aspect((1.0, 1.0, 1.0))
+        self.verts.set_verts(verts)
+        self.verts.set_linewidth(lw_)
+        self.verts.set_alpha(alpha_)
+
+        self.scatter._offsets3d = (x, y, z)
+        self.scatter.set_facecolor(colors)
+        self.scatter.set_edgecolor(colors)
+        self.scatter.set_sizes(sizes)
+        self.scatter.set_visible(self.Atoms_check.isChecked())
 
         self.Crystalax.set_xlim([-1,plotlimits])
         self.Crystalax.set_ylim([-1,plotlimits])
         self.Crystalax.set_zlim([-1,plotlimits])
-        self.Crystalcanvas.draw()
-        
-    def set_pos(self,x,y,z): 
-        """ this function calculates the x,y and z positions of the atoms in an unit cell, based in their fractional positions """
-        a_su = self.LatticeParams_slider['a'].value()
-        b_su = self.LatticeParams_slider['b'].value()
-        c_su = self.LatticeParams_slider['c'].value()
-        alpha_su = self.LatticeParams_slider['alpha'].value()
-        beta_su = self.LatticeParams_slider['beta'].value()
-        gamma_su = self.LatticeParams_slider['gamma'].value()
-        sa = np.sin(alpha_su*self.degree)
-        ca = np.cos(alpha_su*self.degree)
-        sb = np.sin(beta_su*self.degree)
-        cb = np.cos(beta_su*self.degree)
-        sg = np.sin(gamma_su*self.degree)
-        cg = np.cos(gamma_su*self.degree)
-        abg = (ca-cg*cb)/sg
-        return [x*a_su+y*b_su*cg+z*c_su*cb,y*b_su*sg+z*c_su*abg,z*c_su*np.sqrt(sb*sb-abg*abg)]
-
-    def calculate_xpd(self, en, from_opts):
-        """ function that calculates the powder diffration intensity, based on the structure factor, energy dependent form factors and a normalization with Q^-2 """
-        self.intensity = np.zeros (len(self.tth_range))
-        wvl = self.Wvl_slider.value()
-        CrysSize = self.CrystalSize_slider.value()
-        for hkl in self.list_of_hkl_used:
-            Q = self.Qhkl(*hkl)
-            self.intensity += self.calculate_F2(hkl, en, Q)*self.calculate_intensity(hkl, wvl, Q, CrysSize)/(Q*Q)
-        if from_opts:
-            self.main_plot.set_data(self.tth_range, self.intensity)
+        self.Crystalcanvas.draw_idle()
+        
+    def set_pos(self, x, y, z): 
+        """ this function calculates the x,y and z positions of the atoms in an unit cell, based in their fractional positions. x, y and z can be numbers or arrays of any shape; 
+            the orthogonalization matrix is kept by the engine for the lattice given to it by update_lattice """
+        xyz = self.engine.cartesian(np.stack(np.broadcast_arrays(x, y, z), axis = -1))
+        return [xyz[...,0], xyz[...,1], xyz[...,2]]
+
+    def calculate_xpd(self):
+        """ function that gives the values of the widgets to the engine. The powder diffration intensity is calculated by the worker thread, or here before it starts """
+        self.engine.set_atoms(self.atoms.types(), self.atom_positions(), self.atoms.occupancy, self.atoms.B)
+        self.engine.set_energy(self.E, self.Wvl_slider.value())
+        self.engine.set_size(self.CrystalSize_slider.value())
+        state = self.draft_state() if self.dragging and self.worker is not None else self.engine.state()
+        key = self.pattern_cache.key(state)
+        cached = self.pattern_cache.get(key)
+        if self.worker is not None: self.speculator.cancel()
+        if cached is not None:
+            if self.worker is not None: 
+                self.worker.skip()
+                if not self.dragging: self.speculate_timer.start(200)
+            self.intensity = cached[1]
+            self.main_plot.set_data(*cached)
+        elif self.worker is None:
+            tth, self.intensity = self.engine.calculate()
+            self.pattern_cache.put(key, tth, self.intensity)
+            self.main_plot.set_data(tth, self.intensity)
         else:
-            self.main_plot.set_ydata(self.intensity)
-        self.XPDcanvas.draw_idle()
+            self.cache_keys[self.worker.request(state, draft = self.dragging)] = key
+
+    def draft_state(self):
+        """ the inputs of the engine for a draft: coarser tth grid, smaller HKLs and shorter peaks """
+        state = self.engine.state()
+        tth_min, tth_max, tth_step = state['grid']
+        state.update({'grid':(tth_min, tth_max, tth_step*self.draft_step),
+                      'hkl_max':tuple(min(i, self.draft_hkl) for i in state['hkl_max']),
+                      'peak_tol':max(state['peak_tol'], self.draft_peak_tol)})
+        return state
+
+    def xpd_calculated(self, generation, tth, intensity):
+        """ receives a pattern from the worker thread and keeps it in the cache. Only the latest one requested is plotted """
+        key = self.cache_keys.pop(generation, None)
+        for i in [i for i in self.cache_keys if i < generation]: del self.cache_keys[i] # abandoned
+        if key is not None: self.pattern_cache.put(key, tth, intensity)
+        if generation != self.worker.generation: return
+        if not self.dragging: self.speculate_timer.start(200)
+        self.intensity = intensity
+        self.main_plot.set_data(tth, intensity)
+        if self.rescale_pending:
+            self.rescale_pending = False
+            self.rescale()
+        else:
+            self.blit_pXRD()
 
-    def update_limits(self):
-        """ function that updates the list of HKL used for calculating the scattering pattern based on the limits of the Q Qmin and Qmax """
-        self.list_of_hkl_used = []
-        for _ii in self.list_of_hkl:
-            Q = self.Qhkl(*_ii)
-            if (Q > self.Qi) and (Q < self.Qf):
-                self.list_of_hkl_used.append(_ii)
+    def update_lattice(self):
+        """ gives the values of the lattice sliders to the engine. Nothing is recalculated if they did not change. """
+        return self.engine.set_lattice(*[self.LatticeParams_slider[i].value() for i in self.LatticeParams])
 
     def Qhkl(self,h,k,l):
         """ returns the Q value of a HKL peak"""
-        a = self.LatticeParams_slider['a'].value()
-        b = self.LatticeParams_slider['b'].value()
-        c = self.LatticeParams_slider['c'].value()
-        alpha = self.LatticeParams_slider['alpha'].value()
-        beta = self.LatticeParams_slider['beta'].value()
-        gamma = self.LatticeParams_slider['gamma'].value()
-        ha = h/a
-        kb = k/b
-        lc = l/c
-        sa = np.sin(alpha*self.degree)
-        ca = np.cos(alpha*self.degree)
-        sb = np.sin(beta*self.degree)
-        cb = np.cos(beta*self.degree)
-        sg = np.sin(gamma*self.degree)
-        cg = np.cos(gamma*self.degree)
-        return 2*np.pi*np.sqrt((ha*sa*ha*sa+ kb*sb*kb*sb+ lc*sg*lc*sg + 2*ha*kb*(ca*cb-cg)+ 2*ha*lc*(ca*cg-cb) + 2*kb*lc*(cb*cg-ca))/(1.-ca*ca-cb*cb-cg*cg+2*ca*cb*cg))
-
-    def calculate_F2(self,hkl,en_, Q):
-        """ Function which calculates the structure factor. Many approaches were tried in order to descrease the time of the calculation. The best was this last one. """
-        en = self.E*1000
-        if False: # this one here was not the best
-            atom = eval('xu.materials.elements.{}'.format(str(self.Atom_types[0])))
-            Fhkl = atom.f0(Q)+ atom.f1(en)+1j*atom.f2(en)
-            for i in range (self.additional_atoms):
-                 atom = eval('xu.materials.elements.{}'.format(str(self.Atom_types[i+1])))
-                 f = atom.f0(Q)+atom.f1(en)+1j*atom.f2(en)
-                 pos = [self.AddAtoms_slider_x[i+1].value(),self.AddAtoms_slider_y[i+1].value(),self.AddAtoms_slider_z[i+1].value()]
-                 Fhkl += f*np.exp(-2*np.pi*1j*np.dot(hkl,pos))
-            return np.power(np.abs(Fhkl),2)
-        else:
-            s = 'h{}k{}l{}'.format(*hkl)
-            if en_:
-                atom = eval('xu.materials.elements.{}'.format(str(self.Atom_types[0])))
-                Fhkl = atom.f0(Q)+ atom.f1(en)+1j*atom.f2(en)
-                self.Fhkl.update({s:Fhkl})
-                self.f = {}
-            else:
-                try:
-                    Fhkl = self.Fhkl[s]
-                except:
-                    atom = eval('xu.materials.elements.{}'.format(str(self.Atom_types[0])))
-                    Fhkl = atom.f0(Q)+ atom.f1(en)+1j*atom.f2(en)
-                    self.Fhkl.update({s:Fhkl})
-            for i in range (self.additional_atoms):
-                 s2 = 'h{}k{}l{}i{}'.format(*hkl,i)
-                 if en_:
-                    atom = eval('xu.materials.elements.{}'.format(str(self.Atom_types[i+1])))
-                    f = atom.f0(Q)+atom.f1(en)+1j*atom.f2(en)
-                    self.f.update({s2:f})
-                 else:
-                    try:
-                        f = self.f[s2]
-                    except:
-                        atom = eval('xu.materials.elements.{}'.format(str(self.Atom_types[i+1])))
-                        f = atom.f0(Q)+atom.f1(en)+1j*atom.f2(en)
-                        self.f.update({s2:f})
-                 pos = [self.AddAtoms_slider_x[i+1].value(),self.AddAtoms_slider_y[i+1].value(),self.AddAtoms_slider_z[i+1].value()]
-                 Fhkl += f*np.exp(-2*np.pi*1j*np.dot(hkl,pos))
-            abs = np.abs(Fhkl)
-        return abs*abs
+        self.update_lattice()
+        return float(self.engine.Qhkl([h, k, l]))
+
+    def atom_positions(self):
+        """ returns an (M,3) array with the fractional positions of all atoms of the unit cell, the first one being the atom at the origin """
+        return self.atoms.xyz
 
     def Q2tth(self,Q, wvl): 
         """ function that returns the tth of a given Q. """
-        return 360./np.pi*np.arcsin(Q*wvl/(4*np.pi))
-        
-    def size_width(self,tth, wvl, CrysSize): 
-        """ sherer formula to set the peak width."""
-        return 0.9*wvl/(2.355*CrysSize*np.cos(tth/2.*self.degree))
-
-    def calculate_intensity(self,hkl, wvl, Q, CrysSize): 
-        """ calculates the intensity of a peak"""
-        tth = self.Q2tth(Q, wvl)
-        w = self.size_width(tth, wvl, CrysSize)*360/np.pi
-        return 1./(np.sqrt(2*np.pi)*w)*np.exp(-(self.tth_range-tth)*(self.tth_range-tth)/(2.*w*w))
+        return self.engine.Q2tth(Q, wvl)
 
 if __name__ == '__main__':
+    if '--batch' in sys.argv: # patterns of the structures of a manifest, without any window: see pxrd_batch
+        import pxrd_batch
+        sys.exit(pxrd_batch.main([i for i in sys.argv[1:] if i != '--batch']))
     default = Defaults()
     if not os.path.isfile("pxrd.defaults"): default.createDefault()
     app = QApplication(sys.argv)
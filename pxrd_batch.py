@@ -0,0 +1,136 @@
+""" Calculates the patterns of many structures without the GUI, spread over a pool of processes, each one with its own PatternEngine.
+    A structure that fails is reported with its error and the others are still calculated.
+    The structures are given in a JSON manifest, either a list of them or {"defaults": {...}, "structures": [...]}, where the defaults are used for anything a structure does not give:
+        {"defaults": {"energy": 8.048, "size": 200, "grid": [10, 90, 0.02], "hkl_max": [6, 6, 6]},
+         "structures": [{"name": "NaCl", "lattice": [5.64, 5.64, 5.64, 90, 90, 90], "atoms": [["Na", 0, 0, 0], ["Cl", 0.5, 0.5, 0.5, 1.0, 0.6]]},
+                        {"name": "rutile", "cif": "TiO2.cif", "energy": 17.48}]}
+    Each atom is [type, x, y, z] with an optional occupancy and B (in angstrom^2). A structure can also come from a CIF file (relative to the manifest), and then
+    "lattice" and "atoms" are optional. The other keys are "laue" and "extinctions", as in PatternEngine.
+    Each pattern is written to <out>/<name>.xy, as "2th Int" columns that the main window can load as data. Structures whose file is already there are skipped,
+    so a run which was interrupted continues where it stopped. With --store, all patterns go instead to one memory mapped array (see pxrd_store), with one row
+    for each structure; they must then have the same 2theta grid.
+    Example:
+        python pxrd_batch.py manifest.json -o patterns -j 8
+        python pxrd_batch.py manifest.json -o candidates --store
+        python XRDplayground.py --batch manifest.json -o patterns """
+import numpy as np
+import argparse, json, multiprocessing, os, re, sys, time
+from pxrd_engine import PatternEngine
+from pxrd_cif import read_cif
+from pxrd_store import create_store
+
+DEFAULTS = {'energy': 8.048, 'size': 200., 'grid': (10., 90., 0.02), 'hkl_max': (4, 4, 4), 'laue': 'auto', 'extinctions': 'auto'}
+engine = None # one engine for each process of the pool, so the tables of the form factors are made only once
+
+def read_manifest(filename):
+    """ returns the list of structures of a manifest, each one a dict with all keys (the defaults filled in), its name and the file of its pattern. Raises ValueError """
+    with open(filename) as f: manifest = json.load(f)
+    if isinstance(manifest, list): manifest = {'structures': manifest}
+    defaults = dict(DEFAULTS, **manifest.get('defaults', {}))
+    folder = os.path.dirname(os.path.abspath(filename))
+    structures, names = [], set()
+    for i, structure in enumerate(manifest.get('structures', [])):
+        structure = dict(defaults, **structure)
+        if 'cif' in structure: structure['cif'] = os.path.join(folder, structure['cif'])
+        elif 'lattice' not in structure or 'atoms' not in structure: raise ValueError('structure {} has no "lattice" and "atoms", nor a "cif"'.format(i))
+        name = re.sub(r'[^\w.+-]', '_', str(structure.get('name', os.path.splitext(os.path.basename(structure.get('cif', '')))[0] or 'structure')))
+        if name in names: name = '{}_{}'.format(name, i)
+        names.add(name)
+        structure['name'] = name
+        structures.append(structure)
+    return structures
+
+def simulate(structure, E_min = 5., E_max = 25.):
+    """ calculates the pattern of one structure of the manifest. Returns the 2theta grid and the intensity. Raises KeyError, ValueError or OSError """
+    global engine
+    if engine is None: engine = PatternEngine(E_min = E_min, E_max = E_max)
+    lattice = structure.get('lattice')
+    if 'cif' in structure:
+        cif = read_cif(structure['cif'])
+        if lattice is None: lattice = cif['lattice']
+        types, xyz, occupancy, B = cif['types'], cif['xyz'], cif['occupancy'], cif['B']
+    if 'atoms' in structure:
+        atoms = [list(i) + [1., 0.][len(i)-4:] if len(i) < 6 else list(i) for i in structure['atoms']]
+        if any(len(i) != 6 for i in atoms): raise ValueError('atoms are [type, x, y, z] with an optional occupancy and B')
+        types = [str(i[0]) for i in atoms]
+        xyz, occupancy, B = np.array([i[1:4] for i in atoms], dtype = float), np.array([i[4] for i in atoms], dtype = float), np.array([i[5] for i in atoms], dtype = float)
+    if len(lattice) != 6: raise ValueError('the lattice is a, b, c, alpha, beta, gamma')
+    engine.set_lattice(*[float(i) for i in lattice])
+    engine.set_atoms(types, xyz, occupancy, B)
+    engine.set_energy(float(structure['energy']))
+    engine.set_size(float(structure['size']))
+    engine.set_grid(*[float(i) for i in structure['grid']])
+    engine.set_hkl_max(*[int(i) for i in structure['hkl_max']])
+    engine.set_laue(structure['laue'])
+    engine.set_extinctions(structure['extinctions'])
+    return engine.calculate()
+
+def write_pattern(filename, tth, intensity, header = ''):
+    """ writes the pattern as two columns. It is written to a temporary file first, so an interrupted run never leaves a partial pattern behind """
+    temporary = '{}.{}.tmp'.format(filename, os.getpid())
+    np.savetxt(temporary, np.column_stack((tth, intensity)), fmt = '%.6g', header = header + '2th Int')
+    os.replace(temporary, filename)
+
+def job(args):
+    """ the work of one process of the pool: calculates one pattern and writes it to its file, or returns it if there is no file. 
+        Returns the name, the error (None if it worked), the time it took and the pattern """
+    structure, filename = args
+    start = time.perf_counter()
+    try:
+        tth, intensity = simulate(structure)
+        if filename is not None:
+            write_pattern(filename, tth, intensity, header = '{}\n'.format(structure['name']))
+            intensity = None
+    except Exception as error: # a bad entry of the manifest can fail anywhere, and must not stop the others
+        return structure['name'], '{}: {}'.format(type(error).__name__, error), time.perf_counter() - start, None
+    return structure['name'], None, time.perf_counter() - start, intensity
+
+def run(manifest, out, workers = None, overwrite = False, stream = sys.stderr, store = False):
+    """ calculates the patterns of all structures of a manifest that are not in the folder out yet, as files or in a store. Shows the progress in stream. Returns the names which failed """
+    structures = read_manifest(manifest)
+    if store:
+        grids = set(tuple(float(j) for j in i['grid']) for i in structures)
+        if len(grids) > 1: raise ValueError('the structures of a store must have the same grid')
+        store = create_store(out, [('structure', [i['name'] for i in structures])], np.arange(*grids.pop()) if grids else [])
+        rows = {i['name']:j for j, i in enumerate(structures)}
+        todo = [(i, None) for i in structures]
+        if not overwrite: todo = [todo[i] for i in store.missing()]
+    else:
+        os.makedirs(out, exist_ok = True)
+        todo = [(i, os.path.join(out, i['name'] + '.xy')) for i in structures]
+        if not overwrite: todo = [i for i in todo if not os.path.isfile(i[1])]
+    done = len(structures) - len(todo)
+    if done: print('{} of {} patterns already in {}, skipped'.format(done, len(structures), out), file = stream)
+    failed = []
+    if not todo: return failed
+    start = time.perf_counter()
+    with multiprocessing.Pool(min(workers or os.cpu_count() or 1, len(todo))) as pool:
+        for n, (name, error, seconds, intensity) in enumerate(pool.imap_unordered(job, todo), 1):
+            elapsed = time.perf_counter() - start
+            left = elapsed/n*(len(todo) - n)
+            if error is not None: failed.append(name)
+            elif store: store.write([rows[name]], intensity[None])
+            print('[{:{w}}/{}] {} {} ({:.2f} s, {:.0f} s left)'.format(n, len(todo), name, error or 'ok', seconds, left, w = len(str(len(todo)))), file = stream, flush = True)
+    return failed
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Calculates the powder diffraction patterns of the structures of a manifest, without the GUI')
+    parser.add_argument('manifest', help = 'JSON file with the structures')
+    parser.add_argument('-o', '--out', default = 'patterns', help = 'folder of the patterns (default: patterns)')
+    parser.add_argument('-j', '--workers', type = int, default = None, help = 'number of processes (default: one per CPU)')
+    parser.add_argument('--overwrite', action = 'store_true', help = 'calculate again the patterns that are already in the folder')
+    parser.add_argument('--store', action = 'store_true', help = 'write all patterns to one memory mapped array in the folder, instead of one file each')
+    args = parser.parse_args(argv)
+    try:
+        failed = run(args.manifest, args.out, args.workers, args.overwrite, store = args.store)
+    except (OSError, ValueError) as error:
+        print('{}: {}'.format(args.manifest, error), file = sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        print('interrupted: run it again to continue', file = sys.stderr)
+        return 130
+    if failed: print('{} failed: {}'.format(len(failed), ', '.join(failed)), file = sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
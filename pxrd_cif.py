@@ -0,0 +1,172 @@
+""" Reads crystal structures from CIF files: the cell, the atoms of the asymmetric unit and the symmetry operations, which are applied to give all atoms of the unit cell.
+    The result is kept in a '.npz' file next to the CIF, so reading the same file again does not parse it.
+    Only what a powder pattern needs is read: the types, positions, occupancies and B of the atoms (B from U when only U is given).
+    Example:
+        structure = read_cif('NaCl.cif')
+        engine.set_lattice(*structure['lattice'])
+        engine.set_atoms(structure['types'], structure['xyz'], structure['occupancy'], structure['B']) """
+import numpy as np
+import os, re
+
+CACHE_VERSION = 1 # change it when the parsing changes, so the old cached files are not used
+token = re.compile(r"""#.*|'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(\S+)""")
+
+def tokens(text):
+    """ splits a CIF in its tokens: tags, loop_, data_ and values (quoted or not, and the text fields between lines starting with ';'). Comments are dropped """
+    out = []
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        if lines[i].startswith(';'):
+            field = [lines[i][1:]]
+            i += 1
+            while i < len(lines) and not lines[i].startswith(';'):
+                field.append(lines[i])
+                i += 1
+            out.append('\n'.join(field).strip())
+        else:
+            for match in token.finditer(lines[i]):
+                if match.group(0).startswith('#'): break
+                out.append(next(j for j in match.groups() if j is not None))
+        i += 1
+    return out
+
+def blocks(text):
+    """ returns the single values (tag -> value) and the loops (list of (tags, rows)) of the first data block """
+    items, loops = {}, []
+    t = tokens(text)
+    i, block = 0, 0
+    def ends(i): return i >= len(t) or t[i].startswith('_') or t[i].lower() == 'loop_' or t[i].lower().startswith('data_')
+    while i < len(t):
+        low = t[i].lower()
+        if low.startswith('data_'):
+            block += 1
+            if block > 1: break
+            i += 1
+        elif low == 'loop_':
+            i += 1
+            tags = []
+            while i < len(t) and t[i].startswith('_'):
+                tags.append(t[i].lower())
+                i += 1
+            values = []
+            while not ends(i):
+                values.append(t[i])
+                i += 1
+            if not tags or len(values)%len(tags): raise ValueError('loop with {} values for {} tags'.format(len(values), len(tags)))
+            loops.append((tags, [values[j:j+len(tags)] for j in range(0, len(values), len(tags))]))
+        elif t[i].startswith('_'):
+            if i+1 >= len(t): raise ValueError('no value for {}'.format(t[i]))
+            items[low] = t[i+1]
+            i += 2
+        else:
+            i += 1
+    return items, loops
+
+def number(value, default = None):
+    """ a number of the CIF, without its uncertainty: '5.6402(3)' -> 5.6402. '?' and '.' are unknown values """
+    if value is None or value in ('?', '.'): return default
+    return float(re.sub(r'\(\d*\)$', '', value))
+
+def fraction(text):
+    """ '1/2' -> 0.5, '0.25' -> 0.25 """
+    if '/' in text:
+        a, b = text.split('/')
+        return float(a)/float(b)
+    return float(text)
+
+def operation(text):
+    """ a symmetry operation such as '-x+1/2, y, -z' as the matrix R and the translation t of x' = R x + t """
+    R, t = np.zeros((3, 3)), np.zeros(3)
+    parts = text.replace(' ', '').lower().split(',')
+    if len(parts) != 3: raise ValueError('"{}" is not a symmetry operation'.format(text))
+    for row, part in enumerate(parts):
+        terms = re.findall(r'([+-]?)([\d./]*)\*?([xyz]?)', part)
+        if ''.join(''.join(i) for i in terms) != part: raise ValueError('"{}" is not a symmetry operation'.format(text))
+        for sign, value, axis in terms:
+            if not value and not axis: continue
+            value = (-1. if sign == '-' else 1.)*(fraction(value) if value else 1.)
+            if axis: R[row, 'xyz'.index(axis)] += value
+            else: t[row] += value
+    return R, t
+
+def loop(loops, tag):
+    """ the loop which has the tag, as a dict tag -> column """
+    for tags, rows in loops:
+        if tag in tags: return {j:[r[i] for r in rows] for i, j in enumerate(tags)}
+    return None
+
+def expand(xyz, R, t, tol = 1e-3):
+    """ applies all operations (R, t) to each position of the asymmetric unit. Returns the different positions, inside the cell, and the site each one came from """
+    positions, sites = [], []
+    for i, p in enumerate(xyz):
+        images = (np.einsum('nij,j->ni', R, p) + t)%1.
+        images[images > 1-1e-6] = 0.
+        d = images[:, None, :] - images[None, :, :]
+        d -= np.rint(d)
+        first = np.argmax(np.all(np.abs(d) < tol, axis = 2), axis = 1) # the first image at the same place as each one
+        images = images[first == np.arange(len(images))]
+        positions.append(images)
+        sites += [i]*len(images)
+    return np.concatenate(positions), np.array(sites, dtype = int)
+
+def parse_cif(text):
+    """ returns the structure of a CIF: name, lattice (a, b, c, alpha, beta, gamma), and types, xyz, occupancy and B (angstrom^2) of all atoms of the unit cell. Raises ValueError """
+    items, loops = blocks(text)
+    lattice = [number(items.get('_cell_length_'+i)) for i in 'abc'] + [number(items.get('_cell_angle_'+i), 90.) for i in ['alpha', 'beta', 'gamma']]
+    if None in lattice: raise ValueError('the cell is not complete')
+    ops = None
+    for tag in ['_space_group_symop_operation_xyz', '_symmetry_equiv_pos_as_xyz']:
+        ops = loop(loops, tag) or ({tag:[items[tag]]} if tag in items else None)
+        if ops is not None:
+            ops = [operation(i) for i in ops[tag]]
+            break
+    if ops is None: ops = [(np.eye(3), np.zeros(3))] # no operations: the atoms are all the atoms of the cell
+    R = np.array([i[0] for i in ops])
+    t = np.array([i[1] for i in ops])
+    sites = loop(loops, '_atom_site_fract_x')
+    if sites is None: raise ValueError('no atoms')
+    n = len(sites['_atom_site_fract_x'])
+    labels = sites.get('_atom_site_label', ['']*n)
+    types = [re.match(r'[A-Za-z]*\d*[+-]?', i).group(0) for i in sites.get('_atom_site_type_symbol', labels)]
+    xyz = np.array([[number(sites['_atom_site_fract_'+j][i]) for j in 'xyz'] for i in range(n)], dtype = float)
+    if np.isnan(xyz).any(): raise ValueError('unknown positions')
+    occupancy = np.array([number(i, 1.) for i in sites.get('_atom_site_occupancy', ['?']*n)])
+    if '_atom_site_b_iso_or_equiv' in sites: B = np.array([number(i, 0.) for i in sites['_atom_site_b_iso_or_equiv']])
+    else: B = 8*np.pi**2*np.array([number(i, 0.) for i in sites.get('_atom_site_u_iso_or_equiv', ['?']*n)])
+    xyz, site = expand(xyz, R, t)
+    return {'name':       np.array(items.get('_chemical_name_mineral', items.get('_chemical_formula_sum', ''))),
+            'lattice':    np.array(lattice),
+            'types':      np.array(types)[site],
+            'labels':     np.array(labels)[site],
+            'xyz':        xyz,
+            'occupancy':  occupancy[site],
+            'B':          B[site]}
+
+def read_cif(filename, cache = True):
+    """ reads a CIF file (see parse_cif). The parsed structure is saved in filename + '.npz', which is used instead of the CIF while the CIF is not changed """
+    stat = os.stat(filename)
+    key = np.array([CACHE_VERSION, stat.st_size, stat.st_mtime_ns])
+    cached = filename + '.npz'
+    if cache and os.path.isfile(cached):
+        try:
+            with np.load(cached) as data:
+                if np.array_equal(data['key'], key): return {i:data[i] for i in data.files if i != 'key'}
+        except (OSError, KeyError, ValueError):
+            pass
+    with open(filename, encoding = 'utf-8', errors = 'replace') as f: structure = parse_cif(f.read())
+    if cache:
+        try:
+            np.savez_compressed(cached, key = key, **structure)
+        except OSError: # a folder where one can not write: no cache
+            pass
+    return structure
+
+def element(symbol, elements):
+    """ the name of an element of the CIF for the engine (an Elements of pxrd_engine): 'Fe3+' -> 'Fe3p'. Ions which are not known are taken as the neutral atom """
+    for i in [symbol, re.sub(r'\d*[+-]$', '', symbol), symbol[:2], symbol[:1]]:
+        try:
+            return elements.get(i).name
+        except KeyError:
+            pass
+    raise KeyError(symbol)
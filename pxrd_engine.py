@@ -0,0 +1,911 @@
+""" The calculation of the powder diffraction pattern, without any widget. This module does not import PyQt5 nor matplotlib, so it can be used
+    by scripts and batch jobs: the lattice, the atoms, the energy, the crystallite size and the 2theta grid are given as plain values to a PatternEngine. """
+import numpy as np
+import xrayutilities as xu
+import itertools, re, threading
+from collections import OrderedDict
+
+class Lattice():
+    """ Metric tensors and orthogonalization matrix of the unit cell. The trigonometry is done only once for each set of lattice parameters, so the Q values of the whole list of HKLs come from a single numpy call. """
+    def __init__(self):
+        self.degree = np.pi/180.
+        self.parameters = None
+        
+    def set_parameters(self, a, b, c, alpha, beta, gamma):
+        """ recalculates the metric tensors only if the lattice parameters have changed. Returns True if they changed. """
+        parameters = (a, b, c, alpha, beta, gamma)
+        if parameters == self.parameters: return False
+        self.parameters = parameters
+        ca = np.cos(alpha*self.degree)
+        cb = np.cos(beta*self.degree)
+        cg = np.cos(gamma*self.degree)
+        sg = np.sin(gamma*self.degree)
+        abg = (ca-cg*cb)/sg
+        self.M = np.array([[a, b*cg, c*cb],
+                           [0, b*sg, c*abg],
+                           [0, 0,    c*np.sqrt(max(1-cb*cb-abg*abg, 0))]])
+        self.G = np.array([[a*a,    a*b*cg, a*c*cb],
+                           [a*b*cg, b*b,    b*c*ca],
+                           [a*c*cb, b*c*ca, c*c   ]])
+        try:
+            self.G_star = np.linalg.inv(self.G)
+        except np.linalg.LinAlgError: # angles that do not close a cell: no peaks at all
+            self.G_star = np.full((3,3), np.nan)
+        return True
+        
+    def cartesian(self, positions):
+        """ returns the cartesian coordinates of an (...,3) array of fractional positions, with a along x and b in the xy plane """
+        return np.asarray(positions, dtype = float) @ self.M.T
+
+    def tensors(self, parameters):
+        """ returns the metric tensors G of an (M,6) array of lattice parameters (a, b, c, alpha, beta, gamma), all in one numpy call """
+        a, b, c, alpha, beta, gamma = np.asarray(parameters, dtype = float).reshape(-1, 6).T
+        ca, cb, cg = np.cos(alpha*self.degree), np.cos(beta*self.degree), np.cos(gamma*self.degree)
+        return np.stack([np.stack([a*a,    a*b*cg, a*c*cb], axis = -1),
+                         np.stack([a*b*cg, b*b,    b*c*ca], axis = -1),
+                         np.stack([a*c*cb, b*c*ca, c*c   ], axis = -1)], axis = -2)
+
+    def Q(self, hkl):
+        """ returns the Q values of an (N,3) array of HKLs, or of a single HKL """
+        hkl = np.asarray(hkl, dtype = float)
+        return 2*np.pi*np.sqrt(np.einsum('...i,ij,...j->...', hkl, self.G_star, hkl))
+
+class Symmetry():
+    """ Finds the symmetry operations of the structure from the lattice and the atoms, or takes the Laue class given by the user. HKLs which are equivalent 
+        by the Laue class are merged into one representative with a multiplicity, so that each set of equivalent peaks is calculated only once. 
+        HKLs which are systematically absent, by the centering of the cell or by screw axes and glide planes, are removed before that. 
+        The operations found for a structure are shared by all instances (see detect), so the engines of the window and of its threads search them only once. """
+    detected = OrderedDict()
+    detected_limit = 32
+    detected_lock = threading.Lock()
+
+    def __init__(self, tol = 2e-3):
+        self.tol = tol # in fractional coordinates, when comparing the positions of the atoms (the sliders have a resolution of 0.001)
+        E = np.eye(3, dtype = int)
+        _2x = np.diag([1, -1, -1])
+        _2y = np.diag([-1, 1, -1])
+        _2z = np.diag([-1, -1, 1])
+        _4z = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]])
+        _3z = np.array([[0, -1, 0], [1, -1, 0], [0, 0, 1]])
+        _6z = np.array([[1, -1, 0], [1, 0, 0], [0, 0, 1]])
+        _2_100 = np.array([[1, -1, 0], [0, -1, 0], [0, 0, -1]])
+        _2_110 = np.array([[0, 1, 0], [1, 0, 0], [0, 0, -1]])
+        _3_111 = np.array([[0, 0, 1], [1, 0, 0], [0, 1, 0]])
+        # Laue classes in their standard settings (unique axis b for the monoclinic, hexagonal axes for the trigonal ones)
+        generators = {  '-1':[-E],
+                        '2/m':[_2y, -E],
+                        'mmm':[_2z, _2y, -E],
+                        '4/m':[_4z, -E],
+                        '4/mmm':[_4z, _2x, -E],
+                        '-3':[_3z, -E],
+                        '-3m1':[_3z, _2_100, -E],
+                        '-31m':[_3z, _2_110, -E],
+                        '6/m':[_6z, -E],
+                        '6/mmm':[_6z, _2_100, -E],
+                        'm-3':[_2z, _2y, _3_111, -E],
+                        'm-3m':[_4z, _3_111, -E]}
+        self.laue_classes = {}
+        for i in generators: self.laue_classes.update({i:self.closure(generators[i])})
+        # centering translations of the cell, in twelfths (hexagonal axes, obverse setting for R)
+        self.centerings = { 'P':[],
+                            'A':[(0, 6, 6)],
+                            'B':[(6, 0, 6)],
+                            'C':[(6, 6, 0)],
+                            'I':[(6, 6, 6)],
+                            'F':[(0, 6, 6), (6, 0, 6), (6, 6, 0)],
+                            'R':[(8, 4, 4), (4, 8, 8)]}
+        # every integer matrix with elements -1, 0 and 1 and determinant +-1 is a candidate to be an operation of the lattice
+        m = np.array(list(itertools.product((-1, 0, 1), repeat = 9))).reshape(-1, 3, 3)
+        self.candidates = m[np.abs(np.rint(np.linalg.det(m))) == 1]
+        self.G = None
+        self.key = None
+        self.codes = None
+        self.laue_ops = E[None]
+        self.translations = [np.zeros((1,3))]
+        self.absences = (np.zeros((0, 3, 3), dtype = int), np.zeros((0, 3), dtype = int))
+        self.friedel = False
+        self.name = '1'
+
+    def closure(self, generators):
+        """ returns all the operations of the group built by the generators """
+        ops = [np.eye(3, dtype = int)]
+        new = True
+        while new:
+            new = False
+            for a in list(ops):
+                for g in generators:
+                    b = np.dot(a, g)
+                    if not any(np.array_equal(b, c) for c in ops):
+                        ops.append(b)
+                        new = True
+        return np.array(ops)
+
+    def code(self, ops):
+        """ one integer for each operation, just to compare sets of them """
+        return np.dot(ops.reshape(len(ops), 9) + 1, 3**np.arange(9))
+
+    def metric_operations(self, ops, G = None):
+        """ keeps only the operations R (acting on fractional coordinates) which preserve the metric tensor: R^T G R = G. G can also be an (M,3,3) stack of
+            metric tensors, and then only the operations which preserve all of them are kept """
+        G = self.G if G is None else G
+        for G in G.reshape(-1, 3, 3):
+            if len(ops) == 0: break
+            RGR = np.einsum('nji,jk,nkl->nil', ops, G, ops)
+            ops = ops[np.all(np.abs(RGR - G) <= 1e-6*np.abs(G).max(), axis = (1, 2))]
+        return ops
+
+    def structure_operations(self, positions, species, interrupt = None):
+        """ keeps the operations of the lattice which, with some translation, take every atom onto an atom of the same kind. Returns them with all translations that work for each one.
+            The translations tried take the first atom of the rarest kind onto each atom of that kind. They are checked on a few atoms at a time, the atoms of the rarer kinds first, 
+            and an operation is dropped as soon as no translation is left, so most of the operations of a structure without symmetry cost only a few atoms. The atoms are looked 
+            up in a table of the cells of a grid 1/(2 tol) wide, so each check only compares a position with the atoms in its cell and in the 7 next to it on the side it is closer to. The pure translations 
+            of the structure (a centering, or a supercell) are found first: translations which differ by one of them work for the same operations, so only one of each set is tried. 
+            interrupt is checked before each operation, and raises Cancelled when it returns True """
+        if len(positions) == 0: return self.lattice_ops, [np.zeros((1,3)) for R in self.lattice_ops]
+        kind = np.unique(np.asarray(species), return_inverse = True)[1]
+        counts = np.bincount(kind)
+        rare = np.nonzero(kind == np.argmin(counts))[0]
+        order = np.array([i for i in np.argsort(counts[kind], kind = 'stable') if i != rare[0]], dtype = int)
+        K = int(1/(2*self.tol)) # cells of the grid along each axis: an atom within tol of a position is in its cell or in the next one towards the closer side
+        def cells(k, c): return ((k*K + c[..., 0]%K)*K + c[..., 1]%K)*K + c[..., 2]%K
+        table = cells(kind, np.floor(positions*K).astype(np.int64))
+        sort = np.argsort(table, kind = 'stable')
+        table = table[sort]
+        depth = np.unique(table, return_counts = True)[1].max() # the most atoms of one kind in a cell
+        corners = np.array(list(itertools.product((0, 1), repeat = 3)))
+        def found(p, k):
+            """ True for each of the positions p (...,3) which has an atom of the kind k (...) closer than tol """
+            c = np.floor(p*K)
+            side = np.where(p*K - c < 0.5, -1, 1)
+            codes = cells(k[..., None], c.astype(np.int64)[..., None, :] + corners*side[..., None, :])
+            start, end = np.searchsorted(table, codes), np.searchsorted(table, codes, 'right')
+            hit = np.zeros(p.shape[:-1], dtype = bool)
+            for i in range(depth):
+                d = p[..., None, :] - positions[sort[np.minimum(start + i, len(sort) - 1)]]
+                d -= np.rint(d)
+                hit |= np.any((start + i < end) & np.all(np.abs(d) < self.tol, axis = -1), axis = -1)
+            return hit
+        def search(moved, t):
+            start, size = 0, 1
+            while start < len(order) and len(t):
+                atoms = order[start:start + size]
+                t = t[np.all(found(moved[atoms] + t[:, None, :], np.broadcast_to(kind[atoms], (len(t), len(atoms)))), axis = 1)]
+                start += len(atoms)
+                size = max(1, min(2*size, 2**14//max(len(t), 1)))
+            return t
+        def first(t):
+            """ one number for each set of translations which differ by a pure translation """
+            c = np.rint((t[:, None, :] + pure[None, :, :])*K).astype(np.int64)
+            return cells(0, c).min(axis = 1)
+        pure = search(positions, positions[rare] - positions[rare[0]])
+        step = max(1, 2**20//len(pure))
+        ops = []
+        translations = []
+        for R in self.lattice_ops:
+            if interrupt is not None and interrupt(): raise Cancelled('merged')
+            moved = np.dot(positions, R.T)
+            t = positions[rare] - moved[rare[0]]
+            if len(pure) > 1:
+                t = t[np.sort(np.unique(np.concatenate([first(t[i:i + step]) for i in range(0, len(t), step)]), return_index = True)[1])]
+            t = search(moved, t)
+            if len(t):
+                t = (t[:, None, :] + pure[None, :, :]).reshape(-1, 3)
+                ops.append(R)
+                translations.append(t - np.floor(t + self.tol))
+        return np.array(ops), translations
+
+    def detect(self, positions, species, interrupt = None):
+        """ returns the operations of the structure, their translations and the absences they give (see intrinsic). They are kept for the last structures 
+            and operations of the lattice, so a new lattice with the same operations (as when a length of the cell is dragged) does not search them again. 
+            The positions are compared rounded to 1e-6 """
+        key = (self.tol, self.code(self.lattice_ops).tobytes(), tuple(species), np.rint(np.asarray(positions)*1e6).astype(np.int64).tobytes())
+        with self.detected_lock:
+            if key in self.detected:
+                self.detected.move_to_end(key)
+                return self.detected[key]
+        ops, translations = self.structure_operations(positions, species, interrupt)
+        found = (ops, translations, self.intrinsic(ops, translations))
+        with self.detected_lock:
+            self.detected[key] = found
+            if len(self.detected) > self.detected_limit: self.detected.popitem(last = False)
+        return found
+
+    def intrinsic(self, ops, translations):
+        """ returns the operations with a screw or glide part, or a centering translation, as (R, t) with t in twelfths of the axes. Only the part of t along 
+            the axis or plane of R (the average of t over the powers of R) matters for the absences, and it does not depend on where the origin is """
+        if len(ops) == 0: return np.zeros((0, 3, 3), dtype = int), np.zeros((0, 3), dtype = int)
+        ops = np.asarray(ops, dtype = int)
+        E = np.eye(3, dtype = int)
+        power, powers = np.broadcast_to(E, ops.shape), []
+        for i in range(6): # the order of an operation of a lattice is at most 6
+            powers.append(power)
+            power = np.einsum('nij,njk->nik', power, ops)
+        order = 1 + np.argmax(np.all(np.stack(powers[1:] + [power]) == E, axis = (2, 3)), axis = 0)
+        sums = np.cumsum(np.stack(powers), axis = 0)[order - 1, np.arange(len(ops))]
+        which = np.concatenate([[i]*len(t) for i, t in enumerate(translations)]).astype(int)
+        t = np.concatenate(translations)
+        t12 = np.rint(12*np.einsum('nij,nj->ni', sums[which], t)/order[which, None]).astype(int)%12
+        keep = np.any(t12 != 0, axis = 1)
+        which, t12 = which[keep], t12[keep]
+        unique = np.unique(self.code(ops[which])*1728 + np.dot(t12, [144, 12, 1]), return_index = True)[1]
+        return ops[which[unique]], t12[unique]
+
+    def absent(self, hkl):
+        """ returns True for the HKLs which are systematically absent: those kept by an operation R (R^T hkl = hkl) whose translation t gives hkl.t not integer """
+        Rs, ts = self.absences
+        if len(Rs) == 0 or len(hkl) == 0: return np.zeros(len(hkl), dtype = bool)
+        kept = np.all(np.einsum('nj,pji->pni', hkl, Rs) == hkl[None], axis = 2)
+        return np.any(kept & (np.dot(ts, hkl.T)%12 != 0), axis = 0)
+
+    def update(self, G, positions, species, laue = 'auto', extinctions = 'auto', interrupt = None):
+        """ updates the operations for a new lattice (or a stack of them, for operations common to all), new atoms, a new Laue class ('auto', 'none' or one of self.laue_classes) or new extinction rules 
+            ('auto', found from the structure, 'none' or one of self.centerings). Returns True if the Laue class or the absences changed, which means the HKLs should be merged again. 
+            interrupt is given to structure_operations; if it cancels, nothing is changed """
+        key = (G.tobytes(), positions.tobytes(), tuple(species), laue, extinctions)
+        if key == self.key: return False
+        if self.G is None or not np.array_equal(G, self.G):
+            self.G = G.copy()
+            self.lattice_ops = self.metric_operations(self.candidates)
+        E = np.eye(3, dtype = int)
+        if laue == 'auto' or extinctions == 'auto':
+            structure_ops, structure_translations, structure_absences = self.detect(positions, species, interrupt)
+        self.key = key
+        if extinctions == 'auto':
+            absences = structure_absences
+        elif extinctions == 'none':
+            absences = self.intrinsic([], [])
+        else:
+            absences = self.intrinsic([E], [np.array(self.centerings[extinctions], dtype = float).reshape(-1, 3)/12.])
+        changed = not all(np.array_equal(a, b) for a, b in zip(absences, self.absences))
+        self.absences = absences
+        if laue == 'none':
+            laue_ops = E[None]
+            self.friedel = False
+        else:
+            if laue == 'auto':
+                ops, self.translations = structure_ops, structure_translations
+            else:
+                ops = self.metric_operations(self.laue_classes[laue])
+                self.translations = [np.zeros((1,3)) for R in ops]
+            # HKLs transform with the transposed matrices. Friedel pairs are always merged, and their intensities averaged, since f'' makes them different
+            laue_ops = np.concatenate([ops.transpose(0, 2, 1), -ops.transpose(0, 2, 1)])
+            laue_ops = laue_ops[np.unique(self.code(laue_ops), return_index = True)[1]]
+            self.friedel = True
+        codes = np.sort(self.code(laue_ops))
+        changed = changed or self.codes is None or not np.array_equal(codes, self.codes)
+        self.codes = codes
+        self.laue_ops = laue_ops
+        self.name = '1'
+        for i in self.laue_classes:
+            ops = self.laue_classes[i].transpose(0, 2, 1)
+            if np.array_equal(np.sort(self.code(ops)), codes): self.name = i
+        return changed
+
+    def merge(self, hkl):
+        """ returns one representative of each set of equivalent HKLs (the first one found in the list) and the number of HKLs of the list it represents """
+        if len(hkl) == 0: return hkl, np.zeros(0, dtype = int)
+        images = np.einsum('gij,nj->gni', self.laue_ops, hkl)
+        m = np.abs(images).max() + 1
+        b = 2*m + 1
+        canonical = (((images[..., 0] + m)*b + images[..., 1] + m)*b + images[..., 2] + m).max(axis = 0)
+        index, counts = np.unique(canonical, return_index = True, return_counts = True)[1:]
+        order = np.argsort(index)
+        return hkl[index[order]], counts[order]
+
+class Elements():
+    """ Registry of the elements (and ions) known by xrayutilities. Each name is resolved only once into an xrayutilities atom, with its Z, a default color and radius. 
+        Ions can be written as in xrayutilities ('Fe3p', 'O2m') or as 'Fe3+', 'O2-'. """
+    class Element():
+        def __init__(self, name, atom):
+            self.name = name
+            self.atom = atom
+            self.Z = atom.num
+            self.color = '#{:02x}{:02x}{:02x}'.format(*[int(round(255*c)) for c in atom.color[:3]])
+            self.radius = atom.radius
+
+    def __init__(self):
+        self.handles = {}
+
+    def name(self, symbol):
+        """ returns the xrayutilities name of what the user wrote: 'fe' -> 'Fe', 'Fe3+' -> 'Fe3p', 'O2-' -> 'O2m' """
+        match = re.fullmatch(r'\s*([A-Za-z][a-z]?)(\d*)([+-]|[pm](?:dot)?)?\s*', str(symbol))
+        if match is None: return str(symbol)
+        element, charge, sign = match.groups()
+        element = element[0].upper() + element[1:].lower()
+        if sign is None: return element + charge
+        if sign in '+-': sign = {'+':'p', '-':'m'}[sign]
+        return element + (charge or '1') + sign
+
+    def get(self, symbol):
+        """ returns the Element of a symbol. Raises KeyError if xrayutilities does not know it """
+        if symbol not in self.handles:
+            name = self.name(symbol)
+            if name not in self.handles:
+                atom = getattr(xu.materials.elements, name, None)
+                if not isinstance(atom, xu.materials.atom.Atom): raise KeyError(symbol)
+                self.handles.update({name:self.Element(name, atom)})
+            self.handles.update({symbol:self.handles[name]})
+        return self.handles[symbol]
+
+class FormFactors():
+    """ Tables of the atomic form factors: f0 on a dense Q grid and f', f'' on a dense energy grid. The tables of an element are made the first time 
+        it is used, and then all values come from a vectorized linear interpolation, without calling xrayutilities again. """
+    def __init__(self, elements, E_min, E_max, Q_points = 4001, E_step = 1.):
+        self.elements = elements
+        self.Q_points = Q_points
+        self.E_step = E_step # in eV
+        self.f0_tables = {}
+        self.f1f2_tables = {}
+        self.set_energy_range(E_min, E_max)
+
+    def set_energy_range(self, E_min, E_max):
+        """ energy range (in keV) of the tables. The Q grid goes up to the largest Q that can be seen with E_max, i.e., at 2theta = 180 """
+        E_min, E_max = min(E_min, E_max), max(E_min, E_max)
+        if getattr(self, 'E_range', None) == (E_min, E_max): return
+        self.E_range = (E_min, E_max)
+        self.E_grid = np.arange(E_min*1000, E_max*1000 + self.E_step, self.E_step)
+        self.Q_grid = np.linspace(0, 4*np.pi*E_max/12.398, self.Q_points)
+        self.f0_tables = {}
+        self.f1f2_tables = {}
+
+    def tables(self, element):
+        """ returns the f0 table and the f' + if'' table of an element, making them if needed """
+        if element not in self.f0_tables:
+            atom = self.elements.get(element).atom
+            self.f0_tables.update({element:atom.f0(self.Q_grid)})
+            self.f1f2_tables.update({element:atom.f1(self.E_grid) + 1j*atom.f2(self.E_grid)})
+        return self.f0_tables[element], self.f1f2_tables[element]
+
+    def f0(self, element, Q):
+        """ returns f0(Q) for an array of Q values (in 1/angstrom) """
+        if len(Q) and np.nanmax(Q) > self.Q_grid[-1]:
+            self.set_energy_range(self.E_range[0], max(self.E_range[1], np.nanmax(Q)*12.398/(4*np.pi)))
+        return np.interp(Q, self.Q_grid, self.tables(element)[0])
+
+    def dispersion(self, element, E):
+        """ returns f'(E) + if''(E) for one energy (in keV), or an array of them """
+        if np.min(E) < self.E_range[0] or np.max(E) > self.E_range[1]:
+            self.set_energy_range(min(np.min(E), self.E_range[0]), max(np.max(E), self.E_range[1]))
+        f1f2 = self.tables(element)[1]
+        return np.interp(E*1000, self.E_grid, f1f2.real) + 1j*np.interp(E*1000, self.E_grid, f1f2.imag)
+
+    def f(self, element, Q, E):
+        """ returns f0(Q) + f'(E) + if''(E) for an array of Q values (in 1/angstrom) and one energy (in keV) """
+        return self.f0(element, Q) + self.dispersion(element, E)
+
+class AtomTable():
+    """ The atoms of the unit cell, one row per atom, kept as arrays: the element (an index into self.elements), the fractional positions, the occupancy, 
+        the isotropic displacement parameter B (in angstrom^2) and the size and color used to draw it. 
+        Example:
+            atoms = AtomTable()
+            atoms.append(['Na', 'Cl'], [[0, 0, 0], [0.5, 0.5, 0.5]], color = ['#bbbb88', '#77aadd'])
+            engine.set_atoms(atoms.types(), atoms.xyz, atoms.occupancy, atoms.B) """
+    columns = ['element', 'x', 'y', 'z', 'occupancy', 'B', 'size', 'color']
+
+    def __init__(self):
+        self.elements = []
+        self.element = np.zeros(0, dtype = int)
+        self.xyz = np.zeros((0, 3))
+        self.occupancy = np.zeros(0)
+        self.B = np.zeros(0)
+        self.size = np.zeros(0)
+        self.color = np.zeros(0, dtype = 'U16')
+
+    def __len__(self):
+        return len(self.element)
+
+    def types(self):
+        """ the names of the elements of all atoms """
+        return [self.elements[i] for i in self.element]
+
+    def index(self, name):
+        """ the index of an element in self.elements, which is included if it is new """
+        if name not in self.elements: self.elements.append(name)
+        return self.elements.index(name)
+
+    def append(self, types, xyz, occupancy = 1., B = 0., size = 150., color = '#888888'):
+        """ includes atoms at the end of the table. types is a list of names, xyz an (M,3) array; the other columns can be arrays or a single value for all """
+        n = len(types)
+        self.element = np.concatenate((self.element, np.array([self.index(str(i)) for i in types], dtype = int)))
+        self.xyz = np.concatenate((self.xyz, np.array(xyz, dtype = float).reshape(n, 3)))
+        self.occupancy = np.concatenate((self.occupancy, np.broadcast_to(np.asarray(occupancy, dtype = float), (n,))))
+        self.B = np.concatenate((self.B, np.broadcast_to(np.asarray(B, dtype = float), (n,))))
+        self.size = np.concatenate((self.size, np.broadcast_to(np.asarray(size, dtype = float), (n,))))
+        self.color = np.concatenate((self.color, np.broadcast_to(np.asarray(color, dtype = 'U16'), (n,))))
+
+    def remove(self, rows):
+        """ removes the atoms of the given rows """
+        keep = np.ones(len(self), dtype = bool)
+        keep[rows] = False
+        for i in ['element', 'xyz', 'occupancy', 'B', 'size', 'color']: setattr(self, i, getattr(self, i)[keep])
+
+    def get(self, row, column):
+        """ the value of one cell of the table, column being one of self.columns """
+        if column == 'element': return self.elements[self.element[row]]
+        if column in ('x', 'y', 'z'): return self.xyz[row, 'xyz'.index(column)]
+        return getattr(self, column)[row]
+
+    def set(self, row, column, value):
+        """ changes one cell of the table """
+        if column == 'element': self.element[row] = self.index(value)
+        elif column in ('x', 'y', 'z'): self.xyz[row, 'xyz'.index(column)] = value
+        else: getattr(self, column)[row] = value
+
+def same(a, b):
+    """ compares two values of the graph, which can be numbers, strings, numpy arrays or tuples of them """
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and a.shape == b.shape and a.dtype == b.dtype and np.array_equal(a, b)
+    if isinstance(a, (tuple, list)) or isinstance(b, (tuple, list)):
+        return isinstance(a, (tuple, list)) and isinstance(b, (tuple, list)) and len(a) == len(b) and all(same(i, j) for i, j in zip(a, b))
+    return a == b
+
+class PatternCache():
+    """ The patterns calculated most recently, keyed by the state of the engine (PatternEngine.state()), up to limit bytes. When it is full, the pattern used longest ago is dropped. 
+        The sliders give quantized values, so going back to a place already seen gives the same key. hits and misses count how the lookups went.
+        Example:
+            key = cache.key(engine.state())
+            pattern = cache.get(key)
+            if pattern is None: cache.put(key, *engine.calculate()) """
+    def __init__(self, limit = 64*2**20):
+        self.entries = OrderedDict()
+        self.size = 0
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        """ checks a key without counting a hit or a miss """
+        return key in self.entries
+
+    def hashable(self, value):
+        """ numpy arrays become their shape, type and bytes; tuples and lists are converted item by item """
+        if isinstance(value, np.ndarray): return (value.shape, value.dtype.str, value.tobytes())
+        if isinstance(value, (tuple, list)): return tuple(self.hashable(i) for i in value)
+        return value
+
+    def nbytes(self, value):
+        """ the memory taken by the arrays of a pattern or of a key, roughly """
+        if isinstance(value, (np.ndarray, bytes)): return len(value) if isinstance(value, bytes) else value.nbytes
+        if isinstance(value, tuple): return sum(self.nbytes(i) for i in value)
+        return 8
+
+    def key(self, state):
+        """ a key for a state of the engine """
+        return tuple((i, self.hashable(state[i])) for i in sorted(state))
+
+    def get(self, key):
+        """ returns (tth, intensity) of a state, or None if it is not in the cache """
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, tth, intensity):
+        """ keeps a pattern, dropping the oldest ones if needed. A pattern larger than the whole cache is not kept """
+        if key in self.entries: return
+        size = self.nbytes(key) + tth.nbytes + intensity.nbytes
+        if size > self.limit: return
+        self.entries[key] = ((tth, intensity), size)
+        self.size += size
+        self.shrink(self.limit)
+
+    def shrink(self, limit):
+        """ drops the oldest patterns until they take less than limit bytes """
+        while self.size > limit:
+            self.size -= self.entries.popitem(last = False)[1][1]
+
+    def set_limit(self, limit):
+        self.limit = limit
+        self.shrink(limit)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+class Cancelled(Exception):
+    """ raised by Graph.get when its interrupt function asks to abandon the calculation """
+
+class Graph():
+    """ A small dataflow graph. Inputs are set from outside; every other node is a function of other nodes and keeps its last value.
+        Setting an input marks everything downstream of it as dirty, and asking for a node recalculates only the dirty nodes it needs. 
+        A node whose inputs came out with the same values as before is not recalculated, so a change stops where it does not matter anymore. """
+    def __init__(self):
+        self.functions = {}
+        self.parents = {}
+        self.children = {}
+        self.values = {}
+        self.versions = {}
+        self.seen = {}
+        self.dirty = set()
+        self.calls = {} # how many times each node was calculated
+        self.interrupt = None # a function returning True when the calculation should be abandoned. It is checked before calculating each node
+
+    def input(self, name, value = None):
+        self.parents.update({name:()})
+        self.children.setdefault(name, [])
+        self.values.update({name:value})
+        self.versions.update({name:0})
+
+    def node(self, name, function, parents):
+        self.functions.update({name:function})
+        self.parents.update({name:tuple(parents)})
+        self.children.setdefault(name, [])
+        for i in parents: self.children[i].append(name)
+        self.versions.update({name:0})
+        self.seen.update({name:None})
+        self.calls.update({name:0})
+        self.dirty.add(name)
+
+    def set(self, name, value):
+        """ changes an input. Returns True if the value is different from the old one """
+        if same(value, self.values[name]): return False
+        self.values.update({name:value})
+        self.versions[name] += 1
+        self.dirty.update(self.downstream(name))
+        return True
+
+    def downstream(self, name):
+        """ returns all the nodes which depend on a node """
+        found = set()
+        stack = list(self.children[name])
+        while stack:
+            i = stack.pop()
+            if i not in found:
+                found.add(i)
+                stack.extend(self.children[i])
+        return found
+
+    def get(self, name):
+        """ returns the value of a node, calculating it and the nodes it depends on only if needed """
+        if name in self.dirty:
+            args = [self.get(i) for i in self.parents[name]]
+            versions = tuple(self.versions[i] for i in self.parents[name])
+            if versions != self.seen[name]:
+                if self.interrupt is not None and self.interrupt(): raise Cancelled(name)
+                value = self.functions[name](*args)
+                self.calls[name] += 1
+                self.seen[name] = versions
+                if name not in self.values or not same(value, self.values[name]):
+                    self.values.update({name:value})
+                    self.versions[name] += 1
+            self.dirty.discard(name)
+        return self.values[name]
+
+class PatternEngine():
+    """ Calculates the powder diffraction pattern from plain values. The main window keeps one of these and gives it the values of its sliders.
+        The calculation is a Graph, so each change only recalculates what depends on it:
+            lattice -> metric -> Q -> tth -> widths, weights
+            atoms -> structure factor
+            structure (the atoms the symmetry is found from) -> merged HKLs
+            energy -> f', f'' -> structure factor
+            occupancy, B -> structure factor
+            size -> widths
+            grid -> profile
+        Example:
+            engine = PatternEngine()
+            engine.set_lattice(5.63, 5.63, 5.63, 90, 90, 90)
+            engine.set_atoms(['Na', 'Na', 'Na', 'Na', 'Cl', 'Cl', 'Cl', 'Cl'], positions)
+            tth, intensity = engine.calculate() """
+    def __init__(self, E_min = 5., E_max = 25., E = 8.048, D = 200., tth_min = 10., tth_max = 90., tth_step = 0.02, hkl_max = (4, 4, 4), peak_tol = 1e-6, laue = 'auto', extinctions = 'auto'):
+        self.degree = np.pi/180.
+        self.lattice = Lattice()
+        self.symmetry = Symmetry()
+        self.elements = Elements()
+        self.form_factor_tables = FormFactors(self.elements, E_min, E_max)
+        self.merged_hkl = None
+        self.F_hkl = None
+        self.F_refresh = 1000 # incremental updates of F before calculating it again from scratch, so that rounding errors do not pile up
+        self.batch_symmetry = Symmetry() # for calculate_lattices, whose operations must hold for all lattices of the batch
+        self.graph = Graph()
+        self.frozen = False # see freeze_symmetry
+        for i in ['lattice', 'types', 'positions', 'occupancy', 'B', 'structure', 'energy', 'wavelength', 'size', 'grid', 'hkl_max', 'laue', 'extinctions', 'peak_tol']: self.graph.input(i)
+        self.graph.node('metric', self.metric, ['lattice'])
+        self.graph.node('hkl', self.hkl, ['hkl_max'])
+        self.graph.node('merged', self.merge, ['metric', 'structure', 'laue', 'extinctions', 'hkl'])
+        self.graph.node('Q', self.Q, ['metric', 'merged'])
+        self.graph.node('used', self.limits, ['merged', 'Q', 'grid', 'wavelength'])
+        self.graph.node('tth', self.tth, ['used', 'wavelength'])
+        self.graph.node('f0', self.f0, ['used', 'types'])
+        self.graph.node('dispersion', self.dispersion, ['types', 'energy'])
+        self.graph.node('scale', self.scale, ['used', 'occupancy', 'B'])
+        self.graph.node('F', self.structure_factor, ['used', 'positions', 'f0', 'dispersion', 'scale'])
+        self.graph.node('F2', self.F2, ['F', 'merged'])
+        self.graph.node('weights', self.weights, ['used', 'F2'])
+        self.graph.node('widths', self.widths, ['tth', 'wavelength', 'size'])
+        self.graph.node('tth_range', self.tth_grid, ['grid'])
+        self.graph.node('profile', self.calculate_intensity, ['tth_range', 'grid', 'tth', 'widths', 'weights', 'peak_tol'])
+        self.set_atoms([], np.zeros((0, 3)))
+        self.set_energy(E)
+        self.set_size(D)
+        self.set_grid(tth_min, tth_max, tth_step)
+        self.set_hkl_max(*hkl_max)
+        self.set_peak_tol(peak_tol)
+        self.set_laue(laue)
+        self.set_extinctions(extinctions)
+
+    # inputs
+    def set_grid(self, tth_min, tth_max, tth_step):
+        """ 2theta grid (in degrees) where the pattern is calculated """
+        return self.graph.set('grid', (tth_min, tth_max, tth_step))
+
+    def set_hkl_max(self, h_max, k_max, l_max):
+        """ maximum values of H, K and L """
+        return self.graph.set('hkl_max', (h_max, k_max, l_max))
+
+    def set_lattice(self, a, b, c, alpha, beta, gamma):
+        """ lattice parameters in angstrom and degrees. Returns True if they changed """
+        return self.graph.set('lattice', (a, b, c, alpha, beta, gamma))
+
+    def set_atoms(self, types, positions, occupancy = None, B = None):
+        """ names of the elements (or ions), (M,3) fractional positions, occupancies (1 if not given) and isotropic displacement parameters B in angstrom^2 (0 if not given) 
+            of all atoms of the unit cell. Raises KeyError for an unknown element """
+        positions = np.array(positions, dtype = float).reshape(-1, 3)
+        occupancy = np.ones(len(positions)) if occupancy is None else np.array(occupancy, dtype = float).reshape(-1)
+        B = np.zeros(len(positions)) if B is None else np.array(B, dtype = float).reshape(-1)
+        changed = self.graph.set('types', tuple(self.elements.get(str(t)).name for t in types))
+        changed = self.graph.set('occupancy', occupancy) or changed
+        changed = self.graph.set('B', B) or changed
+        changed = self.graph.set('positions', positions) or changed
+        if not self.frozen: self.graph.set('structure', self.structure())
+        return changed
+
+    def structure(self):
+        """ the atoms the symmetry is found from: the species (atoms of the same element with different occupancy or B are different species) and the positions """
+        values = self.graph.values
+        return tuple('{} {:g} {:g}'.format(*i) for i in zip(values['types'], values['occupancy'], values['B'])), values['positions']
+
+    def freeze_symmetry(self, frozen):
+        """ while frozen, set_atoms does not change the structure the symmetry is found from, so moving an atom only updates F, incrementally, and not the merged HKLs.
+            The window freezes it while a slider is dragged: the drafts keep the symmetry from before, which is found again when the slider is released. 
+            Unfreezing takes the current atoms. Returns True if the structure changed """
+        self.frozen = frozen
+        return not frozen and self.graph.set('structure', self.structure())
+
+    def set_energy(self, E, wvl = None):
+        """ energy in keV. The wavelength (in angstrom) is 12.398/E, unless given """
+        energy = self.graph.set('energy', E)
+        return self.graph.set('wavelength', 12.398/E if wvl is None else wvl) or energy
+
+    def set_size(self, D):
+        """ crystallite size in angstrom """
+        return self.graph.set('size', D)
+
+    def set_peak_tol(self, peak_tol):
+        return self.graph.set('peak_tol', peak_tol)
+
+    def set_laue(self, laue):
+        """ 'auto', 'none' or one of the Laue classes of Symmetry """
+        if laue not in ['auto', 'none'] + list(self.symmetry.laue_classes.keys()): raise ValueError(laue)
+        return self.graph.set('laue', laue)
+
+    def set_extinctions(self, extinctions):
+        """ 'auto' (absences of the space group found from the atoms), 'none' or the centering of the cell, one of the keys of Symmetry.centerings.
+            Glide planes and screw axes can not be given, they are only found with 'auto' """
+        if extinctions not in ['auto', 'none'] + list(self.symmetry.centerings.keys()):
+            raise ValueError('extinctions "{}": only auto, none or a centering ({}) can be given'.format(extinctions, ', '.join(self.symmetry.centerings.keys())))
+        return self.graph.set('extinctions', extinctions)
+
+    def state(self):
+        """ returns a dict with the values of all inputs, which can be given to set_state of another engine """
+        return {i:self.graph.values[i] for i in self.graph.parents if i not in self.graph.functions}
+
+    def set_state(self, state):
+        """ sets several inputs at once, from a dict returned by state() """
+        changed = False
+        for i in state: changed = self.graph.set(i, state[i]) or changed
+        return changed
+
+    def get(self, name):
+        """ returns the value of any node of the graph """
+        return self.graph.get(name)
+
+    # nodes
+    def metric(self, lattice):
+        self.lattice.set_parameters(*lattice)
+        return self.lattice.G_star
+
+    def hkl(self, hkl_max):
+        """ creates the (N,3) array of HKLs based on the maximum values for them """
+        h_max, k_max, l_max = hkl_max
+        h, k, l = np.meshgrid(np.arange(-h_max, h_max+1), np.arange(-k_max, k_max+1), np.arange(-l_max, l_max+1), indexing = 'ij')
+        hkl = np.stack([h.ravel(), k.ravel(), l.ravel()], axis = 1)
+        return hkl[np.any(hkl != 0, axis = 1)]
+
+    def merge(self, G_star, structure, laue, extinctions, hkl):
+        """ looks for the Laue class of the structure, drops the systematically absent HKLs and merges the equivalent ones. Returns them, their multiplicities and if the Friedel pairs were merged """
+        species, positions = structure
+        if self.symmetry.update(self.lattice.G, positions, species, laue, extinctions, self.graph.interrupt) or hkl is not self.merged_hkl:
+            self.merged_hkl = hkl
+            hkl_unique, multiplicity = self.symmetry.merge(hkl[~self.symmetry.absent(hkl)])
+            self.merged = (hkl_unique, multiplicity, self.symmetry.friedel)
+        return self.merged
+
+    def Q(self, G_star, merged):
+        return self.lattice.Q(merged[0])
+
+    def limits(self, merged, Q, grid, wvl):
+        """ keeps only the HKLs whose Q is inside the 2theta grid for the current wavelength """
+        Qi = 4*np.pi/wvl*np.sin(grid[0]*np.pi/360.)
+        Qf = 4*np.pi/wvl*np.sin(grid[1]*np.pi/360.)
+        used = (Q > Qi) & (Q < Qf)
+        return merged[0][used], merged[1][used], Q[used]
+
+    def tth(self, used, wvl):
+        return self.Q2tth(used[2], wvl)
+
+    def f0(self, used, types):
+        """ returns the (N_hkl x N_atoms) matrix of f0(Q), taken from the tables of each element """
+        Q = used[2]
+        f = np.empty((len(Q), len(types)))
+        for element in set(types):
+            columns = [i for i, t in enumerate(types) if t == element]
+            f[:, columns] = self.form_factor_tables.f0(element, Q)[:, None]
+        return f
+
+    def dispersion(self, types, E):
+        """ returns f' + if'' of each atom """
+        return np.array([self.form_factor_tables.dispersion(element, E) for element in types], dtype = complex)
+
+    def scale(self, used, occupancy, B):
+        """ returns the (N_hkl x N_atoms) matrix of occupancy times the Debye-Waller factor exp(-B (Q/4 pi)^2) """
+        s2 = (used[2]/(4*np.pi))**2
+        return occupancy[None, :]*np.exp(-s2[:, None]*B[None, :])
+
+    def structure_factor(self, used, positions, f0, dispersion, scale):
+        """ returns F(h) and F(-h) of all HKLs. The phases exp(-2 pi i hkl.r) of every HKL and atom are kept, so when only some atoms moved since the last call,
+            only their old contributions are subtracted and the new ones added. Anything else (HKLs, form factors, number of atoms) makes it start from scratch. """
+        hkl = used[0]
+        if hkl is not self.F_hkl or f0 is not self.F_f0 or dispersion is not self.F_dispersion or scale is not self.F_scale or len(positions) != len(self.F_positions) or self.F_updates >= self.F_refresh:
+            self.F_hkl, self.F_f0, self.F_dispersion, self.F_scale = hkl, f0, dispersion, scale
+            self.F_updates = 0
+            self.f = (f0 + dispersion[None, :])*scale
+            self.phases = np.exp(-2j*np.pi*np.dot(hkl, positions.T))
+            self.F = np.einsum('ij,ij->i', self.f, self.phases)
+            self.F_minus = np.einsum('ij,ij->i', self.f, self.phases.conj())
+        else:
+            moved = np.nonzero(np.any(positions != self.F_positions, axis = 1))[0]
+            if len(moved):
+                self.F_updates += 1
+                phases = np.exp(-2j*np.pi*np.dot(hkl, positions[moved].T))
+                f = self.f[:, moved]
+                self.F = self.F + np.einsum('ij,ij->i', f, phases - self.phases[:, moved])
+                self.F_minus = self.F_minus + np.einsum('ij,ij->i', f, phases.conj() - self.phases[:, moved].conj())
+                self.phases[:, moved] = phases
+        self.F_positions = positions
+        return self.F, self.F_minus
+
+    def F2(self, F, merged):
+        """ calculates |F|^2 of all HKLs at once """
+        Fhkl, F_minus = F
+        F2 = Fhkl.real*Fhkl.real + Fhkl.imag*Fhkl.imag
+        if merged[2]: # the Friedel pairs were merged: take the average of both
+            F2 = (F2 + F_minus.real*F_minus.real + F_minus.imag*F_minus.imag)/2.
+        return F2
+
+    def weights(self, used, F2):
+        """ areas of the peaks: multiplicity, structure factor and a normalization with Q^-2 """
+        Q = used[2]
+        return used[1]*F2/(Q*Q)
+
+    def widths(self, tth, wvl, CrysSize):
+        return self.size_width(tth, wvl, CrysSize)*360/np.pi
+
+    def tth_grid(self, grid):
+        return np.arange(*grid)
+
+    def Qhkl(self, hkl):
+        """ returns the Q value of a HKL, or of an (N,3) array of them, for the current lattice """
+        self.get('metric')
+        return self.lattice.Q(hkl)
+
+    def cartesian(self, positions):
+        """ returns the cartesian coordinates of an (...,3) array of fractional positions for the current lattice """
+        self.get('metric')
+        return self.lattice.cartesian(positions)
+
+    def Q2tth(self, Q, wvl = None):
+        """ returns the tth of a given Q """
+        if wvl is None: wvl = self.graph.values['wavelength']
+        return 360./np.pi*np.arcsin(Q*wvl/(4*np.pi))
+
+    def size_width(self, tth, wvl, CrysSize):
+        """ sherer formula to set the peak width """
+        return 0.9*wvl/(2.355*CrysSize*np.cos(tth/2.*self.degree))
+
+    def calculate_intensity(self, tth_range, grid, tth, w, weights, peak_tol):
+        """ calculates the intensity of all peaks """
+        return self.gaussians(tth_range, grid[2], tth, w, weights, peak_tol)
+
+    def gaussians(self, tth_range, tth_step, tth, w, weights, peak_tol, rows = None, n_rows = 1):
+        """ sums gaussians of areas weights, centres tth and widths w. Each gaussian is only placed over the points of the tth range where it is larger than peak_tol times its maximum, 
+            and all of them are summed at once with bincount. With rows, each gaussian goes to its row of an (n_rows, points) block instead """
+        points = len(tth_range)
+        ok = np.isfinite(tth) & np.isfinite(w) & (w > 0) & np.isfinite(weights)
+        tth, w, weights = tth[ok], w[ok], weights[ok]
+        if rows is not None: rows = rows[ok]
+        if len(tth) == 0 or points == 0: return np.zeros(points) if rows is None else np.zeros((n_rows, points))
+        half = np.minimum(np.ceil(np.sqrt(-2*np.log(peak_tol))*w/tth_step), points).astype(int)
+        centre = np.rint((tth-tth_range[0])/tth_step).astype(int)
+        offsets = np.arange(-half.max(), half.max()+1)
+        index = centre[:,None] + offsets[None,:]
+        inside = (np.abs(offsets)[None,:] <= half[:,None]) & (index >= 0) & (index < points)
+        peak = np.nonzero(inside)[0]
+        index = index[inside]
+        dx = tth_range[index] - tth[peak]
+        values = weights[peak]/(np.sqrt(2*np.pi)*w[peak])*np.exp(-dx*dx/(2.*w[peak]*w[peak]))
+        if rows is None: return np.bincount(index, weights = values, minlength = points)
+        return np.bincount(rows[peak]*points + index, weights = values, minlength = n_rows*points).reshape(n_rows, points)
+
+    def calculate(self):
+        """ calculates the powder diffration intensity, recalculating only the nodes which depend on what changed. Returns the 2theta grid and the intensity """
+        return self.get('tth_range'), self.get('profile')
+
+    def calculate_lattices(self, lattices, energies = None, sizes = None, memory = 2**28):
+        """ calculates the patterns of many lattices with the atoms, grid, HKLs and peak_tol of the engine. lattices is an (M,6) array of (a, b, c, alpha, beta, gamma), 
+            energies (keV) and sizes (angstrom) are one value for all or one for each lattice (the values of the engine if not given). Returns the 2theta grid and an (M, points) array.
+            The HKLs are merged with the symmetry common to all lattices, and the phases of the atoms are calculated only once. The lattices are done in chunks 
+            that need about memory bytes each. The graph of the engine is not changed. """
+        lattices = np.asarray(lattices, dtype = float).reshape(-1, 6)
+        M = len(lattices)
+        if energies is None: # the wavelength of the engine, which may not be 12.398/E
+            energies, wvls = np.full(M, float(self.graph.values['energy'])), np.full(M, float(self.graph.values['wavelength']))
+        else:
+            energies = np.broadcast_to(np.asarray(energies, dtype = float), (M,))
+            wvls = 12.398/energies
+        sizes = np.broadcast_to(np.asarray(self.graph.values['size'] if sizes is None else sizes, dtype = float), (M,))
+        tth_range, grid = self.get('tth_range'), self.graph.values['grid']
+        types, positions, structure = self.graph.values['types'], self.graph.values['positions'], self.graph.values['structure']
+        occupancy, B, peak_tol = self.graph.values['occupancy'], self.graph.values['B'], self.graph.values['peak_tol']
+        intensity = np.zeros((M, len(tth_range)))
+        G = self.lattice.tensors(lattices)
+        closed = np.abs(np.linalg.det(G)) > 0 # a cell with no volume has no peaks
+        if not closed.any() or len(types) == 0: return tth_range, intensity
+        self.batch_symmetry.update(G[closed], structure[1], structure[0], self.graph.values['laue'], self.graph.values['extinctions'])
+        hkl = self.get('hkl')
+        hkl, multiplicity = self.batch_symmetry.merge(hkl[~self.batch_symmetry.absent(hkl)])
+        # the tables of the form factors are widened only once, and only as far as the energies of the batch need
+        E_range = self.form_factor_tables.E_range
+        self.form_factor_tables.set_energy_range(min(E_range[0], energies.min()), max(E_range[1], energies.max()))
+        # atoms of the same element and B share f0 and the Debye-Waller factor, so their phases are summed once for all lattices
+        groups = sorted(set(zip(types, B)))
+        phases = np.exp(-2j*np.pi*np.dot(hkl, positions.T))
+        S = np.zeros((len(groups), len(hkl)), dtype = complex)
+        S_minus = np.zeros((len(groups), len(hkl)), dtype = complex)
+        for g, (element, b) in enumerate(groups):
+            atoms = np.array([t == element and B[i] == b for i, t in enumerate(types)])
+            S[g] = np.dot(phases[:, atoms], occupancy[atoms])
+            S_minus[g] = np.dot(phases[:, atoms].conj(), occupancy[atoms])
+        # the largest gaussian of the batch sets how many points each peak may take
+        w_max = self.size_width(min(grid[1], 179.), wvls.max(), sizes.min())*360/np.pi
+        half = min(np.ceil(np.sqrt(-2*np.log(peak_tol))*w_max/grid[2]), len(tth_range))
+        chunk = max(1, int(memory//(8*len(hkl)*(12 + 4*len(groups) + 4*(2*half + 1)) + 8*len(tth_range))))
+        with np.errstate(invalid = 'ignore'):
+            G_star = np.full(G.shape, np.nan)
+            G_star[closed] = np.linalg.inv(G[closed])
+            for start in range(0, M, chunk):
+                block = slice(start, min(start + chunk, M))
+                E, wvl = energies[block], wvls[block]
+                Q = 2*np.pi*np.sqrt(np.einsum('ni,mij,nj->mn', hkl, G_star[block], hkl))
+                # only the peaks inside the 2theta grid are calculated, so their Q are inside the tables of the form factors
+                sin = Q*wvl[:, None]/(4*np.pi)
+                rows, peaks = np.nonzero((sin > np.sin(grid[0]*np.pi/360.)) & (sin < np.sin(grid[1]*np.pi/360.)))
+                Q, sin = Q[rows, peaks], sin[rows, peaks]
+                s2 = (Q/(4*np.pi))**2
+                F = np.zeros(len(Q), dtype = complex)
+                F_minus = np.zeros(len(Q), dtype = complex)
+                for g, (element, b) in enumerate(groups):
+                    f = (self.form_factor_tables.f0(element, Q) + self.form_factor_tables.dispersion(element, E)[rows])*np.exp(-s2*b)
+                    F += f*S[g][peaks]
+                    F_minus += f*S_minus[g][peaks]
+                F2 = F.real*F.real + F.imag*F.imag
+                if self.batch_symmetry.friedel: F2 = (F2 + F_minus.real*F_minus.real + F_minus.imag*F_minus.imag)/2.
+                tth = 360./np.pi*np.arcsin(sin)
+                w = self.size_width(tth, wvl[rows], sizes[block][rows])*360/np.pi
+                weights = multiplicity[peaks]*F2/Q**2
+                intensity[block] = self.gaussians(tth_range, grid[2], tth, w, weights, peak_tol, rows, len(E))
+        return tth_range, intensity
@@ -0,0 +1,96 @@
+""" Keeps many patterns on disk, in a folder with a memory mapped array, so a sweep can be larger than the memory.
+    sweep() fills a store with the patterns of a PatternEngine over a grid of lattice parameters, energies or sizes, and the main window browses it with a slider.
+    The folder has:
+        patterns.npy    (M, points) float32 array, one pattern per row, opened as a memory map: reading a pattern only reads its row from the disk
+        done.npy        one flag per row, set after the row is written, so an interrupted sweep continues with the rows that are missing
+        tth.npy         the 2theta grid of all patterns
+        axes.json       the names and values of the axes. The rows are all combinations of the values, the last axis changing fastest
+    Example:
+        store = sweep(engine, 'sweep_a_c', [('a', np.linspace(5, 6, 100)), ('c', np.linspace(5, 8, 300)), ('size', [50, 100, 200, 500])])
+        intensity = store.pattern(store.index(10, 20, 3)) """
+import numpy as np
+import json, os
+
+STORE_VERSION = 1
+LATTICE = ['a', 'b', 'c', 'alpha', 'beta', 'gamma']
+
+class SweepStore():
+    """ A folder with the patterns of a sweep (see the module). Opened in mode 'r' it is only read, in 'r+' rows can be written """
+    def __init__(self, folder, mode = 'r'):
+        self.folder = folder
+        with open(os.path.join(folder, 'axes.json')) as f: info = json.load(f)
+        if info.get('version') != STORE_VERSION: raise ValueError('{} is not a sweep of this version'.format(folder))
+        self.axes = info['axes']
+        self.names = [i['name'] for i in info['axes']]
+        self.values = [np.array(i['values']) for i in info['axes']]
+        self.shape = tuple(len(i) for i in self.values)
+        self.chunk = int(info['chunk'])
+        self.tth = np.load(os.path.join(folder, 'tth.npy'))
+        self.patterns = np.load(os.path.join(folder, 'patterns.npy'), mmap_mode = mode)
+        self.done = np.load(os.path.join(folder, 'done.npy'), mmap_mode = mode)
+        if self.patterns.shape != (int(np.prod(self.shape)), len(self.tth)) or len(self.done) != len(self.patterns): raise ValueError('{} is not complete'.format(folder))
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def index(self, *indices):
+        """ the row of the pattern with these indices along the axes """
+        return int(np.ravel_multi_index(indices, self.shape))
+
+    def parameters(self, rows):
+        """ the values of all axes for an array of rows, as a dict name -> array """
+        indices = np.unravel_index(np.asarray(rows), self.shape)
+        return {name:values[i] for name, values, i in zip(self.names, self.values, indices)}
+
+    def pattern(self, row):
+        """ one pattern, read from the disk. Only its row is paged in """
+        return np.array(self.patterns[row], dtype = float)
+
+    def missing(self):
+        """ the rows which were not written yet """
+        return np.nonzero(self.done == 0)[0]
+
+    def write(self, rows, intensities):
+        """ writes patterns to some rows. The rows are marked as done only after the patterns are on the disk """
+        self.patterns[rows] = intensities
+        self.patterns.flush()
+        self.done[rows] = 1
+        self.done.flush()
+
+def create_store(folder, axes, tth, chunk = 1024):
+    """ makes an empty store for a sweep over axes, a list of (name, values), with patterns on the 2theta grid tth. If the folder already has a store with the same axes
+        and grid, it is opened instead, so the rows which are missing can be done. Raises ValueError if it has a different one """
+    axes = [(str(name), np.asarray(values).tolist()) for name, values in axes]
+    tth = np.asarray(tth, dtype = float)
+    info = {'version': STORE_VERSION, 'axes': [{'name': name, 'values': values} for name, values in axes], 'chunk': int(chunk)}
+    if os.path.isfile(os.path.join(folder, 'axes.json')):
+        store = SweepStore(folder, 'r+')
+        if store.axes != info['axes'] or not np.array_equal(store.tth, tth):
+            raise ValueError('{} has another sweep'.format(folder))
+        return store
+    os.makedirs(folder, exist_ok = True)
+    M = int(np.prod([len(values) for name, values in axes]))
+    np.save(os.path.join(folder, 'tth.npy'), tth)
+    np.lib.format.open_memmap(os.path.join(folder, 'patterns.npy'), mode = 'w+', dtype = np.float32, shape = (M, len(tth))).flush()
+    np.lib.format.open_memmap(os.path.join(folder, 'done.npy'), mode = 'w+', dtype = np.uint8, shape = (M,)).flush()
+    with open(os.path.join(folder, 'axes.json'), 'w') as f: json.dump(info, f) # written last: a folder without it is not a store
+    return SweepStore(folder, 'r+')
+
+def sweep(engine, folder, axes, chunk = 1024, memory = 2**28, progress = None):
+    """ calculates the patterns of all combinations of the values of axes, a list of (name, values) with names among a, b, c, alpha, beta, gamma, energy and size,
+        and writes them to a store in folder. Everything else (the atoms, the other lattice parameters, the grid...) comes from the engine. The patterns are done
+        chunk rows at a time with engine.calculate_lattices; progress, if given, is called with the number of rows done and the total after each chunk. Returns the store """
+    for name, values in axes:
+        if name not in LATTICE + ['energy', 'size']: raise ValueError('"{}" can not be swept'.format(name))
+    store = create_store(folder, axes, engine.get('tth_range'), chunk)
+    lattice = np.array(engine.graph.values['lattice'], dtype = float)
+    missing = store.missing()
+    for start in range(0, len(missing), chunk):
+        rows = missing[start:start + chunk]
+        values = store.parameters(rows)
+        lattices = np.tile(lattice, (len(rows), 1))
+        for i, name in enumerate(LATTICE):
+            if name in values: lattices[:, i] = values[name]
+        store.write(rows, engine.calculate_lattices(lattices, values.get('energy'), values.get('size'), memory)[1])
+        if progress is not None: progress(len(store) - len(missing) + start + len(rows), len(store))
+    return store
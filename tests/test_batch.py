@@ -0,0 +1,49 @@
+""" Tests of pxrd_batch: a manifest run over a pool of processes. Run with: python -m pytest tests """
+import io, json, os, sys
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pxrd_batch import run, read_manifest, main
+from pxrd_engine import PatternEngine
+from test_cif import RUTILE
+
+def manifest(folder, structures):
+    filename = os.path.join(folder, 'manifest.json')
+    with open(filename, 'w') as f: json.dump({'defaults': {'grid': [10, 90, 0.05], 'hkl_max': [3, 3, 3]}, 'structures': structures}, f)
+    return filename
+
+def cell(name, a, **kw):
+    return dict({'name': name, 'lattice': [a, a, a, 90, 90, 90], 'atoms': [['Na', 0, 0, 0], ['Cl', 0.5, 0.5, 0.5]]}, **kw)
+
+def test_a_bad_structure_does_not_stop_the_others(tmp_path):
+    structures = [cell('a', 5.5), cell('b', 5.6), cell('bad', 5.7, grid = [10, 90]), cell('c', 5.8), cell('d', 5.9)]
+    out = str(tmp_path/'patterns')
+    stream = io.StringIO()
+    assert run(manifest(str(tmp_path), structures), out, workers = 2, stream = stream) == ['bad']
+    assert 'bad TypeError' in stream.getvalue()
+    assert sorted(os.listdir(out)) == ['a.xy', 'b.xy', 'c.xy', 'd.xy']
+    for name in 'abcd':
+        tth, intensity = np.loadtxt(os.path.join(out, name + '.xy')).T
+        assert np.allclose(tth, np.arange(10, 90, 0.05)) and intensity.max() > 0
+    assert run(manifest(str(tmp_path), structures), out, workers = 2, stream = stream) == ['bad'] # the patterns written are skipped, the bad one is tried again
+
+def test_manifest(tmp_path):
+    with open(str(tmp_path/'TiO2.cif'), 'w') as f: f.write(RUTILE)
+    structures = read_manifest(manifest(str(tmp_path), [cell('Na Cl', 5.6), cell('Na Cl', 5.7, energy = 17.48), {'cif': 'TiO2.cif'}]))
+    assert [i['name'] for i in structures] == ['Na_Cl', 'Na_Cl_1', 'TiO2']
+    assert structures[1]['energy'] == 17.48 and structures[0]['energy'] == 8.048 and structures[0]['hkl_max'] == [3, 3, 3]
+    assert structures[2]['cif'] == str(tmp_path/'TiO2.cif')
+    with pytest.raises(ValueError):
+        read_manifest(manifest(str(tmp_path), [{'name': 'empty'}]))
+
+def test_patterns_and_exit_codes(tmp_path):
+    filename = manifest(str(tmp_path), [cell('NaCl', 5.64, size = 100)])
+    out = str(tmp_path/'patterns')
+    assert main([filename, '-o', out, '-j', '1']) == 0
+    tth, intensity = np.loadtxt(os.path.join(out, 'NaCl.xy')).T
+    e = PatternEngine(D = 100., tth_min = 10, tth_max = 90, tth_step = 0.05, hkl_max = (3, 3, 3))
+    e.set_lattice(5.64, 5.64, 5.64, 90, 90, 90)
+    e.set_atoms(['Na', 'Cl'], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    assert np.allclose(intensity, e.calculate()[1], rtol = 1e-5, atol = 1e-5*intensity.max()) # written with 6 digits
+    assert main([manifest(str(tmp_path), [cell('bad', 5.64, extinctions = 'P2_1')]), '-o', out]) == 1
+    assert main([str(tmp_path/'missing.json'), '-o', out]) == 2
@@ -0,0 +1,73 @@
+""" Tests of pxrd_cif: the structure of a CIF, expanded with its symmetry operations, and the cached parsed copy. Run with: python -m pytest tests """
+import os, sys
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pxrd_cif
+from pxrd_cif import parse_cif, read_cif, operation, element
+from pxrd_engine import Elements
+
+RUTILE = """# rutile, P 42/m n m
+data_TiO2
+_chemical_name_mineral 'Rutile'
+_cell_length_a 4.5937(1)
+_cell_length_b 4.5937(1)
+_cell_length_c 2.9587(2)
+_cell_angle_alpha 90
+_cell_angle_beta 90
+_cell_angle_gamma 90
+_publ_section_title
+;
+ A text field; with 'quotes' and x, y, z
+;
+loop_
+_symmetry_equiv_pos_as_xyz
+ 'x, y, z'            '-x, -y, z'           '-y+1/2, x+1/2, z+1/2' 'y+1/2, -x+1/2, z+1/2'
+ '-x+1/2, y+1/2, -z+1/2' 'x+1/2, -y+1/2, -z+1/2' 'y, x, -z'         '-y, -x, -z'
+ '-x, -y, -z'         'x, y, -z'            'y+1/2, -x+1/2, -z+1/2' '-y+1/2, x+1/2, -z+1/2'
+ 'x+1/2, -y+1/2, z+1/2' '-x+1/2, y+1/2, z+1/2' '-y, -x, z'          'y, x, z'
+loop_
+_atom_site_label
+_atom_site_type_symbol
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+_atom_site_U_iso_or_equiv
+Ti1 Ti4+ 0 0 0 0.0060(2)
+O1 O2- 0.3049(1) 0.3049(1) 0 ?
+"""
+
+def test_parse_cif():
+    structure = parse_cif(RUTILE)
+    assert str(structure['name']) == 'Rutile'
+    assert np.allclose(structure['lattice'], [4.5937, 4.5937, 2.9587, 90, 90, 90])
+    assert list(structure['types']) == ['Ti4+']*2 + ['O2-']*4 and list(structure['labels']) == ['Ti1']*2 + ['O1']*4
+    x = 0.3049
+    found = {tuple(np.round(i, 4)) for i in structure['xyz']}
+    assert found == {(0, 0, 0), (0.5, 0.5, 0.5), (x, x, 0), (1-x, 1-x, 0), (0.5+x, 0.5-x, 0.5), (0.5-x, 0.5+x, 0.5)}
+    assert np.allclose(structure['B'], [8*np.pi**2*0.006]*2 + [0]*4) and np.all(structure['occupancy'] == 1)
+    assert [element(i, Elements()) for i in list(structure['types'][[0, 2]]) + ['Ti9+']] == ['Ti4p', 'O2m', 'Ti'] # an ion which is not known is the neutral atom
+
+def test_errors():
+    with pytest.raises(ValueError):
+        parse_cif(RUTILE.replace('_cell_length_c 2.9587(2)', ''))
+    with pytest.raises(ValueError):
+        operation('x, y')
+    with pytest.raises(ValueError):
+        operation('x, y, w')
+    R, t = operation('-y+1/2, x-z, 0.25+z')
+    assert np.array_equal(R, [[0, -1, 0], [1, 0, -1], [0, 0, 1]]) and np.array_equal(t, [0.5, 0, 0.25])
+
+def test_cached_copy(tmp_path, monkeypatch):
+    filename = str(tmp_path/'TiO2.cif')
+    with open(filename, 'w') as f: f.write(RUTILE)
+    structure = read_cif(filename)
+    assert os.path.isfile(filename + '.npz')
+    def parse(text): raise AssertionError('the CIF was parsed again')
+    with monkeypatch.context() as m:
+        m.setattr(pxrd_cif, 'parse_cif', parse)
+        cached = read_cif(filename)
+    assert sorted(cached) == sorted(structure)
+    for i in structure: assert np.array_equal(cached[i], structure[i])
+    with open(filename, 'w') as f: f.write(RUTILE.replace('4.5937(1)', '4.6000'))
+    assert np.allclose(read_cif(filename)['lattice'][:2], 4.6) # a changed CIF is read again
@@ -0,0 +1,358 @@
+""" Tests of the PatternEngine and of the pieces of pxrd_engine: each vectorized calculation against a plain loop, what the graph recalculates, the symmetry 
+    (merged HKLs and absences) against a brute force sum over all HKLs, and calculate_lattices against calculate. Run with: python -m pytest tests """
+import os, subprocess, sys
+import numpy as np
+import pytest
+import xrayutilities as xu
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pxrd_engine import PatternEngine, Lattice, Symmetry, Elements, FormFactors, AtomTable, PatternCache, Graph, Cancelled
+
+def nacl():
+    fcc = np.array([[0, 0, 0], [0, 0.5, 0.5], [0.5, 0, 0.5], [0.5, 0.5, 0]])
+    return (5.64, 5.64, 5.64, 90, 90, 90), ['Na']*4 + ['Cl']*4, np.concatenate([fcc, (fcc + 0.5)%1]), None, None
+
+def zinc():
+    return (2.665, 2.665, 4.947, 90, 90, 120), ['Zn', 'Zn'], np.array([[1/3., 2/3., 0.25], [2/3., 1/3., 0.75]]), None, np.array([0.5, 0.5])
+
+def triclinic():
+    return (4.1, 5.3, 6.2, 81, 97, 104), ['Fe', 'O', 'O'], np.array([[0.1, 0.2, 0.3], [0.45, 0.15, 0.8], [0.7, 0.65, 0.05]]), np.array([1., 0.8, 1.]), np.array([0.3, 0.6, 0.6])
+
+def engine(structure, **kw):
+    lattice, types, xyz, occupancy, B = structure
+    e = PatternEngine(**kw)
+    e.set_lattice(*lattice)
+    e.set_atoms(types, xyz, occupancy, B)
+    return e
+
+def brute_force(structure, E = 8.048, D = 200., grid = (10., 90., 0.02), hkl_max = (4, 4, 4)):
+    """ the pattern summed over every HKL, with the form factors straight from xrayutilities and whole gaussians """
+    lattice, types, xyz, occupancy, B = structure
+    occupancy = np.ones(len(xyz)) if occupancy is None else occupancy
+    B = np.zeros(len(xyz)) if B is None else B
+    a, b, c, alpha, beta, gamma = lattice
+    ca, cb, cg = [np.cos(np.radians(i)) for i in (alpha, beta, gamma)]
+    G = np.array([[a*a, a*b*cg, a*c*cb], [a*b*cg, b*b, b*c*ca], [a*c*cb, b*c*ca, c*c]])
+    hkl = np.array([i for i in np.ndindex(*[2*m + 1 for m in hkl_max])]) - np.array(hkl_max)
+    hkl = hkl[np.any(hkl != 0, axis = 1)]
+    Q = 2*np.pi*np.sqrt(np.einsum('ni,ij,nj->n', hkl, np.linalg.inv(G), hkl))
+    wvl = 12.398/E
+    tth = np.degrees(2*np.arcsin(np.minimum(Q*wvl/(4*np.pi), 1)))
+    inside = (tth > grid[0]) & (tth < grid[1])
+    hkl, Q, tth = hkl[inside], Q[inside], tth[inside]
+    F = np.zeros(len(hkl), dtype = complex)
+    for t, r, o, b in zip(types, xyz, occupancy, B):
+        atom = getattr(xu.materials.elements, t)
+        f = atom.f0(Q) + atom.f1(E*1000) + 1j*atom.f2(E*1000)
+        F += o*np.exp(-b*(Q/(4*np.pi))**2)*f*np.exp(-2j*np.pi*np.dot(hkl, r))
+    w = np.degrees(2*0.9*wvl/(2.355*D*np.cos(np.radians(tth/2))))
+    x = np.arange(*grid)
+    return x, np.sum(np.abs(F)**2/Q**2/(np.sqrt(2*np.pi)*w)*np.exp(-(x[:, None] - tth)**2/(2*w*w)), axis = 1)
+
+def test_atom_table():
+    atoms = AtomTable()
+    atoms.append(['Na', 'Cl'], [[0, 0, 0], [0.5, 0.5, 0.5]], color = ['#bbbb88', '#77aadd'])
+    atoms.append(['O']*30, np.full((30, 3), 0.25), occupancy = 0.5, B = np.arange(30.))
+    assert len(atoms) == 32 and atoms.elements == ['Na', 'Cl', 'O']
+    assert atoms.types() == ['Na', 'Cl'] + ['O']*30
+    atoms.set(5, 'element', 'Cl')
+    atoms.set(5, 'y', 0.75)
+    atoms.set(5, 'B', 2.)
+    assert (atoms.get(5, 'element'), atoms.get(5, 'y'), atoms.get(5, 'B'), atoms.get(5, 'occupancy'), atoms.get(0, 'color')) == ('Cl', 0.75, 2., 0.5, '#bbbb88')
+    atoms.remove([1, 2, 31])
+    assert len(atoms) == 29 and atoms.types()[:4] == ['Na', 'O', 'O', 'Cl'] and atoms.xyz.shape == (29, 3) and atoms.B[3] == 2.
+    e = engine(((8., 8., 8., 90, 90, 90), atoms.types(), atoms.xyz, atoms.occupancy, atoms.B))
+    assert e.calculate()[1].max() > 0
+
+@pytest.mark.parametrize('structure, laue', [(nacl, 'm-3m'), (zinc, '6/mmm'), (triclinic, '-1')])
+def test_brute_force(structure, laue):
+    e = engine(structure())
+    tth, intensity = e.calculate()
+    x, reference = brute_force(structure())
+    assert e.symmetry.name == laue
+    assert np.allclose(tth, x)
+    assert np.abs(intensity - reference).max() < 1e-3*reference.max()
+
+@pytest.mark.parametrize('structure, laue', [(nacl, 'm-3m'), (zinc, '6/mmm')])
+def test_merged_HKLs(structure, laue):
+    e = engine(structure(), laue = laue, extinctions = 'none')
+    hkl, multiplicity, friedel = e.get('merged')
+    assert multiplicity.sum() == len(e.get('hkl'))
+    assert len(hkl) < len(e.get('hkl'))/4
+    assert np.allclose(e.calculate()[1], engine(structure(), laue = 'none', extinctions = 'none').calculate()[1])
+
+def test_absences():
+    e = engine(nacl())
+    hkl = e.get('merged')[0]
+    assert np.all((hkl%2 == hkl[:, :1]%2).all(axis = 1)) # F centering: h, k, l all even or all odd
+    e = engine(zinc())
+    hkl = e.get('merged')[0]
+    assert not np.any((hkl[:, 0] == 0) & (hkl[:, 1] == 0) & (hkl[:, 2]%2 == 1)) # 6_3 screw axis: 00l with l odd
+    for extinctions in ['none', 'P']:
+        e.set_extinctions(extinctions)
+        hkl = e.get('merged')[0]
+        assert np.any((hkl[:, 0] == 0) & (hkl[:, 1] == 0) & (hkl[:, 2]%2 == 1))
+    with pytest.raises(ValueError): # only centerings can be given, glides and screws are found with 'auto'
+        e.set_extinctions('P6_3')
+
+def test_Q_of_the_whole_list():
+    lattice = Lattice()
+    assert lattice.set_parameters(*triclinic()[0])
+    assert not lattice.set_parameters(*triclinic()[0])
+    hkl = PatternEngine().hkl((3, 3, 3))
+    a, b, c = lattice.M.T
+    V = np.dot(a, np.cross(b, c))
+    reference = [2*np.pi*np.linalg.norm((h*np.cross(b, c) + k*np.cross(c, a) + l*np.cross(a, b))/V) for h, k, l in hkl]
+    assert np.allclose(lattice.Q(hkl), reference)
+    assert np.isclose(lattice.Q(hkl[5]), reference[5])
+
+def test_cartesian():
+    lattice = Lattice()
+    a, b, c, alpha, beta, gamma = triclinic()[0]
+    lattice.set_parameters(a, b, c, alpha, beta, gamma)
+    va, vb, vc = lattice.cartesian(np.eye(3))
+    assert np.allclose([np.linalg.norm(va), np.linalg.norm(vb), np.linalg.norm(vc)], [a, b, c])
+    angle = lambda u, v: np.degrees(np.arccos(np.dot(u, v)/np.linalg.norm(u)/np.linalg.norm(v)))
+    assert np.allclose([angle(vb, vc), angle(va, vc), angle(va, vb)], [alpha, beta, gamma])
+    xyz = np.random.default_rng(0).random((4, 5, 3))
+    assert np.allclose(lattice.cartesian(xyz), [[x*va + y*vb + z*vc for x, y, z in i] for i in xyz])
+
+def test_structure_factor_kernel():
+    lattice, types, xyz, occupancy, B = triclinic()
+    e = engine(triclinic())
+    hkl, multiplicity, Q = e.get('used')
+    F, F_minus = e.get('F')
+    tables = e.form_factor_tables
+    for i in range(len(hkl)):
+        f = [o*np.exp(-b*(Q[i]/(4*np.pi))**2)*tables.f(t, Q[i:i+1], 8.048)[0] for t, o, b in zip(types, occupancy, B)]
+        assert np.isclose(F[i], sum(fj*np.exp(-2j*np.pi*np.dot(hkl[i], r)) for fj, r in zip(f, xyz)))
+        assert np.isclose(F_minus[i], sum(fj*np.exp(2j*np.pi*np.dot(hkl[i], r)) for fj, r in zip(f, xyz)))
+
+@pytest.mark.parametrize('peak_tol', [1e-2, 1e-6])
+def test_windowed_peaks(peak_tol):
+    rng = np.random.default_rng(3)
+    x = np.arange(10., 90., 0.02)
+    tth, w, weights = rng.uniform(5, 95, 200), rng.uniform(0.01, 2, 200), rng.uniform(0, 10, 200) # some peaks outside of the grid, and some wider than their distance to the edge
+    reference = np.sum(weights/(np.sqrt(2*np.pi)*w)*np.exp(-(x[:, None] - tth)**2/(2*w*w)), axis = 1)
+    intensity = PatternEngine().gaussians(x, 0.02, tth, w, weights, peak_tol)
+    assert np.all(intensity <= reference + 1e-12)
+    assert np.all(reference - intensity <= peak_tol*np.sum(weights/(np.sqrt(2*np.pi)*w)))
+
+def test_elements():
+    elements = Elements()
+    assert [elements.name(i) for i in ['fe', 'Fe3+', 'O2-', 'Fe3p', 'Cu1+', 'cl']] == ['Fe', 'Fe3p', 'O2m', 'Fe3p', 'Cu1p', 'Cl']
+    assert elements.get('Fe3+') is elements.get('Fe3p')
+    assert elements.get('fe').atom is xu.materials.elements.Fe and elements.get('Fe').Z == 26
+    for symbol in ['Xx', 'Fe9+', 'energy']:
+        with pytest.raises(KeyError):
+            elements.get(symbol)
+    with pytest.raises(KeyError):
+        engine(((5, 5, 5, 90, 90, 90), ['Xx'], [[0, 0, 0]], None, None))
+
+@pytest.mark.parametrize('element', ['O', 'Fe', 'Fe3+', 'Ba'])
+def test_form_factor_tables(element):
+    tables = FormFactors(Elements(), 5., 25.)
+    atom = Elements().get(element).atom
+    Q = np.linspace(0., 12., 500)
+    assert np.allclose(tables.f0(element, Q), atom.f0(Q), atol = 1e-3)
+    for E in [6.5, 8.048, 17.48, 30.]: # 30 keV is outside of the tables, which are widened
+        assert np.isclose(tables.dispersion(element, E), atom.f1(E*1000) + 1j*atom.f2(E*1000), atol = 2e-2)
+    assert list(tables.f0_tables) == [element] and tables.E_range == (5., 30.)
+
+def test_headless():
+    code = 'import sys, pxrd_engine; print("PyQt5" in sys.modules)'
+    out = subprocess.run([sys.executable, '-c', code], cwd = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'), capture_output = True, text = True, check = True).stdout
+    assert out.strip() == "False"
+    e = engine(zinc(), D = 150., tth_min = 20., tth_max = 100., tth_step = 0.05)
+    other = PatternEngine()
+    other.set_state(e.state())
+    assert np.array_equal(other.calculate()[1], e.calculate()[1])
+
+@pytest.mark.parametrize('centering, allowed', [('P', lambda h, k, l: True), ('A', lambda h, k, l: (k + l)%2 == 0), ('B', lambda h, k, l: (h + l)%2 == 0), 
+                                                ('C', lambda h, k, l: (h + k)%2 == 0), ('I', lambda h, k, l: (h + k + l)%2 == 0), 
+                                                ('F', lambda h, k, l: h%2 == k%2 == l%2), ('R', lambda h, k, l: (-h + k + l)%3 == 0)])
+def test_centering_absences(centering, allowed):
+    e = engine(triclinic(), laue = 'none', extinctions = centering)
+    hkl = e.get('hkl')
+    kept = {tuple(i) for i in e.get('merged')[0]}
+    assert kept == {tuple(i) for i in hkl if allowed(*i)}
+
+def test_absent_HKLs_do_not_change_the_pattern():
+    intensity = engine(nacl(), extinctions = 'F').calculate()[1]
+    assert np.allclose(intensity, engine(nacl(), extinctions = 'none').calculate()[1], rtol = 0, atol = 1e-9*intensity.max())
+
+def calls(e):
+    return dict(e.graph.calls)
+
+def recalculated(e, before):
+    return {i for i in e.graph.calls if e.graph.calls[i] != before[i]}
+
+def test_graph():
+    g = Graph()
+    g.input('x', 3)
+    g.input('y', np.arange(3))
+    g.node('sign', np.sign, ['x'])
+    g.node('z', lambda sign, y: sign*y, ['sign', 'y'])
+    assert np.array_equal(g.get('z'), [0, 1, 2])
+    assert not g.set('x', 3) and not g.set('y', np.arange(3))
+    assert g.downstream('x') == {'sign', 'z'}
+    assert g.set('x', 5)
+    assert np.array_equal(g.get('z'), [0, 1, 2])
+    assert g.calls == {'sign': 2, 'z': 1} # the sign did not change, so z was not calculated again
+    g.set('x', -1)
+    assert np.array_equal(g.get('z'), [0, -1, -2])
+    assert g.calls == {'sign': 3, 'z': 2}
+
+def test_size_recalculates_only_the_profile():
+    e = engine(triclinic())
+    e.calculate()
+    before = calls(e)
+    e.set_size(100.)
+    tth, intensity = e.calculate()
+    assert recalculated(e, before) == {'widths', 'profile'}
+    assert np.array_equal(intensity, engine(triclinic(), D = 100.).calculate()[1])
+
+def test_positions_update_F_incrementally():
+    e = engine(triclinic())
+    e.calculate()
+    lattice, types, xyz, occupancy, B = triclinic()
+    xyz = xyz.copy()
+    xyz[1, 0] += 0.01
+    updates = e.F_updates
+    before = calls(e)
+    e.set_atoms(types, xyz, occupancy, B)
+    tth, intensity = e.calculate()
+    assert 'F' in recalculated(e, before)
+    assert not recalculated(e, before) & {'Q', 'used', 'f0', 'dispersion', 'scale', 'widths'}
+    assert e.F_updates == updates + 1
+    reference = engine((lattice, types, xyz, occupancy, B)).calculate()[1]
+    assert np.abs(intensity - reference).max() < 1e-10*reference.max()
+
+def test_F_is_recalculated_from_scratch_after_F_refresh_updates():
+    e = engine(triclinic())
+    e.calculate()
+    e.F_refresh = 3
+    lattice, types, xyz, occupancy, B = triclinic()
+    updates = []
+    for i in range(5):
+        xyz = xyz.copy()
+        xyz[2, 1] += 0.01
+        e.set_atoms(types, xyz, occupancy, B)
+        e.calculate()
+        updates.append(e.F_updates)
+    assert updates == [1, 2, 3, 0, 1]
+    assert np.allclose(e.get('F')[0], engine((lattice, types, xyz, occupancy, B)).get('F')[0])
+
+def test_frozen_symmetry():
+    e = engine(nacl())
+    e.calculate()
+    lattice, types, xyz, occupancy, B = nacl()
+    xyz = xyz.copy()
+    xyz[1, 0] += 0.01
+    e.freeze_symmetry(True)
+    before = calls(e)
+    e.set_atoms(types, xyz)
+    e.calculate()
+    assert 'merged' not in recalculated(e, before)
+    assert e.freeze_symmetry(False)
+    tth, intensity = e.calculate()
+    assert e.symmetry.name != 'm-3m'
+    reference = engine((lattice, types, xyz, occupancy, B)).calculate()[1]
+    assert np.abs(intensity - reference).max() < 1e-10*reference.max()
+
+def random_cell(n):
+    rng = np.random.default_rng(n)
+    return (10., 10., 10., 90, 90, 90), (['Na', 'Cl', 'O', 'Fe']*n)[:n], rng.random((n, 3)), None, None
+
+def move_one_atom(e, structure):
+    """ moves the first atom a little. Returns the nodes recalculated, the number of incremental updates of F and the structure moved """
+    lattice, types, xyz, occupancy, B = structure
+    xyz = xyz.copy()
+    xyz[0, 0] += 0.001
+    before, updates = calls(e), e.F_updates
+    e.set_atoms(types, xyz)
+    e.calculate()
+    return recalculated(e, before), e.F_updates - updates, (lattice, types, xyz, occupancy, B)
+
+@pytest.mark.parametrize('n', [2, 50])
+def test_one_atom_move_does_not_depend_on_the_number_of_atoms(n):
+    e = engine(random_cell(n), hkl_max = (8, 8, 8))
+    e.calculate()
+    structure = random_cell(n)
+    for frozen, searched in [(True, set()), (False, {'merged'})]: # without freezing, the symmetry is searched again (and found the same) for each move, as a script does
+        e.freeze_symmetry(frozen)
+        e.calculate()
+        nodes, updates, structure = move_one_atom(e, structure)
+        assert nodes == {'F', 'F2', 'weights', 'profile'} | searched
+        assert updates == 1
+        assert np.allclose(e.calculate()[1], engine(structure, hkl_max = (8, 8, 8)).calculate()[1])
+
+def test_interrupt():
+    e = engine(triclinic())
+    e.calculate()
+    e.graph.interrupt = lambda: True
+    e.set_size(100.)
+    with pytest.raises(Cancelled):
+        e.calculate()
+    e.graph.interrupt = None
+    reference = engine(triclinic(), D = 100.).calculate()[1]
+    assert np.array_equal(e.calculate()[1], reference)
+
+def test_interrupt_in_the_symmetry_search():
+    Symmetry.detected.clear() # the operations of NaCl may be known from the other tests
+    e = engine(nacl())
+    checks = []
+    def interrupt(): # the graph checks once before 'merged', then the search before each operation
+        if e.graph.dirty.isdisjoint({'hkl', 'metric'}): checks.append(1)
+        return len(checks) == 2
+    e.graph.interrupt = interrupt
+    with pytest.raises(Cancelled):
+        e.calculate()
+    assert e.symmetry.key is None
+    e.graph.interrupt = None
+    assert e.calculate()[1].max() > 0
+    assert e.symmetry.name == 'm-3m'
+
+@pytest.mark.parametrize('structure', [nacl, zinc, triclinic])
+def test_calculate_lattices(structure):
+    e = engine(structure())
+    lattice = np.array(structure()[0], dtype = float)
+    lattices = lattice*np.array([[1, 1, 1, 1, 1, 1], [1.02, 1, 1, 1, 1, 1], [1, 0.98, 1.01, 1, 1, 1]])
+    tth, intensities = e.calculate_lattices(lattices)
+    for parameters, intensity in zip(lattices, intensities):
+        reference = engine((tuple(parameters),) + structure()[1:]).calculate()[1]
+        assert np.abs(intensity - reference).max() < 1e-10*reference.max()
+
+def test_calculate_lattices_with_energies_and_sizes():
+    e = engine(zinc())
+    lattice = np.array(zinc()[0], dtype = float)
+    lattices = np.array([lattice, lattice*1.01, lattice, [0, 2.665, 4.947, 90, 90, 120]]) # the last one has no volume
+    energies, sizes = [8.048, 17.48, 6.93, 8.048], [200., 80., 500., 200.]
+    tth, intensities = e.calculate_lattices(lattices, energies, sizes, memory = 2**16) # a little memory, so the lattices are done in several chunks
+    for parameters, E, D, intensity in zip(lattices[:3], energies, sizes, intensities):
+        reference = engine((tuple(parameters),) + zinc()[1:], E = E, D = D).calculate()[1]
+        assert np.abs(intensity - reference).max() < 1e-10*reference.max()
+    assert not intensities[3].any()
+    assert e.get('lattice') == tuple(lattice) and e.graph.values['energy'] == 8.048 # the engine is not changed
+
+def test_pattern_cache():
+    e = engine(nacl())
+    keys, patterns = [], []
+    for a in [5.5, 5.6, 5.7]:
+        e.set_lattice(a, a, a, 90, 90, 90)
+        keys.append(PatternCache().key(e.state()))
+        patterns.append(e.calculate())
+    e.set_lattice(5.5, 5.5, 5.5, 90, 90, 90)
+    assert PatternCache().key(e.state()) == keys[0] and len(set(keys)) == 3
+    size = PatternCache().nbytes(keys[0]) + 2*patterns[0][1].nbytes
+    cache = PatternCache(int(2.5*size)) # room for two patterns
+    cache.put(keys[0], *patterns[0])
+    cache.put(keys[1], *patterns[1])
+    assert cache.get(keys[0])[1] is patterns[0][1] # now the one used last
+    cache.put(keys[2], *patterns[2])
+    assert keys[1] not in cache and keys[0] in cache and keys[2] in cache and len(cache) == 2
+    assert cache.get(keys[1]) is None and (cache.hits, cache.misses) == (1, 1) # 'in' does not count
+    cache.set_limit(size)
+    assert list(cache.entries) == [keys[2]] and cache.size == size
+    cache.set_limit(size//2)
+    cache.put(keys[0], *patterns[0]) # larger than the whole cache
+    assert len(cache) == 0 and cache.size == 0
@@ -0,0 +1,238 @@
+""" Tests of the threads and of the main window of XRDplayground, on the offscreen platform of Qt. They are skipped without PyQt5. Run with: python -m pytest tests """
+import os, sys, time
+import numpy as np
+import pytest
+pytest.importorskip('PyQt5')
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from PyQt5.QtWidgets import QApplication
+import XRDplayground as X
+from pxrd_engine import PatternEngine, Cancelled
+from test_engine import nacl, engine
+
+@pytest.fixture(scope = 'module')
+def app():
+    return QApplication.instance() or QApplication(sys.argv)
+
+def wait(app, done, timeout = 60.):
+    """ processes the events of Qt, where the signals of the threads arrive, until done() """
+    end = time.perf_counter() + timeout
+    while not done():
+        assert time.perf_counter() < end
+        app.processEvents()
+        time.sleep(0.002)
+
+@pytest.fixture(scope = 'module')
+def window(app, tmp_path_factory):
+    """ a main window with NaCl, started in a folder with the default pxrd.defaults """
+    folder = os.getcwd()
+    os.chdir(str(tmp_path_factory.mktemp('window')))
+    choice = X.random.choice
+    X.random.choice = lambda structures: 'NaCl'
+    try:
+        default = X.Defaults()
+        default.createDefault()
+        X.a = X.Icons()
+        w = X.Window(default)
+        w.show()
+        settle(app, w)
+        yield w
+        w.close()
+    finally:
+        X.random.choice = choice
+        os.chdir(folder)
+
+def settle(app, w):
+    """ runs the pending changes and waits for the pattern """
+    w.flush()
+    wait(app, w.worker.idle)
+    app.processEvents()
+
+def states(values):
+    """ the states of an engine with NaCl for each value of a """
+    e = engine(nacl())
+    out = []
+    for a in values:
+        e.set_lattice(a, a, a, 90, 90, 90)
+        out.append(e.state())
+    return out
+
+def test_worker_latest_request_wins(app):
+    worker = X.PatternWorker(PatternEngine(), PatternEngine())
+    results = []
+    worker.calculated.connect(lambda generation, tth, intensity: results.append((generation, intensity)))
+    for state in states(np.linspace(5.5, 5.9, 10)): generation = worker.request(state) # all requests arrive before the thread starts: only the last one is calculated
+    assert worker.newer() and not worker.idle()
+    e = worker.engines[False]
+    e.set_state(states([5.2])[0])
+    with pytest.raises(Cancelled): # a calculation is abandoned while a newer request waits
+        e.calculate()
+    worker.start()
+    try:
+        wait(app, lambda: results)
+    finally:
+        worker.stop()
+    assert [i[0] for i in results] == [generation] and worker.idle()
+    assert np.array_equal(results[0][1], engine(((5.9, 5.9, 5.9, 90, 90, 90),) + nacl()[1:]).calculate()[1])
+    worker.skip()
+    assert worker.idle() and worker.newer()
+
+def test_slider_changes_are_coalesced(app, window):
+    w = window
+    fps, generation = w.fps, w.worker.generation
+    w.set_fps(1.)
+    for a in [5.70, 5.71, 5.72, 5.73]: w.LatticeParams_slider['a'].setValue(a)
+    assert w.pending_changes == {'lattice'} and w.redraw_timer.isActive() and w.worker.generation == generation
+    w.flush()
+    assert w.worker.generation == generation + 1 and not w.pending_changes and not w.redraw_timer.isActive()
+    settle(app, w)
+    w.set_fps(fps)
+    assert w.engine.get('lattice')[0] == 5.73
+
+def test_drafts_while_dragging(app, window):
+    w = window
+    w.slider_pressed()
+    w.LatticeParams_slider['a'].setValue(5.8)
+    settle(app, w)
+    assert w.engine.frozen
+    draft = w.draft_state()
+    assert len(w.intensity) == len(np.arange(*draft['grid'])) < len(np.arange(*w.engine.state()['grid']))
+    other = PatternEngine()
+    other.set_state(draft)
+    assert np.allclose(w.intensity, other.calculate()[1])
+    w.slider_released()
+    settle(app, w)
+    assert not w.engine.frozen
+    other.set_state(w.engine.state())
+    assert np.allclose(w.intensity, other.calculate()[1])
+
+def test_unit_cell_artists_are_kept(app, window):
+    w = window
+    artists = list(w.Crystalax.collections)
+    assert w.verts in artists and w.scatter in artists and w.hkl_planes in artists
+    n = len(w.atoms) - 1 # the atom at the origin is drawn at the corners
+    for extended, points in [(True, 27 + 8*n), (False, 8 + n)]:
+        w.Extended_cells_check.setChecked(extended)
+        w.LatticeParams_slider['c'].setValue(6.0 if extended else 5.64)
+        w.update('lattice', 'view')
+        settle(app, w)
+        assert list(w.Crystalax.collections) == artists
+        assert len(w.scatter._offsets3d[0]) == points
+
+def test_pattern_is_blitted(app, window):
+    w = window
+    draws, blits = [], []
+    connection = w.XPDcanvas.mpl_connect('draw_event', lambda event: draws.append(1))
+    blit = w.XPDcanvas.blit
+    w.XPDcanvas.blit = lambda bbox = None: (blits.append(1), blit(bbox))
+    try:
+        w.rescale()
+        app.processEvents()
+        assert len(draws) == 1 and w.XPDbackground is not None
+        w.LatticeParams_slider['a'].setValue(5.5)
+        w.update('lattice')
+        settle(app, w)
+        assert len(draws) == 1 and len(blits) >= 1 # only the animated artists were drawn again, over the copy of the figure
+        assert np.array_equal(w.main_plot.get_ydata(), w.intensity)
+        w.pXRDax.set_xlim(20, 60) # the copy is not valid anymore
+        w.blit_pXRD()
+        wait(app, lambda: len(draws) == 2)
+    finally:
+        del w.XPDcanvas.blit
+        w.XPDcanvas.mpl_disconnect(connection)
+        w.define_pXRDax_limits()
+
+@pytest.mark.parametrize('hkl, sizes', [((1, 1, 1), [3, 3]), ((2, 0, 0), [4, 4, 4]), ((1, -2, 3), None)])
+def test_HKL_planes(window, hkl, sizes):
+    polygons = window.clip_HKL_planes(*hkl)
+    assert window.clip_HKL_planes(*hkl) is polygons
+    if sizes is not None: assert [len(i) for i in polygons] == sizes
+    for i, polygon in enumerate(polygons):
+        assert np.all((polygon > -1e-12) & (polygon < 1 + 1e-12)) # clipped to the cell
+        d = polygon @ np.array(hkl)
+        assert np.allclose(d, np.rint(d[0])) # on one plane of the family
+        if i: assert np.rint(d[0]) == np.rint((polygons[i-1] @ np.array(hkl))[0]) + 1
+
+def test_atom_table_model(app, window):
+    w = window
+    model, n = w.atoms_model, len(w.atoms)
+    rejected = []
+    model.rejected.connect(lambda header, text: rejected.append(text))
+    for i in range(12): w.add_Atom() # more than the 10 atoms there used to be room for
+    assert model.rowCount() == len(w.atoms) == n + 12
+    assert model.setData(model.index(n + 3, 0), 'fe3+') and w.atoms.get(n + 3, 'element') == 'Fe3p'
+    assert not model.setData(model.index(n + 3, 1), '1.5') and not model.setData(model.index(n + 3, 0), 'Xx')
+    assert rejected == ['1.5', 'Xx']
+    assert not model.flags(model.index(0, 1)) & X.Qt.ItemIsEditable # the first atom stays at the origin
+    settle(app, w)
+    assert len(w.engine.get('types')) == n + 12 and w.engine.get('types')[n + 3] == 'Fe3p'
+    model.remove(range(n, n + 12))
+    settle(app, w)
+    assert len(w.atoms) == n and len(w.engine.get('types')) == n
+
+def test_read_CIF(app, window, tmp_path):
+    from test_cif import RUTILE
+    w = window
+    lattice = [w.LatticeParams_slider[i].value() for i in w.LatticeParams]
+    atoms = (w.atoms.types(), w.atoms.xyz.copy(), w.atoms.occupancy.copy(), w.atoms.B.copy(), w.atoms.size.copy(), w.atoms.color.copy())
+    filename = str(tmp_path/'TiO2.cif')
+    with open(filename, 'w') as f: f.write(RUTILE)
+    try:
+        w.read_CIF(filename)
+        settle(app, w)
+        assert w.atoms.types() == ['Ti4p']*2 + ['O2m']*4 and np.all(w.atoms.xyz[0] == 0)
+        assert np.allclose(w.engine.get('lattice'), [4.5937, 4.5937, 2.9587, 90, 90, 90], atol = 1e-3)
+        w.engine.get('merged')
+        assert w.engine.symmetry.name == '4/mmm'
+    finally:
+        w.set_lattice_values(lattice)
+        w.atoms_model.load(atoms[0], atoms[1], atoms[2], atoms[3], size = atoms[4], color = atoms[5])
+        settle(app, w)
+
+def test_patterns_come_from_the_cache(app, window):
+    w = window
+    for a in [5.80, 5.81, 5.80]:
+        hits = w.pattern_cache.hits
+        w.LatticeParams_slider['a'].setValue(a)
+        settle(app, w)
+    assert w.pattern_cache.hits == hits + 1 and w.worker.skipped == w.worker.generation # the last one was not calculated again
+    other = PatternEngine()
+    other.set_state(w.engine.state())
+    assert np.allclose(w.intensity, other.calculate()[1])
+
+def test_speculator(app):
+    speculator = X.Speculator(PatternEngine(), cpu = 1., chunk = 2)
+    results = []
+    speculator.calculated.connect(lambda generation, task, values, tth, intensities: results.append((generation, task, list(values), intensities)))
+    state = states([5.64])[0]
+    speculator.request([(state, 0, [5.6])])
+    speculator.cancel() # before the thread starts: nothing is calculated
+    speculator.start()
+    try:
+        generation = speculator.request([(state, 0, [5.6, 5.7, 5.8]), (state, 'size', [100.])])
+        wait(app, lambda: len(results) == 3)
+    finally:
+        speculator.stop()
+    assert [i[:3] for i in results] == [(generation, 0, [5.6, 5.7]), (generation, 0, [5.8]), (generation, 1, [100.])]
+    for lattice, size, intensity in [((5.6, 5.64, 5.64, 90, 90, 90), 200., results[0][3][0]), ((5.8, 5.64, 5.64, 90, 90, 90), 200., results[1][3][0]), ((5.64,)*3 + (90,)*3, 100., results[2][3][0])]:
+        reference = engine((lattice,) + nacl()[1:], D = size).calculate()[1]
+        assert np.abs(intensity - reference).max() < 1e-10*reference.max()
+
+def test_precomputed_slider_neighbours(app, window):
+    w = window
+    slider = w.LatticeParams_slider['a']
+    neighbours = w.slider_neighbours(slider, 2)
+    assert len(neighbours) == 4 and abs(neighbours[0] - slider.value()) <= abs(neighbours[-1] - slider.value())
+    precompute = w.precompute
+    w.set_precompute(2)
+    w.active_slider = slider
+    try:
+        w.speculate()
+        keys = [w.pattern_cache.key(w.speculation_state(w.engine.state(), 0, i)) for i in neighbours]
+        wait(app, lambda: all(i in w.pattern_cache for i in keys))
+    finally:
+        w.set_precompute(precompute)
+    hits = w.pattern_cache.hits
+    slider.setValue(neighbours[0])
+    settle(app, w)
+    assert w.pattern_cache.hits == hits + 1 # dragging the slider finds the pattern ready
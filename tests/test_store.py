@@ -0,0 +1,48 @@
+""" Tests of pxrd_store: sweeps written to a memory mapped store, and continued when interrupted. Run with: python -m pytest tests """
+import io, os, sys
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pxrd_store import SweepStore, create_store, sweep
+from test_engine import nacl, engine
+
+AXES = [('a', [5.5, 5.6, 5.7]), ('size', [100., 300.])]
+
+def test_sweep(tmp_path):
+    e = engine(nacl())
+    progress = []
+    store = sweep(e, str(tmp_path/'sweep'), AXES, chunk = 4, progress = lambda done, total: progress.append((done, total)))
+    assert progress == [(4, 6), (6, 6)] and len(store.missing()) == 0
+    store = SweepStore(str(tmp_path/'sweep'))
+    assert store.shape == (3, 2) and store.patterns.dtype == np.float32 and isinstance(store.patterns, np.memmap)
+    row = store.index(2, 0)
+    assert {i:list(j) for i, j in store.parameters([row]).items()} == {'a': [5.7], 'size': [100.]}
+    reference = engine(((5.7, 5.64, 5.64, 90, 90, 90),) + nacl()[1:], D = 100.).calculate()[1] # only a is swept
+    assert np.allclose(store.pattern(row), reference, rtol = 1e-6, atol = 1e-6*reference.max()) # kept as float32
+    assert np.array_equal(store.tth, e.get('tth_range'))
+
+def test_interrupted_sweep_continues(tmp_path):
+    e = engine(nacl())
+    folder = str(tmp_path/'sweep')
+    store = create_store(folder, AXES, e.get('tth_range'))
+    store.write([1, 4], np.ones((2, len(store.tth))))
+    assert list(store.missing()) == [0, 2, 3, 5]
+    progress = []
+    store = sweep(e, folder, AXES, progress = lambda done, total: progress.append((done, total)))
+    assert progress == [(6, 6)]
+    assert np.all(store.pattern(1) == 1) and not np.all(store.pattern(0) == 1) # the rows done before are not calculated again
+    with pytest.raises(ValueError):
+        create_store(folder, [('a', [5.5, 5.6])], e.get('tth_range'))
+    with pytest.raises(ValueError):
+        sweep(e, str(tmp_path/'other'), [('occupancy', [0.5, 1.])])
+
+def test_batch_to_a_store(tmp_path):
+    from pxrd_batch import run
+    from test_batch import manifest, cell
+    out = str(tmp_path/'candidates')
+    assert run(manifest(str(tmp_path), [cell('a', 5.5), cell('b', 5.6), cell('c', 5.7)]), out, workers = 2, stream = io.StringIO(), store = True) == []
+    store = SweepStore(out)
+    assert store.names == ['structure'] and list(store.values[0]) == ['a', 'b', 'c'] and len(store.missing()) == 0
+    structure = ((5.5, 5.5, 5.5, 90, 90, 90), ['Na', 'Cl'], [[0, 0, 0], [0.5, 0.5, 0.5]], None, None) # the atoms of cell()
+    _, patterns = engine(structure, tth_min = 10, tth_max = 90, tth_step = 0.05, hkl_max = (3, 3, 3)).calculate_lattices([[a, a, a, 90, 90, 90] for a in [5.5, 5.6, 5.7]])
+    assert np.allclose(store.patterns, patterns, rtol = 1e-5, atol = 1e-5*patterns.max())